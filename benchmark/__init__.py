@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the hot paths of martinellis: parsing and formatting addresses,
+network and set membership, and iteration. Every benchmark is timed against the
+equivalent operation in the standard library :py:mod:`ipaddress` module where one
+exists. Run the suite with::
+
+   python -m benchmark --output results.json
+
+and check a later run for regressions against a stored result with::
+
+   python -m benchmark --baseline results.json
+'''
+
+from benchmark.runner import BENCHMARKS, benchmark, compare, run
+
+__all__ = ['BENCHMARKS', 'benchmark', 'compare', 'run']
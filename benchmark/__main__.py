@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import sys
+
+from benchmark import cases, runner
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark'
+                                     ,description='Benchmark martinellis against the ipaddress module.')
+    parser.add_argument('--quick', action='store_true', help='run only the small size of each benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, keeping the fastest')
+    parser.add_argument('--filter', dest='pattern', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare the results against a stored JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before a regression, as a fraction')
+    options = parser.parse_args(args)
+
+    results = runner.run(quick=options.quick
+                         ,repeat=options.repeat
+                         ,pattern=options.pattern
+                         ,log=lambda line: sys.stdout.write(line + '\n'))
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as fp:
+            baseline = json.load(fp)
+
+        regressions = runner.compare(results, baseline, options.tolerance)
+
+        for name, size, previous, current in regressions:
+            sys.stdout.write('regression: %s[%s] %.1f ns/op -> %.1f ns/op\n' % (name, size, previous, current))
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+import ipaddress
+import itertools
+import os
+import random
+import tempfile
+
+from martinellis import V4Address, V6Address, V4CIDR, V6CIDR, CIDRSet, CIDRTable, formatter
+
+from benchmark.runner import benchmark
+
+SEED = 949
+'''The seed used to generate benchmark data, so every run times the same data.'''
+
+ADDRESS_COUNT = 10000
+'''The number of addresses used by the parsing, formatting and lookup benchmarks.'''
+
+def _v4_values(count, generator):
+    return [generator.getrandbits(32) for i in range(count)]
+
+def _v6_values(count, generator):
+    return [generator.getrandbits(128) for i in range(count)]
+
+def _v4_networks(count, generator):
+    networks = set()
+
+    while len(networks) < count:
+        prefix = generator.randint(8, 30)
+        networks.add((generator.getrandbits(32) >> (32 - prefix) << (32 - prefix), prefix))
+
+    return sorted(networks)
+
+@benchmark('parse.v4')
+def parse_v4(size):
+    strings = [str(ipaddress.IPv4Address(value)) for value in _v4_values(ADDRESS_COUNT, random.Random(SEED))]
+
+    def run():
+        for string in strings:
+            V4Address.from_string(string)
+
+    def baseline():
+        for string in strings:
+            ipaddress.IPv4Address(string)
+
+    return len(strings), run, baseline
+
+@benchmark('parse.v6')
+def parse_v6(size):
+    strings = [str(ipaddress.IPv6Address(value)) for value in _v6_values(ADDRESS_COUNT, random.Random(SEED))]
+
+    def run():
+        for string in strings:
+            V6Address.from_string(string)
+
+    def baseline():
+        for string in strings:
+            ipaddress.IPv6Address(string)
+
+    return len(strings), run, baseline
+
+@benchmark('format.v4')
+def format_v4(size):
+    values = _v4_values(ADDRESS_COUNT, random.Random(SEED))
+    addresses = [V4Address(value=value) for value in values]
+    stdlib_addresses = [ipaddress.IPv4Address(value) for value in values]
+
+    def run():
+        for address_obj in addresses:
+            str(address_obj)
+
+    def baseline():
+        for address_obj in stdlib_addresses:
+            str(address_obj)
+
+    return len(values), run, baseline
+
+@benchmark('format.v6')
+def format_v6(size):
+    values = _v6_values(ADDRESS_COUNT, random.Random(SEED))
+    addresses = [V6Address(value=value) for value in values]
+    stdlib_addresses = [ipaddress.IPv6Address(value) for value in values]
+
+    def run():
+        for address_obj in addresses:
+            str(address_obj)
+
+    def baseline():
+        for address_obj in stdlib_addresses:
+            str(address_obj)
+
+    return len(values), run, baseline
+
+@benchmark('format.v4.batch')
+def format_v4_batch(size):
+    values = _v4_values(ADDRESS_COUNT, random.Random(SEED))
+    stdlib_addresses = [ipaddress.IPv4Address(value) for value in values]
+    formatter.format_v4(values[:1])
+
+    def run():
+        formatter.write(bytearray(), values, bitmax=32)
+
+    def baseline():
+        b'\n'.join([str(address_obj).encode('ascii') for address_obj in stdlib_addresses])
+
+    return len(values), run, baseline
+
+@benchmark('format.v6.batch')
+def format_v6_batch(size):
+    values = _v6_values(ADDRESS_COUNT, random.Random(SEED))
+    stdlib_addresses = [ipaddress.IPv6Address(value) for value in values]
+
+    def run():
+        formatter.write(bytearray(), values, bitmax=128)
+
+    def baseline():
+        b'\n'.join([str(address_obj).encode('ascii') for address_obj in stdlib_addresses])
+
+    return len(values), run, baseline
+
+@benchmark('cidr.has_address')
+def cidr_has_address(size):
+    values = _v4_values(ADDRESS_COUNT, random.Random(SEED))
+    network = V4CIDR(cidr='128.0.0.0/2')
+    stdlib_network = ipaddress.IPv4Network(u'128.0.0.0/2')
+    addresses = [V4Address(value=value) for value in values]
+    stdlib_addresses = [ipaddress.IPv4Address(value) for value in values]
+
+    def run():
+        for address_obj in addresses:
+            network.has_address(address_obj)
+
+    def baseline():
+        for address_obj in stdlib_addresses:
+            address_obj in stdlib_network
+
+    return len(values), run, baseline
+
+@benchmark('cidrset.has_address', sizes=(100, 1000, 10000, 100000, 1000000), quick_sizes=(100, 1000))
+def cidrset_has_address(size):
+    generator = random.Random(SEED)
+    networks = _v4_networks(size, generator)
+    lookups = max(1, 100000 // size)
+    values = _v4_values(lookups, generator)
+    cidr_set = CIDRSet(*[V4CIDR(address=V4Address(value=value), prefix=prefix) for value, prefix in networks])
+    stdlib_networks = [ipaddress.IPv4Network((value, prefix)) for value, prefix in networks]
+    addresses = [V4Address(value=value) for value in values]
+    stdlib_addresses = [ipaddress.IPv4Address(value) for value in values]
+
+    def run():
+        for address_obj in addresses:
+            cidr_set.has_address(address_obj)
+
+    def baseline():
+        for address_obj in stdlib_addresses:
+            any(address_obj in network for network in stdlib_networks)
+
+    return lookups, run, baseline
+
+@benchmark('table.has_address', sizes=(1000, 1000000), quick_sizes=(1000,))
+def table_has_address(size):
+    generator = random.Random(SEED)
+    networks = _v4_networks(size, generator)
+    addresses = [V4Address(value=value) for value in _v4_values(ADDRESS_COUNT, generator)]
+    directory = tempfile.TemporaryDirectory()
+    filename = os.path.join(directory.name, 'table.tbl')
+
+    CIDRSet(*[V4CIDR(address=V4Address(value=value), prefix=prefix) for value, prefix in networks]).save(filename)
+    compiled = CIDRTable.load(filename)
+
+    def run():
+        for address_obj in addresses:
+            compiled.has_address(address_obj)
+
+    def teardown():
+        compiled.close()
+        directory.cleanup()
+
+    return len(addresses), run, None, teardown
+
+@benchmark('cidr.iter.sequential', sizes=(16,), quick_sizes=(20,))
+def cidr_iter_sequential(size):
+    network = V4CIDR(cidr='10.0.0.0/%d' % size)
+    stdlib_network = ipaddress.IPv4Network(u'10.0.0.0/%d' % size)
+
+    def run():
+        for address_obj in network:
+            pass
+
+    def baseline():
+        for address_obj in stdlib_network:
+            pass
+
+    return network.length(), run, baseline
+
+@benchmark('cidr.iter.random', sizes=(16,), quick_sizes=(20,))
+def cidr_iter_random(size):
+    network = V4CIDR(cidr='10.0.0.0/%d' % size, random=True, seed=SEED)
+
+    def run():
+        for address_obj in network:
+            pass
+
+    return network.length(), run, None
+
+@benchmark('cidr.iter_ints', sizes=(16,), quick_sizes=(20,))
+def cidr_iter_ints(size):
+    network = V4CIDR(cidr='10.0.0.0/%d' % size)
+
+    def run():
+        for value in network.iter_ints():
+            pass
+
+    return network.length(), run, None
+
+@benchmark('cidr.iter_chunks.random', sizes=(8,), quick_sizes=(16,))
+def cidr_iter_chunks_random(size):
+    network = V4CIDR(cidr='10.0.0.0/%d' % size, random=True, seed=SEED)
+
+    def run():
+        for chunk in network.iter_chunks(1 << 16, as_numpy=True):
+            pass
+
+    return network.length(), run, None
+
+@benchmark('cidrset.iter.sequential', sizes=(256,), quick_sizes=(16,))
+def cidrset_iter_sequential(size):
+    networks = ['10.%d.%d.0/24' % (index >> 8, index & 0xFF) for index in range(size)]
+    cidr_set = CIDRSet(*[V4CIDR(cidr=network) for network in networks], addresses=True)
+    stdlib_networks = [ipaddress.IPv4Network(network) for network in networks]
+
+    def run():
+        for address_obj in cidr_set:
+            pass
+
+    def baseline():
+        for address_obj in itertools.chain(*stdlib_networks):
+            pass
+
+    return size * 256, run, baseline
+
+@benchmark('cidrset.iter.random', sizes=(256,), quick_sizes=(16,))
+def cidrset_iter_random(size):
+    networks = ['10.%d.%d.0/24' % (index >> 8, index & 0xFF) for index in range(size)]
+    cidr_set = CIDRSet(*[V4CIDR(cidr=network) for network in networks], addresses=True, random=True, seed=SEED)
+
+    def run():
+        for address_obj in cidr_set:
+            pass
+
+    return size * 256, run, None
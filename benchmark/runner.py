@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import platform
+import time
+import timeit
+
+BENCHMARKS = list()
+'''Every benchmark registered with :py:func:`benchmark`, in registration order.'''
+
+class Benchmark(object):
+    '''
+A single registered benchmark. Its *setup* function takes a size and returns a
+tuple of the number of operations performed per run, the martinellis function to
+time, and the :py:mod:`ipaddress` function to time against it, or **None** if the
+standard library has no equivalent. The tuple can hold a fourth item, a function
+called once the benchmark is done to release what *setup* acquired, such as
+temporary files.'''
+
+    def __init__(self, name, setup, sizes, quick_sizes):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+        self.quick_sizes = quick_sizes
+
+def benchmark(name, sizes=(None,), quick_sizes=None):
+    '''Register the decorated setup function as a :py:class:`Benchmark` called
+*name*, run once for every size in *sizes*, or in *quick_sizes* for quick runs.'''
+
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name
+                                    ,setup
+                                    ,tuple(sizes)
+                                    ,tuple(sizes if quick_sizes is None else quick_sizes)))
+        return setup
+
+    return decorator
+
+def _time(function, ops, repeat):
+    best = min(timeit.Timer(function).repeat(repeat=repeat, number=1))
+
+    return {'seconds': best, 'ns_per_op': best * 1e9 / ops}
+
+def run(quick=False, repeat=3, pattern=None, log=None):
+    '''
+Run the registered benchmarks and return the results as a dictionary that can be
+written out as JSON. *quick* runs the smaller size of each benchmark, *repeat* is
+the number of timed runs of which the fastest is kept, and *pattern* restricts the
+run to benchmarks whose name contains it. *log* is called with a line of text as
+each benchmark finishes.'''
+
+    results = list()
+
+    for bench in BENCHMARKS:
+        if pattern is not None and not pattern in bench.name:
+            continue
+
+        for size in (bench.quick_sizes if quick else bench.sizes):
+            prepared = bench.setup(size)
+            ops, function, baseline = prepared[:3]
+            entry = {'name': bench.name, 'size': size, 'ops': ops}
+
+            try:
+                try:
+                    entry['martinellis'] = _time(function, ops, repeat)
+                except Exception as error:
+                    entry['error'] = '%s: %s' % (error.__class__.__name__, error)
+
+                if baseline is not None:
+                    entry['ipaddress'] = _time(baseline, ops, repeat)
+            finally:
+                if len(prepared) > 3:
+                    prepared[3]()
+
+            if 'martinellis' in entry and 'ipaddress' in entry:
+                entry['ratio'] = entry['martinellis']['seconds'] / entry['ipaddress']['seconds']
+
+            results.append(entry)
+
+            if log is not None:
+                log(format_entry(entry))
+
+    return {'timestamp': time.time()
+            ,'python': platform.python_version()
+            ,'implementation': platform.python_implementation()
+            ,'platform': platform.platform()
+            ,'quick': quick
+            ,'results': results}
+
+def format_entry(entry):
+    '''Format a single benchmark result as a line of text.'''
+
+    name = entry['name'] if entry['size'] is None else '%s[%d]' % (entry['name'], entry['size'])
+
+    if 'error' in entry:
+        return '%-40s error: %s' % (name, entry['error'])
+
+    line = '%-40s %12.1f ns/op' % (name, entry['martinellis']['ns_per_op'])
+
+    if 'ipaddress' in entry:
+        line += ' %12.1f ns/op ipaddress (x%.2f)' % (entry['ipaddress']['ns_per_op'], entry['ratio'])
+
+    return line
+
+def compare(results, baseline, tolerance=0.2):
+    '''
+Compare *results* from :py:func:`run` against a stored *baseline* run. Returns a
+list of *(name, size, baseline_ns, current_ns)* tuples for every benchmark that got
+more than *tolerance* slower per operation. Benchmarks missing from either run are
+skipped.'''
+
+    previous = dict()
+
+    for entry in baseline['results']:
+        if 'martinellis' in entry:
+            previous[(entry['name'], entry['size'])] = entry['martinellis']['ns_per_op']
+
+    regressions = list()
+
+    for entry in results['results']:
+        key = (entry['name'], entry['size'])
+
+        if not 'martinellis' in entry or not key in previous:
+            continue
+
+        current = entry['martinellis']['ns_per_op']
+
+        if current > previous[key] * (1 + tolerance):
+            regressions.append((entry['name'], entry['size'], previous[key], current))
+
+    return regressions
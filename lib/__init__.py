@@ -21,12 +21,28 @@ non-inclusive if it is.'''
         start += 1
 
 from martinellis import compat
+from martinellis import vector
 
 from martinellis import address
 from martinellis import cidr
+from martinellis import permutation
+from martinellis import table
+from martinellis import cidrmap
+from martinellis import iprange
+from martinellis import loader
+from martinellis import classify
+from martinellis import formatter
+from martinellis import pool
+from martinellis import stats
 
 from martinellis.address import *
 from martinellis.cidr import *
-
-__all__ = ['xlongrange', 'address', 'cidr', 'Address' ,'V4Address',
-           'V6Address', 'CIDR', 'V4CIDR', 'V6CIDR', 'CIDRSet']
+from martinellis.cidrmap import *
+from martinellis.iprange import *
+from martinellis.permutation import Permutation
+from martinellis.table import CIDRTable, TableHolder
+from martinellis.pool import AddressPool
+
+__all__ = ['xlongrange', 'address', 'cidr', 'Address' ,'V4Address', 'ParseCache',
+           'V6Address', 'CIDR', 'V4CIDR', 'V6CIDR', 'CIDRSet', 'cidrmap', 'CIDRMap',
+           'loader', 'permutation', 'Permutation', 'table', 'CIDRTable', 'TableHolder', 'iprange', 'IPRange', 'V4Range', 'V6Range', 'classify', 'formatter', 'pool', 'AddressPool', 'stats']
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+
+from martinellis import classify
+
+def _classify(options):
+    output = sys.stdout if options.output is None else open(options.output, 'wb')
+    output = getattr(output, 'buffer', output)
+
+    try:
+        classify.classify(options.networks
+                          ,options.logs
+                          ,output
+                          ,processes=options.processes
+                          ,chunk_size=options.chunk_size
+                          ,unmatched=options.unmatched)
+    finally:
+        if options.output is not None:
+            output.close()
+
+    return 0
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m martinellis'
+                                     ,description='Command line tools for martinellis.')
+    commands = parser.add_subparsers(dest='command')
+
+    classify_parser = commands.add_parser('classify', help='tag log lines with the label of the network of their addresses')
+    classify_parser.add_argument('networks', help='a file of networks and labels, one per line')
+    classify_parser.add_argument('logs', nargs='+', help='the log files to classify')
+    classify_parser.add_argument('--output', help='write the tagged lines to this file instead of stdout')
+    classify_parser.add_argument('--processes', type=int, help='number of worker processes, defaulting to one per CPU')
+    classify_parser.add_argument('--chunk-size', type=int, default=classify.CHUNK_SIZE, help='bytes of log handed to a worker at a time')
+    classify_parser.add_argument('--unmatched', default=classify.UNMATCHED, help='label for lines without a matching address')
+    classify_parser.set_defaults(run=_classify)
+
+    options = parser.parse_args(args)
+
+    if options.command is None:
+        parser.print_help()
+        return 2
+
+    return options.run(options)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
+import collections
 import socket
 import struct
+import threading
 
 from martinellis.compat import *
 
@@ -12,6 +14,82 @@ objects.'''
     
     pass
 
+class ParseCache(object):
+    '''
+A bounded least-recently-used cache of parsed objects keyed by the string they
+were parsed from. It's used by :py:func:`Address.blind_assertion` and
+:py:func:`martinellis.cidr.CIDR.blind_assertion` when assigned to their *CACHE*
+class variable::
+
+   >>> Address.CACHE = ParseCache(maxsize=4096)
+   >>> Address.blind_assertion('10.0.0.1')
+   V4Address(10.0.0.1)
+   >>> Address.blind_assertion('10.0.0.1')
+   V4Address(10.0.0.1)
+   >>> Address.CACHE.stats()
+   {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 4096}
+
+Cached objects are shared between callers, so they shouldn't be modified in
+place.'''
+
+    MAXSIZE = 4096
+    '''The default number of entries kept in the cache.'''
+
+    def __init__(self, maxsize=None):
+        self.maxsize = self.MAXSIZE if maxsize is None else maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.maxsize < 1:
+            raise AddressError('cache size must be positive')
+
+    def get(self, key):
+        '''Return the cached object for *key*, or **None** if it isn't cached.'''
+
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''Cache *value* under *key*, evicting the least recently used entry if
+the cache is full.'''
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''Empty the cache and reset its statistics.'''
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''Return a dictionary of the cache's hits, misses, current size and
+maximum size.'''
+
+        return {'hits': self.hits
+                ,'misses': self.misses
+                ,'size': len(self._entries)
+                ,'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._entries)
+
 class Address(object):
     '''
 This is the base class for handling IPv4 and IPv6 objects. It can handle arbitrary
@@ -25,13 +103,24 @@ implemented::
 
    class V4Address(Address):
        MAX = 32
+
+Arithmetic and bitwise operators always return new address objects, and so do
+their augmented forms: ``addr += 1`` rebinds *addr* rather than changing an
+address that may be shared, such as one held by a :py:class:`ParseCache` or
+another thread.
 '''
+
+    __slots__ = ('value', 'max')
     
     MAX = None
     '''The size of the integer, in bits, representing the IP address.'''
     
     VALUE = None
     '''The integer or string value of the IP address being represented.'''
+
+    CACHE = None
+    '''An optional :py:class:`ParseCache` of the addresses parsed by
+:py:func:`Address.blind_assertion`.'''
     
     def __init__(self, **kwargs):
         '''
@@ -61,13 +150,25 @@ Creates an address object. Keyword arguments are:
         elif not float(self.value).is_integer():
             raise AddressError('value must be an integer or string')
 
+    @classmethod
+    def _from_int(cls, value, bitmax=None):
+        '''Create an address object directly from a trusted integer *value*,
+skipping the validation done in :py:func:`Address.__init__`. This is used
+internally wherever the result is already known to be a valid integer, such as
+the results of the arithmetic operators.'''
+
+        address_obj = object.__new__(cls)
+        address_obj.value = value
+        address_obj.max = cls.MAX if bitmax is None else bitmax
+        return address_obj
+
     def __int__(self):
         '''Return the integer representation of the IP address.'''
         
         return self.value
     
     def __hash__(self):
-        return hash('%d/%d' % (self.value, self.max))
+        return hash((self.max, self.value))
 
     def __cmp__(self, other):
         if not isinstance(other, Address):
@@ -78,6 +179,44 @@ Creates an address object. Keyword arguments are:
 
         return cmp(self.value, other.value)
 
+    # addresses order by family first, so IPv4 addresses sort before IPv6
+    # addresses, then by value
+    def __eq__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+
+        return self.value == other.value and self.max == other.max
+
+    def __ne__(self, other):
+        if not isinstance(other, Address):
+            return NotImplemented
+
+        return not (self.value == other.value and self.max == other.max)
+
+    def __lt__(self, other):
+        if not isinstance(other, Address):
+            raise AddressError('comparative operation not possible with non-Address')
+
+        return (self.max, self.value) < (other.max, other.value)
+
+    def __le__(self, other):
+        if not isinstance(other, Address):
+            raise AddressError('comparative operation not possible with non-Address')
+
+        return (self.max, self.value) <= (other.max, other.value)
+
+    def __gt__(self, other):
+        if not isinstance(other, Address):
+            raise AddressError('comparative operation not possible with non-Address')
+
+        return (self.max, self.value) > (other.max, other.value)
+
+    def __ge__(self, other):
+        if not isinstance(other, Address):
+            raise AddressError('comparative operation not possible with non-Address')
+
+        return (self.max, self.value) >= (other.max, other.value)
+
     def __and__(self, other):
         '''
 Perform a binary AND operation on an IP address with either another
@@ -91,47 +230,35 @@ Perform a binary AND operation on an IP address with either another
 
 '''
 
-        if not isinstance(other, (Address, int, long)):
+        if isinstance(other, Address):
+            other = other.value
+        elif not isinstance(other, (int, long)):
             raise AddressError('and operation must be performed on another address or an int')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = int(other & self.value)
-        return self.__class__(**new_object)
+        return self._from_int(self.value & other, self.max)
 
     def __rand__(self, other):
         if not isinstance(other, (Address, int, long)):
             raise AddressError('and operation must be performed on another address or an int')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = int(self.value & other)
-        return self.__class__(**new_object)
-
-    def __iand__(self, other):
-        self.value = int(other & self)
-        return self
+        return self._from_int(int(other) & self.value, self.max)
 
     def __or__(self, other):
         '''Perform a binary OR operation on the address with an 
 :py:class:`Address` object or another integer.'''
         
-        if not isinstance(other, (Address, int, long)):
+        if isinstance(other, Address):
+            other = other.value
+        elif not isinstance(other, (int, long)):
             raise AddressError('or operation must be performed on another address or an int')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = int(other | self.value)
-        return self.__class__(**new_object)
+        return self._from_int(self.value | other, self.max)
 
     def __ror__(self, other):
         if not isinstance(other, (Address, int, long)):
             raise AddressError('and operation must be performed on another address or an int')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = int(self.value | other)
-        return self.__class__(**new_object)
-
-    def __ior__(self, other):
-        self.value = int(other | self)
-        return self
+        return self._from_int(int(other) | self.value, self.max)
 
     def __add__(self, other):
         '''
@@ -146,21 +273,13 @@ Add an integer to the given IP address. Example::
         if not isinstance(other, (int, long)):
             raise AddressError('address objects can only be added with int objects')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = self.value + other
-        return self.__class__(**new_object)
+        return self._from_int(self.value + other, self.max)
 
     def __radd__(self, other):
         if not isinstance(other, (int, long)):
             raise AddressError('address objects can only be added with int objects')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = other + self.value
-        return self.__class__(**new_object)
-
-    def __iadd__(self, other):
-        self.value = int(other + self)
-        return self
+        return self._from_int(other + self.value, self.max)
 
     def __sub__(self, other):
         '''
@@ -175,21 +294,13 @@ Subtract an integer from the given IP address. Example::
         if not isinstance(other, (int, long)):
             raise AddressError('address objects can only be subtracted by int objects')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = self.value - other
-        return self.__class__(**new_object)
+        return self._from_int(self.value - other, self.max)
 
     def __rsub__(self, other):
         if not isinstance(other, (int, long)):
             raise AddressError('address objects can only be subtracted by int objects')
 
-        new_object = dict(list(self.__dict__.items())[:])
-        new_object['value'] = other - self.value
-        return self.__class__(**new_object)
-
-    def __isub__(self, other):
-        self.value = int(self - other)
-        return self
+        return self._from_int(other - self.value, self.max)
 
     def __str__(self):
         '''Convert an :py:class:`Address` object into a string.'''
@@ -200,7 +311,13 @@ Subtract an integer from the given IP address. Example::
         return '%s(%s)' % (self.__class__.__name__, str(self))
 
     def __copy__(self):
-        return self.__class__(**self.__dict__)
+        return self._from_int(self.value, self.max)
+
+    def __getstate__(self):
+        return (self.value, self.max)
+
+    def __setstate__(self, state):
+        self.value, self.max = state
 
     @classmethod
     def from_string(cls, str_val):
@@ -225,30 +342,50 @@ Creates an IP address from a given bitmask. Example::
             raise AddressError('class has no maximum bit range set')
         
         shift = bitmax - prefix
-        value = ((2 ** prefix) - 1) << shift
+        value = ((1 << prefix) - 1) << shift
 
-        return cls(value=value)
+        return cls._from_int(value)
 
     @staticmethod
     def blind_assertion(address):
         '''Tries to convert the string address into either a 
-:py:class:`V4Address` or a :py:class:`V6Address`. Raises an exception if it
-can't convert to either.'''
+:py:class:`V4Address` or a :py:class:`V6Address`, picking the family by whether
+the string contains a colon. Raises an exception if it can't convert to either.
+If :py:attr:`Address.CACHE` is set, parsed addresses are cached by their string.'''
 
         if isinstance(address, Address):
             return address
-        
+
+        if not isinstance(address, (str, unicode)):
+            raise AddressError('address must be an Address object or a string')
+
+        cache = Address.CACHE
+
+        if cache is not None:
+            address_obj = cache.get(address)
+
+            if address_obj is not None:
+                return address_obj
+
         try:
-            return V4Address.from_string(address)
-        except (AddressError, socket.error):
-            return V6Address.from_string(address)
-        except (AddressError, socket.error):
+            if ':' in address:
+                address_obj = V6Address.from_string(address)
+            else:
+                address_obj = V4Address.from_string(address)
+        except AddressError:
             raise AddressError('could not parse address blindly')
 
+        if cache is not None:
+            cache.put(address, address_obj)
+
+        return address_obj
+
 class V4Address(Address):
     '''An :py:class:`Address` class representing an IPv4 address. See
 :py:class:`Address` for functionality.'''
     
+    __slots__ = ()
+    
     MAX = 32
     
     def __str__(self):
@@ -264,12 +401,14 @@ class V4Address(Address):
 
         int_data = struct.unpack('>L', struct_data)[0]
 
-        return cls(value=int_data)
+        return cls._from_int(int_data)
 
 class V6Address(Address):
     '''An :py:class:`Address` class representing an IPv6 address. See
 :py:class:`Address` for functionality.'''
     
+    __slots__ = ()
+    
     MAX = 128
 
     def __str__(self):
@@ -287,4 +426,4 @@ class V6Address(Address):
 
         int_data = struct.unpack('>QQ', struct_data)
         lhs, rhs = int_data
-        return cls(value=lhs << 64 | rhs)
+        return cls._from_int(lhs << 64 | rhs)
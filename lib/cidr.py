@@ -1,13 +1,15 @@
 #!/usr/bin/env python
 
+import array
+import bisect
 import copy
+import heapq
+import itertools
 import os
 import random
 import re
 
-from hotmic import randiter, xrandrange
-
-from martinellis import address, xlongrange
+from martinellis import address, permutation, table, vector, xlongrange
 from martinellis.compat import *
 
 class CIDRError(Exception):
@@ -24,6 +26,301 @@ objects.'''
 
     pass
 
+def merge_intervals(intervals):
+    '''Merge a sequence of inclusive *(first, last)* integer intervals into a
+sorted list of disjoint intervals, joining intervals that overlap or touch.'''
+
+    merged = list()
+
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+
+    return merged
+
+def _boundaries(intervals, side):
+    for first, last in intervals:
+        yield first, side
+        yield last + 1, side
+
+def combine_intervals(left, right, keep):
+    '''
+Combine two sorted lists of disjoint *(first, last)* integer intervals, such as
+those returned by :py:func:`merge_intervals`, in a single linear sweep. The result
+is a sorted list of disjoint intervals covering every integer for which
+*keep(in_left, in_right)* is **True**, where *in_left* and *in_right* tell
+whether the integer is in an interval of *left* and *right*. For example, the
+difference of two lists is::
+
+   >>> combine_intervals([(0, 9)], [(3, 4)], lambda in_left, in_right: in_left and not in_right)
+   [(0, 2), (5, 9)]
+
+
+'''
+
+    result = list()
+    inside = [False, False]
+    start = None
+
+    # every interval toggles its side on at its first integer and off after its
+    # last, so the state between two boundaries is constant
+    points = heapq.merge(_boundaries(left, 0), _boundaries(right, 1))
+
+    for point, toggles in itertools.groupby(points, key=lambda entry: entry[0]):
+        for point, side in toggles:
+            inside[side] = not inside[side]
+
+        kept = keep(inside[0], inside[1])
+
+        if kept and start is None:
+            start = point
+        elif not kept and start is not None:
+            result.append((start, point - 1))
+            start = None
+
+    return result
+
+def subtract_intervals(intervals, exclude):
+    '''
+Remove the sorted list of disjoint *(first, last)* integer intervals *exclude*
+from the sorted list of disjoint intervals *intervals*. Each interval finds the
+first exclusion that can touch it with a bisect, and only walks the exclusions
+overlapping it from there, so a few intervals minus a long exclusion list costs a
+handful of binary searches rather than a sweep over every exclusion::
+
+   >>> subtract_intervals([(0, 9), (20, 29)], [(3, 4), (8, 21)])
+   [(0, 2), (5, 7), (22, 29)]
+
+
+'''
+
+    lasts = [last for first, last in exclude]
+    result = list()
+
+    for first, last in intervals:
+        index = bisect.bisect_left(lasts, first)
+
+        while index < len(exclude) and exclude[index][0] <= last:
+            excluded_first, excluded_last = exclude[index]
+
+            if excluded_first > first:
+                result.append((first, excluded_first - 1))
+
+            first = excluded_last + 1
+
+            if first > last:
+                break
+
+            index += 1
+
+        if first <= last:
+            result.append((first, last))
+
+    return result
+
+def _exclusions(exclude, bitmax):
+    if isinstance(exclude, CIDRSet):
+        return exclude._families().get(bitmax, (None, None, list()))[2]
+
+    if isinstance(exclude, CIDR):
+        return _held_intervals([exclude]) if exclude.address.max == bitmax else list()
+
+    raise CIDRSetError('exclude must be a CIDR or CIDRSet object')
+
+def _held_intervals(networks):
+    # the addresses a network holds, which leaves out the network and broadcast
+    # addresses of non-inclusive networks, and everything of the non-inclusive
+    # networks too small to have any
+    return [(network._low, network._high) for network in networks if network._low <= network._high]
+
+def _held_networks(network_class, inclusive, first, last):
+    # the reverse of _held_intervals: non-inclusive networks are rebuilt over
+    # one more address on each side, so the addresses they leave out fall
+    # outside of the interval. Intervals no single non-inclusive network holds
+    # exactly are rebuilt from smaller ones, which leave out their own bounds
+    if not inclusive:
+        first = max(first - 1, 0)
+        last = min(last + 1, (1 << network_class.ADDRESS_CLASS.MAX) - 1)
+
+    return [network for network in network_class.from_range(first, last, inclusive)
+            if network._low <= network._high]
+
+def _merged_segments(segments):
+    return [(first, last - first + 1)
+            for first, last in merge_intervals([(first, first + length - 1) for first, length in segments])]
+
+def _excluded_segments(segments, exclude, bitmax):
+    # merging first means overlapping networks yield their shared addresses once
+    intervals = [(first, first + length - 1) for first, length in _merged_segments(segments)]
+
+    return [(first, last - first + 1) for first, last in subtract_intervals(intervals, _exclusions(exclude, bitmax))]
+
+def _int_range(start, stop, step=1):
+    if env == 3:
+        return range(start, stop, step)
+
+    # xrange can't hold the long integers of IPv6 on Python 2
+    def long_range(start):
+        while start < stop:
+            yield start
+            start += step
+
+    return long_range(start)
+
+def _segment_offsets(segments):
+    offsets = list()
+    total = 0
+
+    for first, length in segments:
+        offsets.append(total)
+        total += length
+
+    return total, offsets
+
+def _segment_values(segments, offsets, positions):
+    values = list()
+
+    for position in positions:
+        index = bisect.bisect_right(offsets, position) - 1
+        values.append(segments[index][0] + position - offsets[index])
+
+    return values
+
+def _segment_range(segments, offsets, start, stop):
+    values = list()
+    index = bisect.bisect_right(offsets, start) - 1
+
+    while start < stop:
+        first, length = segments[index]
+        end = min(stop, offsets[index] + length)
+        values.extend(_int_range(first + start - offsets[index], first + end - offsets[index]))
+        start = end
+        index += 1
+
+    return values
+
+def _permuted_ints(segments, permutation_obj):
+    total, offsets = _segment_offsets(segments)
+
+    if len(segments) == 1:
+        first = segments[0][0]
+
+        for position in permutation_obj:
+            yield first + position
+
+        return
+
+    for position in permutation_obj:
+        index = bisect.bisect_right(offsets, position) - 1
+        yield segments[index][0] + position - offsets[index]
+
+def _iter_ints(segments, random, seed):
+    if not random:
+        return itertools.chain.from_iterable(_int_range(first, first + length) for first, length in segments)
+
+    total, offsets = _segment_offsets(segments)
+
+    return _permuted_ints(segments, permutation.Permutation(total, seed=seed))
+
+def _iter_int_chunks(segments, bitmax, size, random, seed, as_numpy):
+    if size < 1:
+        raise ValueError('chunk size must be positive')
+
+    if as_numpy:
+        vector.require_numpy()
+
+    total, offsets = _segment_offsets(segments)
+    permutation_obj = permutation.Permutation(total, seed=seed) if random else None
+    chunk_table = None
+
+    if as_numpy and total <= 1 << 64:
+        chunk_table = vector.segment_table(offsets, [segment[0] for segment in segments], bitmax)
+
+    for start in _int_range(0, total, size):
+        stop = min(start + size, total)
+
+        if chunk_table is not None:
+            if permutation_obj is None:
+                positions = vector.numpy.arange(start, stop, dtype=vector.numpy.uint64)
+            else:
+                positions = permutation_obj.permute_many(start, stop)
+
+            yield vector.segment_addresses(positions, chunk_table, bitmax)
+            continue
+
+        if permutation_obj is None:
+            values = _segment_range(segments, offsets, start, stop)
+        else:
+            values = _segment_values(segments, offsets, map(permutation_obj.permute, _int_range(start, stop)))
+
+        yield _pack_ints(values, bitmax, as_numpy)
+
+def _pack_ints(values, bitmax, as_numpy):
+    if as_numpy:
+        return vector.int_array(values, bitmax)
+
+    if bitmax == 32:
+        return array.array('I', values)
+
+    return (array.array('Q', [value >> 64 for value in values])
+            ,array.array('Q', [value & 0xFFFFFFFFFFFFFFFF for value in values]))
+
+def _sample_positions(total, count, seed):
+    if not 0 <= count <= total:
+        raise ValueError('sample larger than the population')
+
+    # the first *count* positions of a permutation are distinct by construction,
+    # so nothing drawn so far has to be remembered
+    permutation_obj = permutation.Permutation(total, seed=seed)
+
+    return map(permutation_obj.permute, _int_range(0, count))
+
+def _sample_ints(segments, count, seed):
+    total, offsets = _segment_offsets(segments)
+
+    return _segment_values(segments, offsets, _sample_positions(total, count, seed))
+
+def _random_ints(segments, bitmax, count, seed, as_numpy):
+    if count < 0:
+        raise ValueError('count must not be negative')
+
+    if as_numpy:
+        vector.require_numpy()
+
+    total, offsets = _segment_offsets(segments)
+
+    if not total and count:
+        raise ValueError('cannot draw from an empty population')
+
+    if as_numpy and 0 < total <= 1 << 64:
+        generator = vector.numpy.random.default_rng(seed)
+        positions = generator.integers(0, total - 1, size=count, dtype=vector.numpy.uint64, endpoint=True)
+        segment_table = vector.segment_table(offsets, [segment[0] for segment in segments], bitmax)
+
+        return vector.segment_addresses(positions, segment_table, bitmax)
+
+    generator = random.Random(seed)
+
+    if total & (total - 1):
+        draw = generator.randrange
+        positions = [draw(total) for index in _int_range(0, count)]
+    else:
+        # getrandbits is much cheaper than randrange, and exact for powers of two
+        bits = total.bit_length() - 1
+        draw = generator.getrandbits
+        positions = [draw(bits) if bits else 0 for index in _int_range(0, count)]
+
+    if len(segments) == 1:
+        first = segments[0][0]
+        values = [first + position for position in positions]
+    else:
+        values = _segment_values(segments, offsets, positions)
+
+    return _pack_ints(values, bitmax, as_numpy)
+
 class CIDR(object):
     '''
 This is the base class for representing IP addresses in CIDR notation. It allows
@@ -58,6 +355,14 @@ a value that can be passed to the *value* argument of its constructor.'''
     
     RANDOM = False
     '''Indicate whether to iterate over the network randomly.'''
+
+    SEED = None
+    '''The seed of the random iteration order. See
+:py:func:`martinellis.cidr.CIDR.permutation` for details.'''
+
+    CACHE = None
+    '''An optional :py:class:`martinellis.address.ParseCache` of the networks
+parsed by :py:func:`martinellis.cidr.CIDR.blind_assertion`.'''
     
     def __init__(self, **kwargs):
         '''
@@ -80,6 +385,17 @@ Creates a CIDR object. Keyword arguments are:
 
    *random*: Randomize address values on iteration.
 
+   *seed*: An integer seed selecting the order of random iteration. The same
+   network and seed always iterate in the same order. If not given, every
+   iteration picks a new order.
+
+The base address is normalized to the routing address of the network, and the
+integer bounds of the network are computed once and kept in the *first*, *last*
+and *mask* attributes. CIDR objects are immutable: setting an attribute after
+construction raises a :py:class:`martinellis.cidr.CIDRError`. They compare,
+sort and hash by address family, network address and prefix, so networks
+differing only in their *inclusive*, *random* or *seed* switches are equal.
+
 
 '''
 
@@ -100,6 +416,7 @@ Creates a CIDR object. Keyword arguments are:
         self.prefix = kwargs.setdefault('prefix', self.PREFIX)
         self.inclusive = kwargs.setdefault('inclusive', self.INCLUSIVE)
         self.random = kwargs.setdefault('random', self.RANDOM)
+        self.seed = kwargs.setdefault('seed', self.SEED)
 
         if self.address is None:
             raise CIDRError('no base address provided')
@@ -116,6 +433,32 @@ Creates a CIDR object. Keyword arguments are:
         if not isinstance(self.prefix, (int, long)):
             raise CIDRError('prefix must be an integer')
 
+        bitmax = self.address.max
+
+        if not 0 <= self.prefix <= bitmax:
+            raise CIDRError('prefix out of range of the address class')
+
+        # the bounds never change, so compute them once rather than on every
+        # membership check, and keep a private copy of the normalized address
+        # so changes to the address given to the constructor can't leak in
+        self.mask = ((1 << self.prefix) - 1) << (bitmax - self.prefix)
+        self.first = self.address.value & self.mask
+        self.last = self.first | (~self.mask & ((1 << bitmax) - 1))
+        self.address = self.address_class._from_int(self.first, bitmax)
+        self._low = self.first + int(not self.inclusive)
+        self._high = self.last - int(not self.inclusive)
+        self._key = (bitmax, self.first, self.prefix)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise CIDRError('CIDR objects are immutable')
+
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise CIDRError('CIDR objects are immutable')
+
     def netmask(self):
         '''
 Return an :py:class:`martinellis.address.Address` object specified by the member
@@ -126,7 +469,7 @@ variable *address_class* representing the netmask of the given network. Example:
 
 '''
         
-        return self.address_class.from_prefix(self.prefix)
+        return self.address_class._from_int(self.mask, self.address.max)
 
     def routing_address(self):
         '''
@@ -139,7 +482,7 @@ Example::
 
 '''
 
-        return self.address & self.netmask()
+        return self.address_class._from_int(self.first, self.address.max)
 
     def broadcast_address(self):
         '''
@@ -152,20 +495,20 @@ Example::
 
 '''
 
-        return self.address | (self.network_range() - 1)
+        return self.address_class._from_int(self.last, self.address.max)
 
     def network_range(self):
         '''Return the number of possible addresses in this given network.'''
         
-        return 2 ** (self.address.max - self.prefix)
+        return self.last - self.first + 1
 
     def get_address(self, index):
         '''Treat the network like an array and get the address at offset *index*.'''
         
-        if index < int(not self.inclusive) or index > self.network_range() - int(not self.inclusive):
+        if index < int(not self.inclusive) or index > self.network_range() - 1 - int(not self.inclusive):
             raise IndexError('index {} out of range of network'.format(index))
 
-        return self.routing_address() + index
+        return self.address_class._from_int(self.first + index, self.address.max)
 
     def has_address(self, address_obj):
         '''Check if the given *address_obj* is a member of the network specified
@@ -176,15 +519,10 @@ same :py:class:`martinellis.address.Address` object specified by the class's
         if not isinstance(address_obj, address.Address):
             raise CIDRError('can only check for membership of address objects')
 
-        if not issubclass(address_obj.__class__, self.address_class):
+        if not isinstance(address_obj, self.address_class):
             raise CIDRError('address class mismatch')
-        
-        route_addr = self.routing_address()
-        route_cmp = route_addr + int(not self.inclusive)
-        broad_addr = self.broadcast_address()
-        broad_cmp = broad_addr + int(not self.inclusive)
 
-        return route_cmp <= address_obj <= broad_cmp
+        return self._low <= address_obj.value <= self._high
 
     def is_subset_of(self, cidr_obj):
         '''Check if this :py:class:`martinellis.cidr.CIDR` object is a subset of
@@ -193,15 +531,10 @@ the given *cidr_obj*.'''
         if not isinstance(cidr_obj, CIDR):
             raise CIDRError('can only check subset of CIDR objects')
 
-        if not issubclass(cidr_obj.address.__class__, self.address_class):
+        if not isinstance(cidr_obj.address, self.address_class):
             raise CIDRError('address class mismatch')
-        
-        route_addr = cidr_obj.routing_address()
-        route_cmp = route_addr + int(not cidr_obj.inclusive)
-        broad_addr = cidr_obj.broadcast_address()
-        broad_cmp = broad_addr + int(not cidr_obj.inclusive)
-        
-        return self.address & broad_addr == route_addr and self.prefix >= cidr_obj.prefix
+
+        return cidr_obj.first <= self.first and self.last <= cidr_obj.last
 
     def is_superset_of(self, cidr_obj):
         '''Check if this :py:class:`martinellis.cidr.CIDR` object is a superset of
@@ -209,12 +542,200 @@ the given *cidr_obj*.'''
 
         return cidr_obj.is_subset_of(self)
 
+    def contains_many(self, addresses):
+        '''
+Vectorized version of :py:func:`martinellis.cidr.CIDR.has_address`. *addresses*
+is a NumPy array of IPv4 addresses as unsigned 32-bit integers, or of IPv6
+addresses as an *(n, 2)* array of unsigned 64-bit high and low halves. Returns a
+boolean mask of the addresses that are members of the network. Example::
+
+   >>> V4CIDR(cidr='10.0.0.0/8').contains_many(numpy.array([0x0a000001, 0x0b000001], dtype=numpy.uint32))
+   array([ True, False])
+
+Requires NumPy.'''
+
+        keys, bitmax = vector.as_keys(addresses)
+
+        if not bitmax == self.address.max:
+            raise CIDRError('address class mismatch')
+
+        return vector.in_range(keys, bitmax, self._low, self._high)
+
+    def permutation(self, seed=None, position=0):
+        '''
+Return a :py:class:`martinellis.permutation.Permutation` that yields every
+address in the network exactly once in a pseudorandom order. The permutation can
+be checkpointed with :py:func:`martinellis.permutation.Permutation.state` and
+picked up again later, even from another process, with
+:py:func:`martinellis.permutation.Permutation.resume`::
+
+   >>> addresses = V4CIDR(cidr='10.0.0.0/8').permutation(seed=1337)
+   >>> next(addresses)
+   V4Address(10.228.67.230)
+   >>> state = addresses.state()
+   >>> next(V4CIDR(cidr='10.0.0.0/8').permutation().resume(state))
+   V4Address(10.175.22.32)
+
+*seed* defaults to the *seed* of the network, and *position* is the position in
+the permutation to start from.'''
+
+        length, transform = self._address_index()
+
+        if seed is None:
+            seed = self.seed
+
+        return permutation.Permutation(length, seed=seed, position=position, transform=transform)
+
+    def shard(self, count, index, random=None, seed=None):
+        '''
+Return a :py:class:`martinellis.cidr.Shard` iterating over the *index*-th of
+*count* non-overlapping slices of the addresses in the network. The slices differ
+in size by at most one address, so handing one shard to each of *count* workers
+covers the network exactly once. Example::
+
+   >>> [list(V4CIDR(cidr='10.0.0.0/30').shard(2, index)) for index in range(2)]
+   [[V4Address(10.0.0.0), V4Address(10.0.0.1)], [V4Address(10.0.0.2), V4Address(10.0.0.3)]]
+
+*random* defaults to the *random* switch of the network. Random shards are slices
+of the same :py:func:`martinellis.cidr.CIDR.permutation`, so every worker must use
+the same *seed*, which defaults to the *seed* of the network.'''
+
+        if count < 1 or not 0 <= index < count:
+            raise CIDRError('shard index out of range')
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        if random and seed is None:
+            raise CIDRError('random shards need a seed shared by every shard')
+
+        return Shard(self, count, index, random, seed)
+
+    def iter_ints(self, random=None, seed=None, exclude=None):
+        '''
+Return an iterator of the addresses in the network as plain integers rather than
+:py:class:`martinellis.address.Address` objects. *random* and *seed* default to
+the switches of the network; random order follows
+:py:func:`martinellis.cidr.CIDR.permutation`.
+
+*exclude* is a :py:class:`martinellis.cidr.CIDR` or
+:py:class:`martinellis.cidr.CIDRSet` of addresses to leave out, such as a
+do-not-scan list. Excluded ranges are cut out of the network before iterating
+with :py:func:`martinellis.cidr.subtract_intervals`, so none of the remaining
+addresses are tested against the exclusions one by one, and random order is a
+permutation of the remaining addresses only. Example::
+
+   >>> list(V4CIDR(cidr='10.0.0.0/29').iter_ints(exclude=CIDRSet(V4CIDR(cidr='10.0.0.2/31'))))
+   [167772160, 167772161, 167772164, 167772165, 167772166, 167772167]
+
+
+'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        return _iter_ints(self._segments(exclude), random, seed)
+
+    def iter_chunks(self, size, random=None, seed=None, as_numpy=False, exclude=None):
+        '''
+Return an iterator of blocks of up to *size* addresses of the network, in the same
+order as :py:func:`martinellis.cidr.CIDR.iter_ints`, leaving out the addresses in
+*exclude*. IPv4 blocks are
+``array('I')`` objects, and IPv6 blocks are tuples of two ``array('Q')`` objects
+holding the high and low 64 bits of each address. If *as_numpy* is **True**,
+blocks are NumPy arrays in the form accepted by
+:py:func:`martinellis.cidr.CIDR.contains_many` instead, and random blocks are
+permuted with vectorized operations. Example::
+
+   >>> list(V4CIDR(cidr='10.0.0.0/30').iter_chunks(3))
+   [array('I', [167772160, 167772161, 167772162]), array('I', [167772163])]
+
+
+'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        return _iter_int_chunks(self._segments(exclude), self.address.max, size, random, seed, as_numpy)
+
+    def _segments(self, exclude=None):
+        length = self.length()
+
+        if length <= 0:
+            return list()
+
+        if exclude is not None:
+            return _excluded_segments([(self._low, length)], exclude, self.address.max)
+
+        return [(self._low, length)]
+
+    def _address_index(self):
+        first = self._low
+        address_class = self.address_class
+        bitmax = self.address.max
+
+        return max(0, self.length()), lambda index: address_class._from_int(first + index, bitmax)
+
     def random_address(self):
         '''Return a random address contained within this subnet.'''
 
-        max_index = self.network_range() - int(not self.inclusive)
-        random_index = random.randint(1, max_index)
-        return self.get_address(random_index)
+        length = self.length()
+
+        if length <= 0:
+            raise CIDRError('network has no addresses')
+
+        return self.get_address(int(not self.inclusive) + random.randrange(length))
+
+    def sample(self, count, seed=None):
+        '''
+Return a list of *count* distinct random addresses of the network. The addresses
+are the first *count* positions of :py:func:`martinellis.cidr.CIDR.permutation`,
+so drawing them takes constant memory per address however large the network is,
+and no set of the addresses drawn so far is kept. Example::
+
+   >>> V6CIDR(cidr='2001:db8::/32').sample(2, seed=7)
+   [V6Address(2001:db8:e617:33ef:600e:a3f0:8022:5b7e), V6Address(2001:db8:7df6:3680:6c63:77a2:82aa:a356)]
+
+*seed* defaults to the *seed* of the network. Raises a ``ValueError`` if the
+network holds fewer than *count* addresses.'''
+
+        address_class = self.address_class
+        bitmax = self.address.max
+
+        return [address_class._from_int(value, bitmax) for value in self.sample_ints(count, seed)]
+
+    def sample_ints(self, count, seed=None):
+        '''Like :py:func:`martinellis.cidr.CIDR.sample`, but return the addresses
+as plain integers.'''
+
+        if seed is None:
+            seed = self.seed
+
+        return _sample_ints(self._segments(), count, seed)
+
+    def random_ints(self, count, seed=None, as_numpy=False):
+        '''
+Return *count* random addresses of the network, drawn with replacement, as a block
+in the form returned by :py:func:`martinellis.cidr.CIDR.iter_chunks`. Addresses are
+drawn from a ``random.Random`` generator seeded with *seed*, or, if *as_numpy* is
+**True**, from a NumPy generator in a single vectorized call. Example::
+
+   >>> V4CIDR(cidr='10.0.0.0/8').random_ints(3, seed=1)
+   array('I', [170026417, 177321816, 181989738])
+
+
+'''
+
+        return _random_ints(self._segments(), self.address.max, count, seed, as_numpy)
 
     def random_subnet(self, prefix=None):
         '''Return a random subnet that's a subset of this subnet.'''
@@ -243,25 +764,57 @@ the given *cidr_obj*.'''
     def __str__(self):
         '''Return a string representation of the CIDR object.'''
         
-        return '%s/%s' % (self.routing_address(), self.prefix)
+        return '%s/%d' % (self.address, self.prefix)
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, str(self))
 
     def __hash__(self):
-        return hash('%d/%d/%d/%d' % (hash(self.address), self.prefix, int(self.inclusive), int(self.random)))
+        return hash(self._key)
 
     def __cmp__(self, other):
         if not isinstance(other, CIDR):
             raise CIDRError('cannot compare CIDR object to non-CIDR objects')
 
-        if not self.address.max == other.address.max:
-            return cmp(self.address.max, other.address.max)
-        
-        if not self.prefix == other.prefix:
-            return cmp(self.prefix, other.prefix)
+        return cmp(self._key, other._key)
+
+    # networks order by family, then network address, then prefix, so a
+    # sorted list of networks puts every supernet right before its subnets
+    def __eq__(self, other):
+        if not isinstance(other, CIDR):
+            return NotImplemented
+
+        return self._key == other._key
+
+    def __ne__(self, other):
+        if not isinstance(other, CIDR):
+            return NotImplemented
 
-        return cmp(self.address, other.address)
+        return not self._key == other._key
+
+    def __lt__(self, other):
+        if not isinstance(other, CIDR):
+            raise CIDRError('cannot compare CIDR object to non-CIDR objects')
+
+        return self._key < other._key
+
+    def __le__(self, other):
+        if not isinstance(other, CIDR):
+            raise CIDRError('cannot compare CIDR object to non-CIDR objects')
+
+        return self._key <= other._key
+
+    def __gt__(self, other):
+        if not isinstance(other, CIDR):
+            raise CIDRError('cannot compare CIDR object to non-CIDR objects')
+
+        return self._key > other._key
+
+    def __ge__(self, other):
+        if not isinstance(other, CIDR):
+            raise CIDRError('cannot compare CIDR object to non-CIDR objects')
+
+        return self._key >= other._key
 
     def __rshift__(self, other):
         '''If *other* is a :py:class:`martinellis.cidr.CIDR` object, check if
@@ -307,23 +860,17 @@ of the network.'''
 affected by the *random* and *inclusive* switches given to 
 :py:func:`martinellis.cidr.CIDR.__init__`.'''
         
-        upper_address = self.network_range()
-        lower_address = 0
+        if self.random:
+            for address_obj in self.permutation():
+                yield address_obj
 
-        upper_address -= int(not self.inclusive)
-        lower_address += int(not self.inclusive)
-        
-        if not self.inclusive:
-            upper_address += 1
-            lower_address += 1
+            return
 
-        if self.random:
-            addresses = xrandrange(lower_address, upper_address)
-        else:
-            addresses = xlongrange(lower_address, upper_address)
+        from_int = self.address_class._from_int
+        bitmax = self.address.max
 
-        for address_obj in addresses:
-            yield self[address_obj]
+        for value in self.iter_ints(random=False):
+            yield from_int(value, bitmax)
 
     def __len__(self):
         return self.length()
@@ -338,7 +885,8 @@ network of the :py:class:`martinellis.cidr.CIDR` object.'''
         return self >> element
 
     def __copy__(self):
-        return self.__class__(**self.__dict__)
+        # immutable objects can be shared rather than copied
+        return self
     
     @classmethod
     def from_string(cls, cidr):
@@ -376,22 +924,84 @@ object.'''
 
         return cls(**kwargs)
 
+    @classmethod
+    def from_range(cls, first, last, inclusive=None):
+        '''
+Return a list of the fewest :py:class:`martinellis.cidr.CIDR` objects covering
+exactly the addresses from *first* to *last* inclusive. *first* and *last* can be
+:py:class:`martinellis.address.Address` objects or integers. *inclusive* sets the
+switch of the returned networks, and defaults to
+:py:attr:`martinellis.cidr.CIDR.INCLUSIVE`. Example::
+
+   >>> V4CIDR.from_range(V4Address(value='10.0.0.0'), V4Address(value='10.0.2.255'))
+   [V4CIDR(10.0.0.0/23), V4CIDR(10.0.2.0/24)]
+
+'''
+
+        address_class = getattr(cls, 'ADDRESS_CLASS', None)
+
+        if address_class is None:
+            raise CIDRError('cidr class has no static address class')
+
+        first = int(first)
+        last = int(last)
+        bitmax = address_class.MAX
+        networks = list()
+
+        if first < 0 or last >= 1 << bitmax:
+            raise CIDRError('range exceeds the address space')
+
+        if inclusive is None:
+            inclusive = cls.INCLUSIVE
+
+        while first <= last:
+            # the largest block aligned on first that doesn't run past last
+            bits = min((first & -first).bit_length() - 1 if first else bitmax
+                       ,(last - first + 1).bit_length() - 1)
+
+            networks.append(cls(address=address_class._from_int(first)
+                                ,prefix=bitmax - bits
+                                ,inclusive=inclusive
+                                ,random=cls.RANDOM))
+            first += 1 << bits
+
+        return networks
+
     @staticmethod
     def blind_assertion(cidr):
         '''Tries to convert the string into either a
-:py:class:`martinellis.cidr.V4CIDR` or a :py:class:`martinellis.cidr.V6CIDR`.
-Raises an exception if it can't convert to either.'''
+:py:class:`martinellis.cidr.V4CIDR` or a :py:class:`martinellis.cidr.V6CIDR`,
+picking the family by whether the string contains a colon. Raises an exception if
+it can't convert to either. If :py:attr:`martinellis.cidr.CIDR.CACHE` is set,
+parsed networks are cached by their string.'''
 
         if isinstance(cidr, CIDR):
             return cidr
-        
+
+        if not isinstance(cidr, (str, unicode)):
+            raise CIDRError('cidr must be a CIDR object or a string')
+
+        cache = CIDR.CACHE
+
+        if cache is not None:
+            cidr_obj = cache.get(cidr)
+
+            if cidr_obj is not None:
+                return cidr_obj
+
         try:
-            return V4CIDR.from_string(cidr)
-        except address.AddressError:
-            return V6CIDR.from_string(cidr)
-        except address.AddressError:
+            if ':' in cidr:
+                cidr_obj = V6CIDR.from_string(cidr)
+            else:
+                cidr_obj = V4CIDR.from_string(cidr)
+        except (address.AddressError, CIDRError, ValueError):
             raise CIDRError('could not parse cidr string blindly')
 
+        if cache is not None:
+            cache.put(cidr, cidr_obj)
+
+        return cidr_obj
+
 class V4CIDR(CIDR):
     '''A :py:class:`martinellis.cidr.CIDR` class representing an IPv4 CIDR. See
 :py:class:`martinellis.cidr.CIDR` for functionality.'''
@@ -404,6 +1014,105 @@ class V6CIDR(CIDR):
     
     ADDRESS_CLASS = address.V6Address
 
+class FenwickTree(object):
+    '''
+A binary indexed tree over a list of non-negative integer weights. It updates a
+weight and picks an index by cumulative weight in O(log n) time, which makes it
+useful for drawing networks weighted by their size.'''
+
+    def __init__(self, weights):
+        self.size = len(weights)
+        self._tree = [0] + list(weights)
+
+        for index in range(1, self.size + 1):
+            parent = index + (index & -index)
+
+            if parent <= self.size:
+                self._tree[parent] += self._tree[index]
+
+    def add(self, index, delta):
+        '''Add *delta* to the weight at *index*.'''
+
+        index += 1
+
+        while index <= self.size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index):
+        '''Return the sum of the weights before *index*.'''
+
+        total = 0
+
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+
+        return total
+
+    def total(self):
+        '''Return the sum of all weights.'''
+
+        return self.prefix_sum(self.size)
+
+    def find(self, value):
+        '''Return the index whose weight covers the cumulative *value*, that is
+the smallest index whose prefix sum including itself exceeds *value*.'''
+
+        index = 0
+        step = 1 << self.size.bit_length()
+
+        while step:
+            if index + step <= self.size and self._tree[index + step] <= value:
+                index += step
+                value -= self._tree[index]
+
+            step >>= 1
+
+        return index
+
+class Shard(object):
+    '''
+One of several non-overlapping slices of the addresses of a
+:py:class:`martinellis.cidr.CIDR` or :py:class:`martinellis.cidr.CIDRSet`, as
+returned by :py:func:`martinellis.cidr.CIDR.shard` and
+:py:func:`martinellis.cidr.CIDRSet.shard`. It holds no addresses itself, just the
+network or set it slices and the bounds of its slice, so it's cheap to create and
+can be pickled to send to another process.'''
+
+    def __init__(self, source, count, index, random=False, seed=None):
+        length, transform = source._address_index()
+
+        self.source = source
+        self.count = count
+        self.index = index
+        self.random = random
+        self.seed = seed
+        self.start = length * index // count
+        self.stop = length * (index + 1) // count
+
+    def length(self):
+        '''Count how many addresses are in this shard.'''
+
+        return self.stop - self.start
+
+    def __len__(self):
+        return self.length()
+
+    def __iter__(self):
+        length, transform = self.source._address_index()
+
+        if not self.random:
+            for position in xlongrange(self.start, self.stop):
+                yield transform(position)
+
+            return
+
+        permutation_obj = permutation.Permutation(length, seed=self.seed)
+
+        for position in xlongrange(self.start, self.stop):
+            yield transform(permutation_obj.permute(position))
+
 class CIDRSet(set):
     '''A Python set object representing multiple networks. It's capable of taking
 multiple large networks and creating a functional iterator out of them. An
@@ -411,7 +1120,7 @@ example::
 
    >>> cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/31'), V4CIDR(cidr='10.0.0.50/31'), addresses=True)
    >>> list(cidr_set)
-   [V4Address(10.0.0.50), V4Address(10.0.0.51), V4Address(10.0.0.0), V4Address(10.0.0.1)]
+   [V4Address(10.0.0.0), V4Address(10.0.0.1), V4Address(10.0.0.50), V4Address(10.0.0.51)]
 
 
 '''
@@ -422,9 +1131,16 @@ example::
     RANDOM = False
     '''Same effect as :py:attr:`martinellis.cidr.CIDR.RANDOM`.'''
 
+    SEED = None
+    '''Same effect as :py:attr:`martinellis.cidr.CIDR.SEED`.'''
+
     ADDRESSES = False
     '''Affects what type of value is returned on iteration. See
 :py:func:`martinellis.cidr.CIDR.__init__` for details.'''
+
+    COLLAPSED = False
+    '''Keep the set collapsed into its minimal cover as networks are added. See
+:py:func:`martinellis.cidr.CIDRSet.collapse` for details.'''
     
     def __init__(self, *args, **kwargs):
         '''Create a :py:class:`martinellis.cidr.CIDRSet` object. *args* offered
@@ -436,19 +1152,31 @@ to the constructor are interpretted as the dataset containing
 
    *random*: Mark whether the networks returned are random.
 
+   *seed*: An integer seed selecting the order of random iteration.
+
    *addresses*: If this argument is set to **True**, iteration over the set object
    will return :py:class:`martinellis.address.Address` objects. Otherwise,
    iteration will return :py:class:`martinellis.cidr.CIDR` objects.
 
+   *collapsed*: If this argument is set to **True**, overlapping and adjacent
+   networks are merged whenever networks are added, so the set always holds its
+   minimal cover. See :py:func:`martinellis.cidr.CIDRSet.collapse`.
+
 
 '''
         
         self.inclusive = kwargs.setdefault('inclusive', self.INCLUSIVE)
         self.random = kwargs.setdefault('random', self.RANDOM)
+        self.seed = kwargs.setdefault('seed', self.SEED)
         self.addresses = kwargs.setdefault('addresses', self.ADDRESSES)
+        self.collapsed = kwargs.setdefault('collapsed', self.COLLAPSED)
+        self._cache = dict()
 
         set.__init__(self, args)
 
+        if self.collapsed:
+            self._collapse_update()
+
     def address_length(self):
         '''Return the number of addresses in this set.'''
         
@@ -460,6 +1188,611 @@ to the constructor are interpretted as the dataset containing
         
         return set(super(CIDRSet, self).__iter__())
 
+    def sorted_networks(self):
+        '''Return a list of the networks in this set, sorted by address family,
+routing address and prefix.'''
+
+        return sorted(self.network_set())
+
+    def permutation(self, seed=None, position=0):
+        '''
+Return a :py:class:`martinellis.permutation.Permutation` that yields every
+address of every network in the set in a pseudorandom order, like
+:py:func:`martinellis.cidr.CIDR.permutation` does for a single network. Addresses
+in overlapping networks are yielded once per network containing them, so collapse
+the set first with :py:func:`martinellis.cidr.CIDRSet.collapse` if that matters.
+*seed* defaults to the *seed* of the set.'''
+
+        total, transform = self._address_index()
+
+        if seed is None:
+            seed = self.seed
+
+        return permutation.Permutation(total, seed=seed, position=position, transform=transform)
+
+    def shard(self, count, index, random=None, seed=None):
+        '''
+Return a :py:class:`martinellis.cidr.Shard` iterating over the *index*-th of
+*count* non-overlapping slices of the addresses in the set. Shards are balanced by
+address count rather than by network, so a set holding one /8 and many /24s still
+splits evenly. *random* and *seed* work like they do for
+:py:func:`martinellis.cidr.CIDR.shard`, defaulting to the switches of the set.
+Addresses in overlapping networks are counted once per network, so collapse the
+set first with :py:func:`martinellis.cidr.CIDRSet.collapse` if that matters.'''
+
+        if count < 1 or not 0 <= index < count:
+            raise CIDRSetError('shard index out of range')
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        if random and seed is None:
+            raise CIDRSetError('random shards need a seed shared by every shard')
+
+        return Shard(self, count, index, random, seed)
+
+    def iter_ints(self, random=None, seed=None, exclude=None):
+        '''
+Return an iterator of the addresses of every network in the set as plain integers,
+like :py:func:`martinellis.cidr.CIDR.iter_ints`. *random* and *seed* default to
+the switches of the set; random order follows
+:py:func:`martinellis.cidr.CIDRSet.permutation`.
+
+Addresses in the :py:class:`martinellis.cidr.CIDR` or
+:py:class:`martinellis.cidr.CIDRSet` *exclude* are left out, the same way as
+:py:func:`martinellis.cidr.CIDR.iter_ints` does. When *exclude* is given, the
+networks of the set are merged first, so addresses in overlapping networks are
+yielded only once; pass an empty :py:class:`martinellis.cidr.CIDRSet` to get that
+without excluding anything.'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        if exclude is None:
+            return _iter_ints(self._segments(), random, seed)
+
+        segments = list()
+
+        for bitmax in self._bitmaxes():
+            segments += _excluded_segments(self._segments(bitmax), exclude, bitmax)
+
+        return _iter_ints(segments, random, seed)
+
+    def iter_chunks(self, size, random=None, seed=None, as_numpy=False, exclude=None):
+        '''Return an iterator of blocks of up to *size* addresses of the networks
+in the set, like :py:func:`martinellis.cidr.CIDR.iter_chunks`. A block never
+mixes address families: all IPv4 blocks come before all IPv6 blocks, and random
+order is a permutation within each family. *exclude* works like it does for
+:py:func:`martinellis.cidr.CIDRSet.iter_ints`.'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        def segments(bitmax):
+            if exclude is None:
+                return self._segments(bitmax)
+
+            return _excluded_segments(self._segments(bitmax), exclude, bitmax)
+
+        return itertools.chain.from_iterable(_iter_int_chunks(segments(bitmax), bitmax, size, random, seed, as_numpy)
+                                             for bitmax in self._bitmaxes())
+
+    def _bitmaxes(self):
+        return sorted(set([network.address.max for network in self.network_set()]))
+
+    def _segments(self, bitmax=None):
+        segments = list()
+
+        for network in self.sorted_networks():
+            if bitmax is None or network.address.max == bitmax:
+                segments += network._segments()
+
+        return segments
+
+    def _changed(self):
+        # the address and subnet indexes are built on first use and kept until
+        # the networks of the set change
+        self._cache = dict()
+
+    def _address_index(self):
+        if not 'addresses' in self._cache:
+            self._cache['addresses'] = self._build_address_index()
+
+        return self._cache['addresses']
+
+    def _build_address_index(self):
+        offsets = list()
+        networks = list()
+        total = 0
+
+        for network in self.sorted_networks():
+            length, transform = network._address_index()
+
+            if length <= 0:
+                continue
+
+            offsets.append(total)
+            networks.append(transform)
+            total += length
+
+        def transform(index):
+            position = bisect.bisect_right(offsets, index) - 1
+            return networks[position](index - offsets[position])
+
+        return total, transform
+
+    def random_address(self):
+        '''Return a random address contained within one of the networks of this
+set. Networks are picked weighted by their size, so every address in the set is
+equally likely. The cumulative sizes of the networks are indexed on the first
+call and kept until the set changes, so each pick is a binary search.'''
+
+        total, transform = self._address_index()
+
+        if not total:
+            raise CIDRSetError('set has no addresses')
+
+        return transform(random.randrange(total))
+
+    def _sample_families(self):
+        segments = list()
+        classes = list()
+
+        for bitmax in self._bitmaxes():
+            address_class = [network.address_class for network in self.network_set() if network.address.max == bitmax][0]
+            merged = _merged_segments(self._segments(bitmax))
+            segments += merged
+            classes += [(address_class, bitmax)] * len(merged)
+
+        return segments, classes
+
+    def sample(self, count, seed=None):
+        '''Return a list of *count* distinct random addresses from the networks of
+the set, like :py:func:`martinellis.cidr.CIDR.sample`. Overlapping networks are
+merged first, so every address in the set is equally likely and drawn at most
+once. *seed* defaults to the *seed* of the set.'''
+
+        if seed is None:
+            seed = self.seed
+
+        segments, classes = self._sample_families()
+        total, offsets = _segment_offsets(segments)
+        result = list()
+
+        # IPv4 and IPv6 segments can hold the same integers, so the family of a
+        # draw comes from its position rather than its value
+        for position in _sample_positions(total, count, seed):
+            index = bisect.bisect_right(offsets, position) - 1
+            address_class, bitmax = classes[index]
+            result.append(address_class._from_int(segments[index][0] + position - offsets[index], bitmax))
+
+        return result
+
+    def sample_ints(self, count, seed=None):
+        '''Like :py:func:`martinellis.cidr.CIDRSet.sample`, but return the
+addresses as plain integers.'''
+
+        if seed is None:
+            seed = self.seed
+
+        return _sample_ints(self._sample_families()[0], count, seed)
+
+    def random_ints(self, count, seed=None, as_numpy=False):
+        '''Return *count* random addresses from the networks of the set, drawn
+with replacement, like :py:func:`martinellis.cidr.CIDR.random_ints`. Overlapping
+networks are merged first, so every address in the set is equally likely. A block
+holds a single address family, so the set must not mix IPv4 and IPv6 networks.'''
+
+        bitmaxes = self._bitmaxes()
+
+        if len(bitmaxes) > 1:
+            raise CIDRSetError('cannot draw a block of mixed address families')
+
+        bitmax = bitmaxes[0] if bitmaxes else 32
+
+        return _random_ints(_merged_segments(self._segments(bitmax)), bitmax, count, seed, as_numpy)
+
+    def random_subnet(self, prefix):
+        '''Return a random subnet with the given *prefix* that's aligned within one
+of the networks of this set. Networks are picked weighted by how many such
+subnets they hold, so every candidate subnet is equally likely. Like
+:py:func:`martinellis.cidr.CIDRSet.random_address`, the weights for each *prefix*
+are indexed once until the set changes.'''
+
+        key = ('subnets', prefix)
+
+        if not key in self._cache:
+            networks = [network for network in self.sorted_networks()
+                        if network.prefix <= prefix <= network.address.max]
+            self._cache[key] = (networks, FenwickTree([1 << (prefix - network.prefix) for network in networks]))
+
+        networks, weights = self._cache[key]
+        total = weights.total()
+
+        if not total:
+            raise CIDRSetError('set has no networks that can hold the subnet')
+
+        offset = random.randrange(total)
+        index = weights.find(offset)
+        network = networks[index]
+        subnet = offset - weights.prefix_sum(index)
+        base = network.first + (subnet << (network.address.max - prefix))
+
+        return network.__class__(address=network.address_class._from_int(base, network.address.max)
+                                 ,prefix=prefix
+                                 ,inclusive=network.inclusive
+                                 ,random=network.random
+                                 ,seed=network.seed)
+
+    def _families(self):
+        families = dict()
+
+        for network in self.network_set():
+            bitmax = network.address.max
+            network_class, switches, intervals = families.setdefault(bitmax, (network.__class__, set(), list()))
+            switches.add(network.inclusive)
+            intervals += _held_intervals([network])
+
+        # a family mixing inclusive and non-inclusive networks has no single
+        # switch to rebuild its networks with, so it's marked with None
+        return dict([(bitmax, (network_class
+                               ,switches.pop() if len(switches) == 1 else None
+                               ,merge_intervals(intervals)))
+                     for bitmax, (network_class, switches, intervals) in families.items()])
+
+    @staticmethod
+    def _networks(families):
+        networks = list()
+
+        for bitmax in sorted(families):
+            network_class, inclusive, intervals = families[bitmax]
+
+            if intervals and inclusive is None:
+                raise CIDRSetError('cannot merge inclusive and non-inclusive networks')
+
+            for first, last in intervals:
+                networks += _held_networks(network_class, inclusive, first, last)
+
+        return networks
+
+    def _combine(self, other, keep):
+        if not isinstance(other, CIDRSet):
+            raise CIDRSetError('other must be a CIDRSet')
+
+        return self._combine_families(self._families(), other._families(), keep)
+
+    @staticmethod
+    def _combine_families(left, right, keep):
+        families = dict()
+
+        # the networks of the result take their class and inclusive switch from
+        # the left operand, falling back on the right one
+        for bitmax in set(left) | set(right):
+            network_class, inclusive, intervals = left[bitmax] if bitmax in left else right[bitmax]
+            families[bitmax] = (network_class
+                                ,inclusive
+                                ,combine_intervals(left.get(bitmax, (None, None, list()))[2]
+                                                   ,right.get(bitmax, (None, None, list()))[2]
+                                                   ,keep))
+
+        return families
+
+    def collapsed_networks(self):
+        '''Return a sorted list of the fewest networks holding exactly the same
+addresses as the networks in this set. Overlapping and adjacent networks are
+merged in a single sorted pass per address family. The merged networks keep the
+*inclusive* switch of the networks they were merged from, so merging inclusive
+and non-inclusive networks of the same family raises a
+:py:class:`martinellis.cidr.CIDRSetError`.
+
+Non-inclusive networks don't hold their network and broadcast addresses, so
+adjacent ones are left apart rather than merged into a larger network that would
+hold the addresses between them. The set operations and
+:py:func:`martinellis.cidr.CIDRSet.remove` can leave addresses that no
+non-inclusive network holds exactly, such as the first address of a network;
+those are dropped, so the result never holds addresses it shouldn't.'''
+
+        return self._networks(self._families())
+
+    def diff(self, other):
+        '''
+Compare the address space of this set against a newer set *other*. Returns a tuple
+of two sorted lists of the fewest networks covering the address space that was
+added in *other* and the address space that was removed from this set. The sets
+are compared as collapsed address ranges in a linear merge, so splitting or
+joining networks without changing the addresses they cover is not a change::
+
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/16')).diff(CIDRSet(V4CIDR(cidr='10.0.0.0/17'), V4CIDR(cidr='10.0.128.0/17')))
+   ([], [])
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/16')).diff(CIDRSet(V4CIDR(cidr='10.0.0.0/17'), V4CIDR(cidr='10.1.0.0/24')))
+   ([V4CIDR(10.1.0.0/24)], [V4CIDR(10.0.128.0/17)])
+
+The result can be handed to :py:func:`martinellis.cidr.CIDRSet.apply`.'''
+
+        added = self._networks(self._combine(other, lambda old, new: new and not old))
+        removed = self._networks(self._combine(other, lambda old, new: old and not new))
+
+        return added, removed
+
+    def apply(self, changes):
+        '''Apply the *(added, removed)* tuple of network lists returned by
+:py:func:`martinellis.cidr.CIDRSet.diff` to this set in place. The set ends up
+holding the fewest networks covering its old address space, minus the removed
+address space, plus the added address space.'''
+
+        added, removed = changes
+        families = self._combine_families(self._families()
+                                          ,CIDRSet(*added)._families()
+                                          ,lambda current, add: current or add)
+        families = self._combine_families(families
+                                          ,CIDRSet(*removed)._families()
+                                          ,lambda current, remove: current and not remove)
+
+        self._replace(families)
+
+    def _replace(self, families):
+        networks = self._networks(families)
+
+        super(CIDRSet, self).clear()
+        super(CIDRSet, self).update(networks)
+        self._changed()
+
+        if self.collapsed:
+            # collapsed sets keep the sorted bounds of their merged ranges, so
+            # adding and removing a network only re-splits the ranges it touches
+            self._index = dict([(bitmax, (network_class
+                                          ,inclusive
+                                          ,[first for first, last in intervals]
+                                          ,[last for first, last in intervals]))
+                                for bitmax, (network_class, inclusive, intervals) in families.items()])
+
+    def _respan(self, bitmax, start, stop, intervals):
+        network_class, inclusive, firsts, lasts = self._index[bitmax]
+        old = list(zip(firsts[start:stop], lasts[start:stop]))
+
+        if old == intervals:
+            return
+
+        for first, last in old:
+            for network in _held_networks(network_class, inclusive, first, last):
+                super(CIDRSet, self).discard(network)
+
+        for first, last in intervals:
+            super(CIDRSet, self).update(_held_networks(network_class, inclusive, first, last))
+
+        firsts[start:stop] = [first for first, last in intervals]
+        lasts[start:stop] = [last for first, last in intervals]
+
+    def _collapsed_add(self, element):
+        bitmax = element.address.max
+        network_class, inclusive, firsts, lasts = self._index.setdefault(bitmax, (element.__class__, element.inclusive, list(), list()))
+
+        if not element.inclusive == inclusive:
+            raise CIDRSetError('cannot merge inclusive and non-inclusive networks')
+
+        if element._low > element._high:
+            return
+
+        # the ranges overlapping or touching the network merge with it
+        first = element._low
+        last = element._high
+        start = bisect.bisect_left(lasts, first - 1)
+        stop = bisect.bisect_right(firsts, last + 1)
+
+        if start < stop:
+            first = min(first, firsts[start])
+            last = max(last, lasts[stop - 1])
+
+        self._respan(bitmax, start, stop, [(first, last)])
+
+    def _collapsed_remove(self, element, missing_ok):
+        first = element._low
+        last = element._high
+
+        if first > last:
+            return
+        network_class, inclusive, firsts, lasts = self._index.get(element.address.max, (None, None, list(), list()))
+        start = bisect.bisect_left(lasts, first)
+        stop = bisect.bisect_right(firsts, last)
+
+        if not missing_ok and not (stop - start == 1 and firsts[start] <= first and last <= lasts[start]):
+            raise KeyError(element)
+
+        if start < stop:
+            old = list(zip(firsts[start:stop], lasts[start:stop]))
+            self._respan(element.address.max, start, stop, subtract_intervals(old, [(first, last)]))
+
+    @staticmethod
+    def _operand(other):
+        if isinstance(other, CIDRSet):
+            return other
+
+        if isinstance(other, CIDR):
+            return CIDRSet(other)
+
+        networks = list(other)
+
+        for network in networks:
+            if not isinstance(network, CIDR):
+                raise CIDRSetError('operand must hold CIDR objects')
+
+        return CIDRSet(*networks)
+
+    def _algebra(self, others, keep):
+        families = self._families()
+
+        for other in others:
+            families = self._combine_families(families, self._operand(other)._families(), keep)
+
+        return families
+
+    def union(self, *others):
+        '''
+Return a new set holding the fewest networks covering the address space of this
+set and every set in *others*. Unlike the union of Python sets, this works on
+addresses rather than network objects, so overlapping networks are merged.
+*others* can be :py:class:`martinellis.cidr.CIDRSet` objects, single
+:py:class:`martinellis.cidr.CIDR` objects or iterables of them. This and the other
+set operations are linear sweeps over the sorted address ranges of each
+family. The resulting networks keep the *inclusive* switch of the networks of
+this set, or of *others* for address families this set doesn't hold.'''
+
+        return self.__class__(*self._networks(self._algebra(others, lambda left, right: left or right)), **self.__dict__)
+
+    def intersection(self, *others):
+        '''
+Return a new set holding the fewest networks covering the address space shared by
+this set and every set in *others*. Example::
+
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/8')).intersection(CIDRSet(V4CIDR(cidr='10.1.0.0/16')))
+   CIDRSet({V4CIDR(10.1.0.0/16)})
+
+See :py:func:`martinellis.cidr.CIDRSet.union`.'''
+
+        return self.__class__(*self._networks(self._algebra(others, lambda left, right: left and right)), **self.__dict__)
+
+    def difference(self, *others):
+        '''Return a new set holding the fewest networks covering the address space
+of this set that is in none of the sets in *others*. See
+:py:func:`martinellis.cidr.CIDRSet.union`.'''
+
+        return self.__class__(*self._networks(self._algebra(others, lambda left, right: left and not right)), **self.__dict__)
+
+    def symmetric_difference(self, other):
+        '''Return a new set holding the fewest networks covering the address space
+in exactly one of this set and *other*. See
+:py:func:`martinellis.cidr.CIDRSet.union`.'''
+
+        return self.__class__(*self._networks(self._algebra([other], lambda left, right: left != right)), **self.__dict__)
+
+    def complement(self, within=None):
+        '''
+Return a new set holding the fewest networks covering the address space of
+*within* that is not in this set. *within* can be a
+:py:class:`martinellis.cidr.CIDRSet`, a :py:class:`martinellis.cidr.CIDR` or an
+iterable of them, and defaults to the whole address space of every address family
+in this set. Example::
+
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/9')).complement(V4CIDR(cidr='10.0.0.0/8'))
+   CIDRSet({V4CIDR(10.128.0.0/9)})
+
+
+'''
+
+        inner = self._families()
+
+        if within is None:
+            outer = dict([(bitmax, (network_class, inclusive, [(0, (1 << bitmax) - 1)]))
+                          for bitmax, (network_class, inclusive, intervals) in inner.items()])
+        else:
+            outer = self._operand(within)._families()
+
+        families = self._combine_families(outer, inner, lambda outside, inside: outside and not inside)
+
+        return self.__class__(*self._networks(families), **self.__dict__)
+
+    def intersection_update(self, *others):
+        '''Update this set in place to the result of
+:py:func:`martinellis.cidr.CIDRSet.intersection`.'''
+
+        self._replace(self._algebra(others, lambda left, right: left and right))
+
+    def difference_update(self, *others):
+        '''Update this set in place to the result of
+:py:func:`martinellis.cidr.CIDRSet.difference`.'''
+
+        self._replace(self._algebra(others, lambda left, right: left and not right))
+
+    def symmetric_difference_update(self, other):
+        '''Update this set in place to the result of
+:py:func:`martinellis.cidr.CIDRSet.symmetric_difference`.'''
+
+        self._replace(self._algebra([other], lambda left, right: left != right))
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __xor__(self, other):
+        return self.symmetric_difference(other)
+
+    def __ior__(self, other):
+        self._replace(self._algebra([other], lambda left, right: left or right))
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def collapse(self):
+        '''
+Return a copy of this set holding the fewest networks that hold exactly the same
+addresses. Overlapping networks and adjacent networks that form a larger aligned
+network are merged, except for non-inclusive networks, see
+:py:func:`martinellis.cidr.CIDRSet.collapsed_networks`. Example::
+
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.1.0/24'), V4CIDR(cidr='10.0.0.128/25')).collapse()
+   CIDRSet({V4CIDR(10.0.0.0/23)})
+
+
+'''
+
+        return self.__class__(*self.collapsed_networks(), **self.__dict__)
+
+    def save(self, filename):
+        '''
+Compile the address space covered by this set into the binary table format of
+:py:mod:`martinellis.table` and write it to *filename*. The file holds the sorted,
+merged ranges of each address family, and can be loaded with
+:py:func:`martinellis.table.CIDRTable.load` to answer membership checks straight
+from the mapped file. Like :py:func:`martinellis.cidr.CIDRSet.collapse`, the table
+covers the full address space of each network regardless of *inclusive*.'''
+
+        table.save(filename, *self._table_ranges())
+
+    def compile(self):
+        '''Compile the address space covered by this set into an in-memory
+:py:class:`martinellis.table.CIDRTable`, the same table
+:py:func:`martinellis.cidr.CIDRSet.save` writes. The table is an immutable
+snapshot: changing the set afterwards doesn't change the table, so it can be read
+by many threads while the set is rebuilt elsewhere. See
+:py:class:`martinellis.table.TableHolder` for swapping in new snapshots.'''
+
+        return table.compile(*self._table_ranges())
+
+    def _table_ranges(self):
+        families = {32: list(), 128: list()}
+
+        for network in self.network_set():
+            families[network.address.max].append((network.first, network.last))
+
+        return merge_intervals(families[32]), merge_intervals(families[128])
+
+    def _collapse_update(self):
+        self._replace(self._families())
+
     def copy(self):
         '''Return a copy of this object.'''
         
@@ -471,23 +1804,94 @@ to the constructor are interpretted as the dataset containing
         if not isinstance(element, CIDR):
             raise CIDRSetError('element must be a CIDR object')
 
-        super(CIDRSet, self).add(element)
+        if self.collapsed:
+            self._collapsed_add(element)
+        else:
+            super(CIDRSet, self).add(element)
+
+        self._changed()
+
+    def update(self, *others):
+        '''Add the :py:class:`martinellis.cidr.CIDR` objects from each iterable in
+*others* to this set.'''
+
+        elements = list()
+
+        for other in others:
+            for element in other:
+                if not isinstance(element, CIDR):
+                    raise CIDRSetError('element must be a CIDR object')
+
+                elements.append(element)
+
+        # merging a few networks into a large collapsed set is cheaper one at a
+        # time, and many networks are cheaper in one sorted pass
+        if self.collapsed and len(elements) < len(self):
+            for element in elements:
+                self._collapsed_add(element)
+
+            self._changed()
+            return
+
+        super(CIDRSet, self).update(elements)
+        self._changed()
+
+        if self.collapsed:
+            self._collapse_update()
 
     def remove(self, element):
-        '''Remove a :py:class:`martinellis.cidr.CIDR` object from this set.'''
+        '''Remove a :py:class:`martinellis.cidr.CIDR` object from this set. In a
+collapsed set, the address space of *element* is removed instead, splitting the
+network it was merged into, and a ``KeyError`` is raised unless all of it is in
+the set.'''
 
         if not isinstance(element, CIDR):
             raise CIDRSetError('element must be a CIDR object')
 
-        super(CIDRSet, self).remove(element)
+        if self.collapsed:
+            self._collapsed_remove(element, False)
+        else:
+            super(CIDRSet, self).remove(element)
+
+        self._changed()
 
     def discard(self, element):
         '''Remove a :py:class:`martinellis.cidr.CIDR` object from this set only if
-it is present.'''
+it is present. In a collapsed set, whatever part of the address space of
+*element* is in the set is removed.'''
         if not isinstance(element, CIDR):
             raise CIDRSetError('element must be a CIDR object')
 
-        super(CIDRSet, self).discard(element)
+        if self.collapsed:
+            self._collapsed_remove(element, True)
+        else:
+            super(CIDRSet, self).discard(element)
+
+        self._changed()
+
+    def pop(self):
+        '''Remove and return an arbitrary :py:class:`martinellis.cidr.CIDR` object
+from this set.'''
+
+        self._changed()
+
+        if not self.collapsed:
+            return super(CIDRSet, self).pop()
+
+        for element in super(CIDRSet, self).__iter__():
+            self._collapsed_remove(element, False)
+            return element
+
+        raise KeyError('pop from an empty set')
+
+    def clear(self):
+        '''Remove every network from this set.'''
+
+        super(CIDRSet, self).clear()
+        self._changed()
+
+        if self.collapsed:
+            self._index = dict()
 
     def has_address(self, address_obj):
         '''Check if any element in the set has a given
@@ -503,6 +1907,36 @@ it is present.'''
 
         return False
 
+    def match_many(self, addresses):
+        '''
+Vectorized longest-prefix match of an array of addresses against the networks in
+this set. *addresses* takes the same form as in
+:py:func:`martinellis.cidr.CIDR.contains_many`. Returns a tuple of the list of
+networks in the set of the same address family and a NumPy integer array
+holding, for each address, the index into that list of the most specific network
+containing it, or -1 if no network contains it. Requires NumPy.'''
+
+        keys, bitmax = vector.as_keys(addresses)
+        networks = [network for network in self.network_set() if network.address.max == bitmax]
+        bounds = list()
+
+        for index, network in enumerate(networks):
+            first = network._low
+            last = network._high
+
+            if first <= last:
+                bounds.append((first, last, network.prefix, index))
+
+        return networks, vector.search(keys, bitmax, vector.flatten(bounds))
+
+    def contains_many(self, addresses):
+        '''Vectorized version of :py:func:`martinellis.cidr.CIDRSet.has_address`.
+Returns a boolean mask of the addresses in *addresses* that are members of any
+network in this set. See :py:func:`martinellis.cidr.CIDRSet.match_many`.'''
+
+        networks, indexes = self.match_many(addresses)
+        return indexes >= 0
+
     def is_subset_of(self, cidr_obj):
         '''Check if this set of networks is a subset of *cidr_obj*. Essentially
 calls :py:func:`martinellis.cidr.CIDR.is_subset_of` on each CIDR in the set.'''
@@ -532,6 +1966,13 @@ calls :py:func:`martinellis.cidr.CIDR.is_superset_of` on each CIDR in the set.''
     def __copy__(self):
         return self.copy()
 
+    def __reduce__(self):
+        state = dict(self.__dict__)
+        # the cached indexes hold closures, and are rebuilt on demand anyway
+        state['_cache'] = dict()
+
+        return (self.__class__, tuple(self.network_set()), state)
+
     def __lshift__(self, other):
         '''If *other* is an :py:class:`martinellis.address.Address` object, check
 if it is not a member of this set of networks. If *other* is a
@@ -573,36 +2014,34 @@ over the addresses contained in the networks. Otherwise, iterate over the networ
 themselves. If *random* is set to **True**, return a randomized version of the
 configuration.'''
         
-        networks = list(self.network_set())
+        networks = self.sorted_networks()
+        generator = random.Random(self.seed)
         
         if self.random:
-            random.shuffle(networks)
+            generator.shuffle(networks)
 
         if not self.addresses:
             for network in networks:
                 yield network
 
-            raise StopIteration
+            return
 
-        if self.random:
-            network_iterators = list(map(randiter, networks))
-        else:
-            network_iterators = list(map(iter, networks))
+        if not self.random:
+            for network in networks:
+                for address in network:
+                    yield address
 
-        while len(network_iterators):
-            if not self.random:
-                iterator = network_iterators.pop(0)
+            return
 
-                for address in iterator:
-                    yield address
+        # pick each address's network weighted by how many addresses it has left,
+        # so every remaining address is equally likely to come next
+        network_iterators = [network.permutation(seed=generator.getrandbits(64)) for network in networks]
+        weights = FenwickTree([iterator.length for iterator in network_iterators])
+        remaining = weights.total()
 
-                continue
-            
-            index = random.randrange(0, len(network_iterators))
-            iterator = network_iterators[index]
-
-            try:
-                yield next(iterator)
-            except StopIteration:
-                network_iterators.pop(index)
-                continue
+        while remaining:
+            index = weights.find(generator.randrange(remaining))
+            weights.add(index, -1)
+            remaining -= 1
+
+            yield next(network_iterators[index])
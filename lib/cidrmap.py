@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+
+import json
+
+from martinellis import address, cidr, table, vector
+from martinellis.compat import *
+
+class CIDRMapError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`CIDRMap`
+objects.'''
+
+    pass
+
+class _TrieNode(object):
+    '''A single node in the path-compressed binary trie backing a
+:py:class:`CIDRMap`. Nodes without a *key* are glue nodes that only exist to
+branch two subtrees apart.'''
+
+    __slots__ = ('network', 'prefix', 'mask', 'children', 'key', 'value')
+
+    def __init__(self, network, prefix, bitmax, key=None, value=None):
+        self.network = network
+        self.prefix = prefix
+        self.mask = ((1 << prefix) - 1) << (bitmax - prefix)
+        self.children = [None, None]
+        self.key = key
+        self.value = value
+
+class CIDRMap(object):
+    '''
+A mapping of :py:class:`martinellis.cidr.CIDR` keys to arbitrary values. Keys of
+both address families can be mixed in the same map. Besides the normal mapping
+interface, it supports longest-prefix-match lookups of addresses via
+:py:func:`martinellis.cidrmap.CIDRMap.lookup`. An example::
+
+   >>> routes = CIDRMap((V4CIDR(cidr='10.0.0.0/8'), 'core'), (V4CIDR(cidr='10.1.0.0/16'), 'lab'))
+   >>> routes.lookup(V4Address(value='10.1.2.3'))
+   'lab'
+   >>> routes.lookup(V4Address(value='10.2.3.4'))
+   'core'
+
+The map is backed by a path-compressed binary (Patricia) trie per address
+family, so lookups, insertions and removals take time proportional to the prefix
+length rather than the number of networks in the map.
+
+
+'''
+
+    def __init__(self, *args):
+        '''Create a :py:class:`martinellis.cidrmap.CIDRMap` object. *args* offered
+to the constructor are interpretted as *(cidr, value)* pairs to insert into the
+map. Keys can be :py:class:`martinellis.cidr.CIDR` objects or CIDR strings.'''
+
+        self._roots = dict()
+        self._length = 0
+
+        self.update(args)
+
+    @staticmethod
+    def _network_key(cidr_obj):
+        if isinstance(cidr_obj, (str, unicode)):
+            cidr_obj = cidr.CIDR.blind_assertion(cidr_obj)
+
+        if not isinstance(cidr_obj, cidr.CIDR):
+            raise CIDRMapError('key must be a CIDR object or a CIDR string')
+
+        bitmax = cidr_obj.address.max
+        network = cidr_obj.first
+
+        return cidr_obj, network, cidr_obj.prefix, bitmax
+
+    def _find(self, network, prefix, bitmax):
+        node = self._roots.get(bitmax, None)
+
+        while node is not None and node.prefix < prefix:
+            node = node.children[(network >> (bitmax - 1 - node.prefix)) & 1]
+
+        if node is None or node.key is None:
+            return None
+
+        if not node.prefix == prefix or not node.network == network:
+            return None
+
+        return node
+
+    def _insert(self, cidr_obj, network, prefix, bitmax, value):
+        node = self._roots.get(bitmax, None)
+
+        if node is None:
+            node = _TrieNode(0, 0, bitmax)
+            self._roots[bitmax] = node
+
+        while 1:
+            if node.prefix == prefix:
+                if node.key is None:
+                    self._length += 1
+
+                node.key = cidr_obj
+                node.value = value
+                return
+
+            bit = (network >> (bitmax - 1 - node.prefix)) & 1
+            child = node.children[bit]
+
+            if child is None:
+                node.children[bit] = _TrieNode(network, prefix, bitmax, cidr_obj, value)
+                self._length += 1
+                return
+
+            limit = min(child.prefix, prefix)
+            diff = (child.network ^ network) >> (bitmax - limit)
+            common = limit - diff.bit_length()
+
+            if common == child.prefix:
+                node = child
+                continue
+
+            if common == prefix:
+                new_node = _TrieNode(network, prefix, bitmax, cidr_obj, value)
+            else:
+                new_node = _TrieNode(network & ~((1 << (bitmax - common)) - 1), common, bitmax)
+                new_bit = (network >> (bitmax - 1 - common)) & 1
+                new_node.children[new_bit] = _TrieNode(network, prefix, bitmax, cidr_obj, value)
+
+            child_bit = (child.network >> (bitmax - 1 - common)) & 1
+            new_node.children[child_bit] = child
+            node.children[bit] = new_node
+            self._length += 1
+            return
+
+    def _remove(self, network, prefix, bitmax):
+        node = self._roots.get(bitmax, None)
+        path = list()
+
+        while node is not None and node.prefix < prefix:
+            path.append(node)
+            node = node.children[(network >> (bitmax - 1 - node.prefix)) & 1]
+
+        if node is None or node.key is None or not node.network == network or not node.prefix == prefix:
+            return False
+
+        node.key = None
+        node.value = None
+        self._length -= 1
+
+        # splice out any nodes that no longer hold a value or branch the trie
+        while path and node.key is None:
+            children = [child for child in node.children if child is not None]
+
+            if len(children) > 1:
+                break
+
+            parent = path.pop()
+            parent.children[parent.children.index(node)] = children[0] if children else None
+            node = parent
+
+        return True
+
+    def _walk(self):
+        stack = [self._roots[bitmax] for bitmax in sorted(self._roots, reverse=True)]
+
+        while stack:
+            node = stack.pop()
+
+            if node.key is not None:
+                yield node
+
+            for child in reversed(node.children):
+                if child is not None:
+                    stack.append(child)
+
+    def _matches(self, address_obj):
+        if isinstance(address_obj, (str, unicode)):
+            address_obj = address.Address.blind_assertion(address_obj)
+
+        if not isinstance(address_obj, address.Address):
+            raise CIDRMapError('can only look up Address objects or address strings')
+
+        bitmax = address_obj.max
+        value = address_obj.value
+        node = self._roots.get(bitmax, None)
+
+        while node is not None and value & node.mask == node.network:
+            if node.key is not None:
+                yield node
+
+            if node.prefix == bitmax:
+                break
+
+            node = node.children[(value >> (bitmax - 1 - node.prefix)) & 1]
+
+    def lookup(self, address_obj, default=None):
+        '''Return the value of the most specific network containing
+*address_obj*, or *default* if no network in the map contains it. *address_obj*
+can be a :py:class:`martinellis.address.Address` object or an address string.'''
+
+        match = self.longest_match(address_obj)
+
+        if match is None:
+            return default
+
+        return match[1]
+
+    def longest_match(self, address_obj):
+        '''Return a *(cidr, value)* tuple for the most specific network containing
+*address_obj*, or **None** if no network in the map contains it.'''
+
+        if isinstance(address_obj, (str, unicode)):
+            address_obj = address.Address.blind_assertion(address_obj)
+
+        if not isinstance(address_obj, address.Address):
+            raise CIDRMapError('can only look up Address objects or address strings')
+
+        bitmax = address_obj.max
+        value = address_obj.value
+        node = self._roots.get(bitmax, None)
+        best = None
+
+        while node is not None and value & node.mask == node.network:
+            if node.key is not None:
+                best = node
+
+            if node.prefix == bitmax:
+                break
+
+            node = node.children[(value >> (bitmax - 1 - node.prefix)) & 1]
+
+        if best is None:
+            return None
+
+        return (best.key, best.value)
+
+    def matches(self, address_obj):
+        '''Return an iterator of *(cidr, value)* tuples for every network
+containing *address_obj*, from the least specific to the most specific.'''
+
+        for node in self._matches(address_obj):
+            yield (node.key, node.value)
+
+    def get(self, key, default=None):
+        '''Return the value stored for the exact network *key*, or *default* if
+it is not in the map.'''
+
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+        node = self._find(network, prefix, bitmax)
+
+        if node is None:
+            return default
+
+        return node.value
+
+    def update(self, items):
+        '''Insert every *(cidr, value)* pair from *items* into the map. *items*
+can also be a dictionary or another :py:class:`martinellis.cidrmap.CIDRMap`.'''
+
+        if isinstance(items, (dict, CIDRMap)):
+            items = items.items()
+
+        for key, value in items:
+            self[key] = value
+
+    def pop(self, key, *default):
+        '''Remove the exact network *key* from the map and return its value. If
+the key is missing, return *default* if given or raise a KeyError.'''
+
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+        node = self._find(network, prefix, bitmax)
+
+        if node is None:
+            if default:
+                return default[0]
+
+            raise KeyError(key)
+
+        value = node.value
+        self._remove(network, prefix, bitmax)
+        return value
+
+    def clear(self):
+        '''Remove every network from the map.'''
+
+        self._roots = dict()
+        self._length = 0
+
+    def keys(self):
+        '''Return an iterator of the networks in the map, sorted by address
+family, network address and prefix.'''
+
+        for node in self._walk():
+            yield node.key
+
+    def values(self):
+        '''Return an iterator of the values in the map, in the same order as
+:py:func:`martinellis.cidrmap.CIDRMap.keys`.'''
+
+        for node in self._walk():
+            yield node.value
+
+    def items(self):
+        '''Return an iterator of *(cidr, value)* tuples in the map, in the same
+order as :py:func:`martinellis.cidrmap.CIDRMap.keys`.'''
+
+        for node in self._walk():
+            yield (node.key, node.value)
+
+    def save(self, filename):
+        '''
+Compile this map into the binary table format of :py:mod:`martinellis.table` and
+write it to *filename*. Overlapping networks are flattened into disjoint ranges
+owned by the most specific network, so
+:py:func:`martinellis.table.CIDRTable.lookup` on the loaded table returns the same
+value as :py:func:`martinellis.cidrmap.CIDRMap.lookup`. Values must be
+serializable as JSON, and equal values are only stored once.'''
+
+        table.save(filename, *self._table_ranges())
+
+    def compile(self):
+        '''Compile this map into an in-memory
+:py:class:`martinellis.table.CIDRTable`, the same table
+:py:func:`martinellis.cidrmap.CIDRMap.save` writes. The table is an immutable
+snapshot that stays the same while the map is changed, see
+:py:class:`martinellis.table.TableHolder`.'''
+
+        return table.compile(*self._table_ranges())
+
+    def _table_ranges(self):
+        values = list()
+        indexes = dict()
+        bounds = {32: list(), 128: list()}
+
+        for node in self._walk():
+            try:
+                encoded = json.dumps(node.value, sort_keys=True)
+            except (TypeError, ValueError):
+                raise CIDRMapError('value for %s cannot be serialized as JSON' % node.key)
+
+            if not encoded in indexes:
+                indexes[encoded] = len(values)
+                values.append(node.value)
+
+            bitmax = node.key.address.max
+            last = node.network | (~node.mask & ((1 << bitmax) - 1))
+            bounds[bitmax].append((node.network, last, node.prefix, indexes[encoded]))
+
+        return vector.flatten(bounds[32]), vector.flatten(bounds[128]), values
+
+    def __setitem__(self, key, value):
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+        self._insert(cidr_obj, network, prefix, bitmax, value)
+
+    def __getitem__(self, key):
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+        node = self._find(network, prefix, bitmax)
+
+        if node is None:
+            raise KeyError(key)
+
+        return node.value
+
+    def __delitem__(self, key):
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+
+        if not self._remove(network, prefix, bitmax):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        cidr_obj, network, prefix, bitmax = self._network_key(key)
+        return self._find(network, prefix, bitmax) is not None
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__
+                           ,', '.join(['%s: %r' % (key, value) for key, value in self.items()]))
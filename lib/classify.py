@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+
+from martinellis import address, cidrmap, table
+from martinellis.compat import *
+
+class ClassifyError(Exception):
+    '''
+A general error that's raised when errors occur while classifying log files.'''
+
+    pass
+
+CHUNK_SIZE = 16 << 20
+'''The number of bytes of a log file handed to a worker at a time.'''
+
+UNMATCHED = '-'
+'''The label given to lines without an address in any network.'''
+
+ADDRESS_PATTERN = re.compile(br'(?<![0-9A-Za-z.:])'
+                             br'(?:\d{1,3}(?:\.\d{1,3}){3}(?![0-9A-Za-z.])'
+                             br'|[0-9A-Fa-f]{0,4}(?::[0-9A-Fa-f]{0,4}){2,7}(?:\d{1,3}(?:\.\d{1,3}){3})?(?![0-9A-Za-z.:]))')
+'''Matches strings that look like IPv4 or IPv6 addresses. Matches are only
+candidates, and are parsed before they're looked up.'''
+
+_TABLE = None
+
+def load_networks(source):
+    '''
+Read a labeled network list into a :py:class:`martinellis.cidrmap.CIDRMap`.
+*source* is a filename or a text file object with one network per line, followed
+by whitespace and its label. Blank lines and lines starting with ``#`` are
+skipped. Example::
+
+   10.0.0.0/8      corp
+   2001:db8::/32   lab
+
+
+'''
+
+    if isinstance(source, (str, unicode)):
+        with open(source) as fp:
+            return load_networks(fp)
+
+    networks = cidrmap.CIDRMap()
+
+    for line_number, line in enumerate(source, 1):
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split(None, 1)
+
+        if len(fields) < 2:
+            raise ClassifyError('line %d: network without a label' % line_number)
+
+        try:
+            networks[fields[0]] = fields[1]
+        except cidrmap.CIDRMapError:
+            raise ClassifyError('line %d: could not parse network %r' % (line_number, fields[0]))
+
+    return networks
+
+def label_line(lookup_table, line, unmatched=UNMATCHED):
+    '''Return the label of the first address in the bytes *line* found in
+*lookup_table*, or *unmatched* if there is none.'''
+
+    for match in ADDRESS_PATTERN.finditer(line):
+        try:
+            label = lookup_table.lookup(match.group().decode('ascii'))
+        except address.AddressError:
+            continue
+
+        if label is not None:
+            return label
+
+    return unmatched
+
+def _label_bytes(label):
+    # maps can hold any JSON value, and labels that aren't strings are written
+    # the way the lookup server answers them
+    if isinstance(label, (str, unicode)):
+        return label.encode('utf-8')
+
+    return json.dumps(label, sort_keys=True).encode('utf-8')
+
+def byte_ranges(filename, chunk_size=CHUNK_SIZE):
+    '''Split *filename* into a list of *(filename, start, stop)* byte ranges of
+about *chunk_size* bytes. A range owns every line that starts inside it, so
+ranges can be classified independently of each other.'''
+
+    if chunk_size < 1:
+        raise ClassifyError('chunk size must be positive')
+
+    size = os.path.getsize(filename)
+
+    return [(filename, start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+def _init_worker(filename):
+    global _TABLE
+
+    _TABLE = table.CIDRTable.load(filename)
+
+def _classify_range(job):
+    filename, start, stop, unmatched = job
+    result = list()
+
+    with open(filename, 'rb') as fp:
+        if start > 0:
+            # the line running over the start of the range belongs to the range
+            # before it, unless the range starts right after a newline
+            fp.seek(start - 1)
+            fp.readline()
+
+        position = fp.tell()
+
+        while position < stop:
+            line = fp.readline()
+
+            if not line:
+                break
+
+            position += len(line)
+            line = line.rstrip(b'\r\n')
+            label = label_line(_TABLE, line, unmatched)
+            result.append(_label_bytes(label) + b'\t' + line + b'\n')
+
+    return b''.join(result)
+
+def classify(networks, filenames, output, processes=None, chunk_size=CHUNK_SIZE, unmatched=UNMATCHED):
+    '''
+Tag every line of the log files in *filenames* with the label of the first
+address in it that falls within a labeled network, writing ``label<TAB>line``
+lines to the binary file object *output* in the same order as the input. Lines
+without a matching address are labeled *unmatched*. Labels that aren't strings,
+such as numbers or dictionaries, are written as their JSON encoding.
+
+*networks* is a :py:class:`martinellis.cidrmap.CIDRMap` of labels, an iterable of
+*(cidr, label)* pairs, or a labeled network list read with
+:py:func:`load_networks`. The networks are compiled into a
+:py:class:`martinellis.table.CIDRTable` that every worker maps from disk, and the
+logs are split into byte ranges of *chunk_size* bytes that are classified by a
+pool of *processes* worker processes, defaulting to one per CPU. Returns the
+number of lines written.'''
+
+    global _TABLE
+
+    if isinstance(networks, (str, unicode)):
+        networks = load_networks(networks)
+    elif not isinstance(networks, cidrmap.CIDRMap):
+        networks = cidrmap.CIDRMap(*networks)
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, 'networks.tbl')
+    jobs = list()
+
+    for log_filename in filenames:
+        jobs += [job + (unmatched,) for job in byte_ranges(log_filename, chunk_size)]
+
+    try:
+        networks.save(filename)
+        lines = 0
+
+        if processes == 1:
+            _init_worker(filename)
+            results = map(_classify_range, jobs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes, _init_worker, (filename,))
+            results = pool.imap(_classify_range, jobs)
+
+        try:
+            for data in results:
+                output.write(data)
+                lines += data.count(b'\n')
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    finally:
+        if _TABLE is not None:
+            _TABLE.close()
+            _TABLE = None
+
+        shutil.rmtree(directory)
+
+    return lines
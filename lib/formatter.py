@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import itertools
+import socket
+import struct
+
+from martinellis import address, cidr, iprange, vector
+from martinellis.compat import *
+
+class FormatterError(Exception):
+    '''
+A general error that's raised when errors occur while formatting addresses.'''
+
+    pass
+
+COMPRESSED = 'compressed'
+'''Format IPv6 addresses in their shortest form, the same way as
+:py:func:`martinellis.address.V6Address.__str__`.'''
+
+EXPLODED = 'exploded'
+'''Format IPv6 addresses with all eight groups of four hex digits.'''
+
+PTR = 'ptr'
+'''Format addresses as their reverse DNS names under ``in-addr.arpa`` or
+``ip6.arpa``.'''
+
+STYLES = (COMPRESSED, EXPLODED, PTR)
+'''Every style accepted by the formatting functions.'''
+
+BATCH_SIZE = 65536
+'''The number of addresses formatted and written at a time by :py:func:`write`.'''
+
+_OCTETS = [str(octet).encode('ascii') for octet in range(256)]
+_PAIRS = None
+_PTR_PAIRS = None
+
+def _v4_tables():
+    global _PAIRS, _PTR_PAIRS
+
+    # a table of every pair of octets halves the work per address, and is only
+    # built the first time it's needed
+    if _PAIRS is None:
+        _PAIRS = [_OCTETS[pair >> 8] + b'.' + _OCTETS[pair & 0xFF] for pair in range(1 << 16)]
+        _PTR_PAIRS = [_OCTETS[pair & 0xFF] + b'.' + _OCTETS[pair >> 8] for pair in range(1 << 16)]
+
+    return _PAIRS, _PTR_PAIRS
+
+def format_v4(values, style=COMPRESSED):
+    '''Format an iterable of integer IPv4 addresses, returning a list of byte
+strings. IPv4 addresses look the same compressed and exploded.'''
+
+    pairs, ptr_pairs = _v4_tables()
+
+    if style == PTR:
+        return [ptr_pairs[value & 0xFFFF] + b'.' + ptr_pairs[value >> 16] + b'.in-addr.arpa' for value in values]
+
+    if not style in STYLES:
+        raise FormatterError('unknown style %r' % style)
+
+    return [pairs[value >> 16] + b'.' + pairs[value & 0xFFFF] for value in values]
+
+def format_v6(values, style=COMPRESSED):
+    '''Format an iterable of integer IPv6 addresses, returning a list of byte
+strings.'''
+
+    if style == COMPRESSED:
+        # inet_ntop keeps the output identical to V6Address.__str__, and is
+        # faster than compressing the groups in Python
+        inet_ntop = socket.inet_ntop
+        family = socket.AF_INET6
+
+        if env == 3:
+            return [inet_ntop(family, value.to_bytes(16, 'big')).encode('ascii') for value in values]
+
+        return [inet_ntop(family, struct.pack('>QQ', value >> 64, value & 0xFFFFFFFFFFFFFFFF)) for value in values]
+
+    if style == EXPLODED:
+        return [':'.join([hexed[index:index+4] for index in range(0, 32, 4)]).encode('ascii')
+                for hexed in ['%032x' % value for value in values]]
+
+    if style == PTR:
+        return [('.'.join(('%032x' % value)[::-1]) + '.ip6.arpa').encode('ascii') for value in values]
+
+    raise FormatterError('unknown style %r' % style)
+
+def format_ints(values, bitmax, style=COMPRESSED):
+    '''Format an iterable of integer addresses of the family with *bitmax* bits,
+returning a list of byte strings. See :py:func:`format_v4` and
+:py:func:`format_v6`.'''
+
+    if bitmax == 32:
+        return format_v4(values, style)
+
+    if bitmax == 128:
+        return format_v6(values, style)
+
+    raise FormatterError('unsupported address family')
+
+def _families(source, bitmax):
+    if isinstance(source, cidr.CIDRSet):
+        for family in (32, 128):
+            segments = source._segments(family)
+
+            if segments:
+                yield family, cidr._iter_ints(segments, source.random, source.seed)
+    elif isinstance(source, cidr.CIDR):
+        yield source.address.max, source.iter_ints()
+    elif isinstance(source, iprange.IPRange):
+        yield source.ADDRESS_CLASS.MAX, source.iter_ints()
+    elif vector.numpy is not None and isinstance(source, vector.numpy.ndarray):
+        if source.ndim == 1:
+            yield 32, source.tolist()
+        else:
+            yield 128, (high << 64 | low for high, low in source.tolist())
+    elif isinstance(source, address.Address):
+        yield source.max, [source.value]
+    else:
+        if bitmax is None:
+            raise FormatterError('bitmax is required to format plain integers')
+
+        yield bitmax, source
+
+def write(output, source, bitmax=None, style=COMPRESSED, separator=b'\n', batch_size=BATCH_SIZE):
+    '''
+Format the addresses of *source* and write them to *output*, each followed by
+*separator*. Returns the number of addresses written. *output* is a binary file
+object or a :py:class:`bytearray` to append to, which can be cleared and reused
+between calls. *source* is one of:
+
+   * a :py:class:`martinellis.cidr.CIDR`, :py:class:`martinellis.cidr.CIDRSet` or
+     :py:class:`martinellis.iprange.IPRange`, formatted in the order of their
+     ``iter_ints`` method, IPv4 addresses first for sets
+   * a NumPy array in the form accepted by
+     :py:func:`martinellis.cidr.CIDR.contains_many`
+   * any other iterable of integers, such as an ``array('I')``, of the family
+     with *bitmax* bits
+
+*style* is one of :py:data:`COMPRESSED`, :py:data:`EXPLODED` or :py:data:`PTR`.
+No :py:class:`martinellis.address.Address` objects are created along the way,
+and addresses are written *batch_size* at a time. For example, a reverse zone::
+
+   >>> with open('zone.txt', 'wb') as fp:
+   ...     write(fp, V4CIDR(cidr='10.0.0.0/8'), style=PTR, separator=b' PTR host.example.\\n')
+   ...
+   16777216
+
+
+'''
+
+    if not style in STYLES:
+        raise FormatterError('unknown style %r' % style)
+
+    if batch_size < 1:
+        raise FormatterError('batch size must be positive')
+
+    append = output.extend if isinstance(output, bytearray) else output.write
+    count = 0
+
+    for family, values in _families(source, bitmax):
+        values = iter(values)
+
+        while True:
+            batch = format_ints(itertools.islice(values, batch_size), family, style)
+
+            if not batch:
+                break
+
+            batch.append(b'')
+            append(separator.join(batch))
+            count += len(batch) - 1
+
+    return count
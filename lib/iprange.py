@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+from martinellis import address, cidr, permutation, vector
+from martinellis.compat import *
+
+class IPRangeError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`IPRange`
+objects.'''
+
+    pass
+
+class IPRange(object):
+    '''
+An arbitrary, unaligned range of addresses from a first to a last address
+inclusive, such as the ``start-end`` ranges found in GeoIP databases, RIR
+delegations and firewall exports. Ranges iterate, slice into shards and check
+membership like :py:class:`martinellis.cidr.CIDR` objects, and convert to and
+from the fewest aligned networks covering them. An example::
+
+   >>> V4Range(range='10.0.0.1-10.0.0.6').to_cidrs()
+   [V4CIDR(10.0.0.1/32), V4CIDR(10.0.0.2/31), V4CIDR(10.0.0.4/31), V4CIDR(10.0.0.6/32)]
+
+'''
+
+    ADDRESS_CLASS = None
+    '''The :py:class:`martinellis.address.Address` class of the range.'''
+
+    CIDR_CLASS = None
+    '''The :py:class:`martinellis.cidr.CIDR` class of the networks returned by
+:py:func:`martinellis.iprange.IPRange.to_cidrs`.'''
+
+    FIRST = None
+    '''The default first address of the range.'''
+
+    LAST = None
+    '''The default last address of the range.'''
+
+    RANDOM = False
+    '''Indicate whether to iterate over the range randomly.'''
+
+    SEED = None
+    '''The seed of the random iteration order. See
+:py:func:`martinellis.iprange.IPRange.permutation` for details.'''
+
+    def __init__(self, **kwargs):
+        '''
+Creates an IPRange object. Keyword arguments are:
+
+   *first*: The first address of the range, as an instance of
+   :py:attr:`martinellis.iprange.IPRange.ADDRESS_CLASS`, an address string or an
+   integer.
+
+   *last*: The last address of the range, in the same forms as *first*.
+
+   *range*: A string of the form "10.0.0.1-10.0.0.6". This can be used in place
+   of the *first* and *last* arguments.
+
+   *random*: Randomize address values on iteration.
+
+   *seed*: An integer seed selecting the order of random iteration.
+
+
+'''
+
+        if self.ADDRESS_CLASS is None:
+            raise IPRangeError('range class has no static address class')
+
+        if 'range' in kwargs:
+            new_object = self.__class__.from_string(kwargs['range'])
+            kwargs['first'] = new_object.first
+            kwargs['last'] = new_object.last
+
+        self.first = self._address(kwargs.setdefault('first', self.FIRST))
+        self.last = self._address(kwargs.setdefault('last', self.LAST))
+        self.random = kwargs.setdefault('random', self.RANDOM)
+        self.seed = kwargs.setdefault('seed', self.SEED)
+
+        if self.first.value > self.last.value:
+            raise IPRangeError('first address of range is after its last address')
+
+    def _address(self, value):
+        address_class = self.ADDRESS_CLASS
+
+        if value is None:
+            raise IPRangeError('range bounds not provided')
+
+        if isinstance(value, (str, unicode)):
+            return address_class.from_string(value)
+
+        if isinstance(value, (int, long)):
+            if value < 0 or value >= 1 << address_class.MAX:
+                raise IPRangeError('address exceeds the address space')
+
+            return address_class._from_int(value)
+
+        if not isinstance(value, address_class):
+            raise IPRangeError('range bounds must be instances of the address class')
+
+        return value
+
+    @classmethod
+    def from_string(cls, string):
+        '''Convert a string of the form "first-last" into an
+:py:class:`martinellis.iprange.IPRange` object. A single address is a range of
+one address.'''
+
+        split_range = [part.strip() for part in string.split('-')]
+
+        if len(split_range) > 2:
+            raise IPRangeError('too many bounds in range string')
+
+        return cls(first=split_range[0], last=split_range[-1])
+
+    @classmethod
+    def from_cidrs(cls, cidrs):
+        '''
+Return a sorted list of the fewest :py:class:`martinellis.iprange.IPRange`
+objects covering the full address space of the networks in *cidrs*. Overlapping
+and adjacent networks merge into a single range. Example::
+
+   >>> V4Range.from_cidrs([V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.1.0/25')])
+   [V4Range(10.0.0.0-10.0.1.127)]
+
+'''
+
+        intervals = list()
+
+        for cidr_obj in cidrs:
+            if not isinstance(cidr_obj, cidr.CIDR):
+                raise IPRangeError('can only build ranges from CIDR objects')
+
+            if not cidr_obj.address.max == cls.ADDRESS_CLASS.MAX:
+                raise IPRangeError('address class mismatch')
+
+            intervals.append((cidr_obj.first, cidr_obj.last))
+
+        return [cls(first=first, last=last) for first, last in cidr.merge_intervals(intervals)]
+
+    @staticmethod
+    def blind_assertion(string):
+        '''Tries to convert the string into either a
+:py:class:`martinellis.iprange.V4Range` or a
+:py:class:`martinellis.iprange.V6Range`, raising an
+:py:class:`martinellis.iprange.IPRangeError` if neither works.'''
+
+        if isinstance(string, IPRange):
+            return string
+
+        if not isinstance(string, (str, unicode)):
+            raise IPRangeError('range must be an IPRange object or a string')
+
+        try:
+            if ':' in string:
+                return V6Range.from_string(string)
+
+            return V4Range.from_string(string)
+        except (address.AddressError, IPRangeError, ValueError):
+            raise IPRangeError('could not parse range string blindly')
+
+    def to_cidrs(self):
+        '''Return a list of the fewest :py:class:`martinellis.cidr.CIDR` objects
+covering exactly this range. The networks are *inclusive*, so iterating over them
+yields the same addresses as the range. The decomposition takes at most two
+networks per bit of the address, however large the range is.'''
+
+        return self.CIDR_CLASS.from_range(self.first, self.last, inclusive=True)
+
+    def length(self):
+        '''Count how many addresses are in this range.'''
+
+        return self.last.value - self.first.value + 1
+
+    def get_address(self, index):
+        '''Treat the range like an array and get the address at offset *index*.'''
+
+        if index < 0 or index >= self.length():
+            raise IndexError('index {} out of range'.format(index))
+
+        return self.ADDRESS_CLASS._from_int(self.first.value + index)
+
+    def has_address(self, address_obj):
+        '''Check if the given *address_obj* is within the range.'''
+
+        if not isinstance(address_obj, address.Address):
+            raise IPRangeError('can only check for membership of address objects')
+
+        if not isinstance(address_obj, self.ADDRESS_CLASS):
+            raise IPRangeError('address class mismatch')
+
+        return self.first.value <= address_obj.value <= self.last.value
+
+    def _bounds(self, other):
+        if isinstance(other, IPRange):
+            return other.ADDRESS_CLASS.MAX, other.first.value, other.last.value
+
+        if isinstance(other, cidr.CIDR):
+            return other.address.max, other.first, other.last
+
+        raise IPRangeError('can only compare ranges with IPRange or CIDR objects')
+
+    def is_subset_of(self, other):
+        '''Check if this range lies within *other*, an
+:py:class:`martinellis.iprange.IPRange` or the full address space of a
+:py:class:`martinellis.cidr.CIDR`.'''
+
+        bitmax, first, last = self._bounds(other)
+
+        if not bitmax == self.ADDRESS_CLASS.MAX:
+            return False
+
+        return first <= self.first.value and self.last.value <= last
+
+    def is_superset_of(self, other):
+        '''Check if *other*, an :py:class:`martinellis.iprange.IPRange` or the
+full address space of a :py:class:`martinellis.cidr.CIDR`, lies within this
+range.'''
+
+        bitmax, first, last = self._bounds(other)
+
+        if not bitmax == self.ADDRESS_CLASS.MAX:
+            return False
+
+        return self.first.value <= first and last <= self.last.value
+
+    def contains_many(self, addresses):
+        '''Vectorized version of :py:func:`martinellis.iprange.IPRange.has_address`
+over a NumPy array of addresses, in the form accepted by
+:py:func:`martinellis.cidr.CIDR.contains_many`. Requires NumPy.'''
+
+        keys, bitmax = vector.as_keys(addresses)
+
+        if not bitmax == self.ADDRESS_CLASS.MAX:
+            raise IPRangeError('address class mismatch')
+
+        return vector.in_range(keys, bitmax, self.first.value, self.last.value)
+
+    def permutation(self, seed=None, position=0):
+        '''Return a :py:class:`martinellis.permutation.Permutation` that yields
+every address in the range exactly once in a pseudorandom order. See
+:py:func:`martinellis.cidr.CIDR.permutation`.'''
+
+        length, transform = self._address_index()
+
+        if seed is None:
+            seed = self.seed
+
+        return permutation.Permutation(length, seed=seed, position=position, transform=transform)
+
+    def shard(self, count, index, random=None, seed=None):
+        '''Return a :py:class:`martinellis.cidr.Shard` iterating over the
+*index*-th of *count* non-overlapping slices of the range. See
+:py:func:`martinellis.cidr.CIDR.shard`.'''
+
+        if count < 1 or not 0 <= index < count:
+            raise IPRangeError('shard index out of range')
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        if random and seed is None:
+            raise IPRangeError('random shards need a seed shared by every shard')
+
+        return cidr.Shard(self, count, index, random, seed)
+
+    def iter_ints(self, random=None, seed=None):
+        '''Return an iterator of the addresses in the range as plain integers. See
+:py:func:`martinellis.cidr.CIDR.iter_ints`.'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        return cidr._iter_ints(self._segments(), random, seed)
+
+    def iter_chunks(self, size, random=None, seed=None, as_numpy=False):
+        '''Return an iterator of blocks of up to *size* addresses of the range.
+See :py:func:`martinellis.cidr.CIDR.iter_chunks`.'''
+
+        if random is None:
+            random = self.random
+
+        if seed is None:
+            seed = self.seed
+
+        return cidr._iter_int_chunks(self._segments(), self.ADDRESS_CLASS.MAX, size, random, seed, as_numpy)
+
+    def _segments(self):
+        return [(self.first.value, self.length())]
+
+    def _address_index(self):
+        first = self.first.value
+        address_class = self.ADDRESS_CLASS
+        bitmax = address_class.MAX
+
+        return self.length(), lambda index: address_class._from_int(first + index, bitmax)
+
+    def __str__(self):
+        return '%s-%s' % (self.first, self.last)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, str(self))
+
+    def __eq__(self, other):
+        if not isinstance(other, IPRange):
+            return NotImplemented
+
+        return (self.ADDRESS_CLASS.MAX, self.first.value, self.last.value) == (other.ADDRESS_CLASS.MAX, other.first.value, other.last.value)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+
+        if result is NotImplemented:
+            return result
+
+        return not result
+
+    def __hash__(self):
+        return hash((self.ADDRESS_CLASS.MAX, self.first.value, self.last.value))
+
+    def __len__(self):
+        return self.length()
+
+    def __getitem__(self, index):
+        '''Calls :py:func:`martinellis.iprange.IPRange.get_address`.'''
+
+        return self.get_address(index)
+
+    def __iter__(self):
+        '''Returns an iterator of addresses within the range, in random order if
+the *random* switch is set.'''
+
+        if self.random:
+            for address_obj in self.permutation():
+                yield address_obj
+
+            return
+
+        from_int = self.ADDRESS_CLASS._from_int
+        bitmax = self.ADDRESS_CLASS.MAX
+
+        for value in self.iter_ints(random=False):
+            yield from_int(value, bitmax)
+
+    def __contains__(self, element):
+        '''Check if the *element* is either an address in the range or a range or
+network within it.'''
+
+        if isinstance(element, address.Address):
+            return self.has_address(element)
+
+        return self.is_superset_of(element)
+
+    def __copy__(self):
+        return self.__class__(**self.__dict__)
+
+class V4Range(IPRange):
+    '''A :py:class:`martinellis.iprange.IPRange` class representing a range of
+IPv4 addresses. See :py:class:`martinellis.iprange.IPRange` for functionality.'''
+
+    ADDRESS_CLASS = address.V4Address
+    CIDR_CLASS = cidr.V4CIDR
+
+class V6Range(IPRange):
+    '''A :py:class:`martinellis.iprange.IPRange` class representing a range of
+IPv6 addresses. See :py:class:`martinellis.iprange.IPRange` for functionality.'''
+
+    ADDRESS_CLASS = address.V6Address
+    CIDR_CLASS = cidr.V6CIDR
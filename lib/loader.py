@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+import array
+import mmap
+import os
+import socket
+import sys
+
+from martinellis import vector
+from martinellis.compat import *
+
+class LoaderError(Exception):
+    '''
+A general error that's raised when errors occur while loading address files.'''
+
+    pass
+
+BLOCK_SIZE = 1 << 20
+'''The number of bytes read from the source at a time.'''
+
+def _frombytes(array_obj, data):
+    if hasattr(array_obj, 'frombytes'):
+        array_obj.frombytes(data)
+    else:
+        array_obj.fromstring(data)
+
+    if sys.byteorder == 'little':
+        array_obj.byteswap()
+
+class Chunk(object):
+    '''
+A block of parsed lines. Addresses are stored in compact integer arrays rather
+than :py:class:`martinellis.address.Address` objects:
+
+   *v4*: An ``array('I')`` of IPv4 addresses.
+
+   *v4_prefixes*: An ``array('B')`` of IPv4 network prefixes, parallel to *v4*.
+
+   *v6_high*, *v6_low*: ``array('Q')`` objects holding the high and low 64 bits
+   of each IPv6 address.
+
+   *v6_prefixes*: An ``array('B')`` of IPv6 network prefixes, parallel to
+   *v6_high* and *v6_low*.
+
+   *errors*: A list of *(line_number, line)* tuples for the lines that couldn't
+   be parsed. Line numbers start at 1.
+
+Plain address files get the full prefix of their family for every entry.'''
+
+    __slots__ = ('v4', 'v4_prefixes', 'v6_high', 'v6_low', 'v6_prefixes', 'errors')
+
+    def __init__(self):
+        self.v4 = array.array('I')
+        self.v4_prefixes = array.array('B')
+        self.v6_high = array.array('Q')
+        self.v6_low = array.array('Q')
+        self.v6_prefixes = array.array('B')
+        self.errors = list()
+
+    def extend(self, other):
+        '''Append the entries of another :py:class:`Chunk` to this one.'''
+
+        self.v4.extend(other.v4)
+        self.v4_prefixes.extend(other.v4_prefixes)
+        self.v6_high.extend(other.v6_high)
+        self.v6_low.extend(other.v6_low)
+        self.v6_prefixes.extend(other.v6_prefixes)
+        self.errors.extend(other.errors)
+
+    def as_numpy(self):
+        '''Return a tuple of the IPv4 and IPv6 addresses as NumPy arrays, in the
+form accepted by :py:func:`martinellis.cidr.CIDR.contains_many`. Requires
+NumPy.'''
+
+        vector.require_numpy()
+        numpy = vector.numpy
+
+        v4 = numpy.frombuffer(self.v4, dtype=numpy.uint32) if len(self.v4) else numpy.zeros(0, dtype=numpy.uint32)
+        v6 = numpy.zeros((len(self.v6_high), 2), dtype=numpy.uint64)
+
+        if len(self.v6_high):
+            v6[:, 0] = numpy.frombuffer(self.v6_high, dtype=numpy.uint64)
+            v6[:, 1] = numpy.frombuffer(self.v6_low, dtype=numpy.uint64)
+
+        return v4, v6
+
+    def __len__(self):
+        return len(self.v4) + len(self.v6_high)
+
+def _iter_blocks(source, block_size):
+    if isinstance(source, (str, unicode)):
+        with open(source, 'rb') as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                return
+
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                for block in _iter_blocks(mapped, block_size):
+                    yield block
+            finally:
+                mapped.close()
+
+        return
+
+    if hasattr(source, 'read'):
+        while 1:
+            block = source.read(block_size)
+
+            if not block:
+                return
+
+            yield block
+
+    for offset in range(0, len(source), block_size):
+        yield source[offset:offset+block_size]
+
+def _iter_lines(source, block_size):
+    line_number = 0
+    remainder = b''
+
+    for block in _iter_blocks(source, block_size):
+        lines = (remainder + block).split(b'\n')
+        remainder = lines.pop()
+
+        for line in lines:
+            line_number += 1
+            yield line_number, line
+
+    if remainder:
+        yield line_number + 1, remainder
+
+def _parse_lines(lines, cidrs):
+    chunk = Chunk()
+    v4_packed = list()
+    v6_packed = list()
+    inet_pton = socket.inet_pton
+
+    for line_number, line in lines:
+        entry = line.strip()
+
+        if not entry or entry.startswith(b'#'):
+            continue
+
+        try:
+            entry = entry.decode('ascii')
+
+            if cidrs and '/' in entry:
+                entry, prefix = entry.split('/', 1)
+                prefix = int(prefix)
+            else:
+                prefix = None
+
+            if ':' in entry:
+                if prefix is None:
+                    prefix = 128
+                elif not 0 <= prefix <= 128:
+                    raise ValueError('prefix out of range')
+
+                v6_packed.append(inet_pton(socket.AF_INET6, entry))
+                chunk.v6_prefixes.append(prefix)
+            else:
+                if prefix is None:
+                    prefix = 32
+                elif not 0 <= prefix <= 32:
+                    raise ValueError('prefix out of range')
+
+                v4_packed.append(inet_pton(socket.AF_INET, entry))
+                chunk.v4_prefixes.append(prefix)
+        except (ValueError, UnicodeError, OSError, socket.error):
+            chunk.errors.append((line_number, line))
+
+    _frombytes(chunk.v4, b''.join(v4_packed))
+
+    v6_values = array.array('Q')
+    _frombytes(v6_values, b''.join(v6_packed))
+    chunk.v6_high = v6_values[0::2]
+    chunk.v6_low = v6_values[1::2]
+
+    return chunk
+
+def iter_chunks(source, cidrs=False, chunk_lines=65536, block_size=BLOCK_SIZE):
+    '''
+Parse a newline-delimited file of IPv4 and IPv6 addresses, yielding a
+:py:class:`Chunk` for every *chunk_lines* lines read. Memory use stays bounded by
+the chunk size no matter how large the source is. Blank lines and lines starting
+with ``#`` are skipped, and lines that can't be parsed are reported in the
+chunk's *errors* rather than raising an exception.
+
+*source* can be a filename, which is read through :py:mod:`mmap`, a binary file
+object, or a bytes-like object such as an existing :py:class:`mmap.mmap`. If
+*cidrs* is **True**, lines are parsed as CIDR strings like
+:py:func:`martinellis.cidr.CIDR.from_string` does, and their prefixes are stored in
+the prefix arrays. Example::
+
+   >>> for chunk in iter_chunks('blocklist.txt', cidrs=True):
+   ...     print(len(chunk.v4), len(chunk.v6_high), chunk.errors)
+   ...
+   3 1 [(4, b'not an address')]
+
+
+'''
+
+    if chunk_lines < 1:
+        raise LoaderError('chunk_lines must be positive')
+
+    batch = list()
+
+    for entry in _iter_lines(source, block_size):
+        batch.append(entry)
+
+        if len(batch) >= chunk_lines:
+            yield _parse_lines(batch, cidrs)
+            batch = list()
+
+    if batch:
+        yield _parse_lines(batch, cidrs)
+
+def load(source, cidrs=False, block_size=BLOCK_SIZE):
+    '''Parse an entire address file into a single :py:class:`Chunk`. See
+:py:func:`iter_chunks` for the arguments.'''
+
+    result = Chunk()
+
+    for chunk in iter_chunks(source, cidrs=cidrs, block_size=block_size):
+        result.extend(chunk)
+
+    return result
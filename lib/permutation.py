@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+import random
+
+from martinellis import vector
+from martinellis.compat import *
+
+class PermutationError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`Permutation`
+objects.'''
+
+    pass
+
+class Permutation(object):
+    '''
+A seekable, resumable pseudorandom permutation of the integers from 0 up to
+*length*. Iterating over it visits every integer exactly once in a pseudorandom
+order while only ever holding a handful of integers in memory, no matter how large
+*length* is. An example::
+
+   >>> permutation = Permutation(10, seed=1337)
+   >>> list(permutation)
+   [3, 6, 4, 8, 2, 7, 1, 9, 0, 5]
+   >>> permutation.seek(4)
+   >>> next(permutation)
+   2
+
+The permutation is a keyed Feistel network over the smallest power-of-four sized
+domain that fits *length*, cycle-walked back into range. Any position can be
+computed directly, so :py:func:`Permutation.seek` is O(1), and the whole state
+of an iteration is captured by :py:func:`Permutation.state`.
+
+Class variables can be changed at the class definition to change the default
+behavior of the class.'''
+
+    ROUNDS = 4
+    '''The number of Feistel rounds to run.'''
+
+    MULTIPLIER = 0x9E3779B97F4A7C15
+    '''The odd constant used to mix values inside the round function.'''
+
+    def __init__(self, length, seed=None, position=0, transform=None):
+        '''
+Creates a permutation object. Arguments are:
+
+   *length*: The number of integers to permute.
+
+   *seed*: An integer that selects the permutation. The same *length* and *seed*
+   always produce the same order. If not given, a random seed is picked; it can be
+   read back from :py:func:`Permutation.state`.
+
+   *position*: The position in the permutation to start iterating from.
+
+   *transform*: An optional callable applied to every permuted integer before it
+   is yielded, such as one turning an index into an address object.
+
+
+'''
+
+        if length < 0:
+            raise PermutationError('length must not be negative')
+
+        if seed is None:
+            seed = random.getrandbits(64)
+
+        self.length = length
+        self.seed = seed
+        self.transform = transform
+
+        bits = max(2, (length - 1).bit_length())
+        bits += bits & 1
+
+        self._half = bits // 2
+        self._mask = (1 << self._half) - 1
+        self._shift = (self._half + 1) // 2
+
+        self._schedule_keys()
+        self.seek(position)
+
+    def _schedule_keys(self):
+        generator = random.Random(self.seed)
+        self._keys = [generator.getrandbits(self._half) for i in range(self.ROUNDS)]
+
+    def _round(self, value, key):
+        value = ((value ^ key) * self.MULTIPLIER) & self._mask
+        return value ^ (value >> self._shift)
+
+    def _encrypt(self, value):
+        left = value >> self._half
+        right = value & self._mask
+
+        for key in self._keys:
+            left, right = right, left ^ self._round(right, key)
+
+        return (left << self._half) | right
+
+    def _decrypt(self, value):
+        left = value >> self._half
+        right = value & self._mask
+
+        for key in reversed(self._keys):
+            left, right = right ^ self._round(left, key), left
+
+        return (left << self._half) | right
+
+    def permute(self, index):
+        '''Return the integer at *index* in the permutation, without applying
+*transform*.'''
+
+        if index < 0 or index >= self.length:
+            raise IndexError('index {} out of range of permutation'.format(index))
+
+        value = self._encrypt(index)
+
+        while value >= self.length:
+            value = self._encrypt(value)
+
+        return value
+
+    def permute_many(self, start, stop):
+        '''
+Return a NumPy ``uint64`` array of the integers at positions *start* up to *stop*
+in the permutation, matching :py:func:`Permutation.permute` but computed with
+vectorized operations. Only permutations of up to 2**64 integers are supported.
+Requires NumPy.'''
+
+        vector.require_numpy()
+        numpy = vector.numpy
+
+        if self._half > 32:
+            raise PermutationError('permutation is too large for 64-bit arrays')
+
+        if start < 0 or stop > self.length or start > stop:
+            raise IndexError('positions out of range of permutation')
+
+        values = self._encrypt_many(numpy.arange(start, stop, dtype=numpy.uint64))
+
+        if self.length < 1 << 64:
+            length = numpy.uint64(self.length)
+            pending = numpy.flatnonzero(values >= length)
+
+            while len(pending):
+                values[pending] = self._encrypt_many(values[pending])
+                pending = pending[values[pending] >= length]
+
+        return values
+
+    def _encrypt_many(self, values):
+        numpy = vector.numpy
+        half = numpy.uint64(self._half)
+        mask = numpy.uint64(self._mask)
+        shift = numpy.uint64(self._shift)
+        multiplier = numpy.uint64(self.MULTIPLIER)
+
+        left = values >> half
+        right = values & mask
+
+        for key in self._keys:
+            mixed = ((right ^ numpy.uint64(key)) * multiplier) & mask
+            left, right = right, left ^ mixed ^ (mixed >> shift)
+
+        return (left << half) | right
+
+    def index(self, value):
+        '''Return the position at which *value* appears in the permutation. This is
+the inverse of :py:func:`Permutation.permute`.'''
+
+        if value < 0 or value >= self.length:
+            raise ValueError('{} is not in the permutation'.format(value))
+
+        index = self._decrypt(value)
+
+        while index >= self.length:
+            index = self._decrypt(index)
+
+        return index
+
+    def seek(self, position):
+        '''Move the iteration to *position*, so the next value yielded is the one at
+that position.'''
+
+        if position < 0 or position > self.length:
+            raise PermutationError('position out of range of permutation')
+
+        self.position = position
+
+    def tell(self):
+        '''Return the current position of the iteration.'''
+
+        return self.position
+
+    def state(self):
+        '''Return a dictionary capturing the state of the iteration. It only holds
+integers, so it can be stored as JSON and later passed to
+:py:func:`Permutation.resume`.'''
+
+        return {'length': self.length, 'seed': self.seed, 'position': self.position}
+
+    def resume(self, state):
+        '''Restore an iteration from a dictionary returned by
+:py:func:`Permutation.state`, returning this object.'''
+
+        if not state['length'] == self.length:
+            raise PermutationError('state belongs to a permutation of a different length')
+
+        if not state['seed'] == self.seed:
+            self.seed = state['seed']
+            self._schedule_keys()
+
+        self.seek(state['position'])
+
+        return self
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        '''Return the permuted integer at *index*, passed through *transform* if one
+was given.'''
+
+        if self.transform is None:
+            return self.permute(index)
+
+        return self.transform(self.permute(index))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.position >= self.length:
+            raise StopIteration
+
+        value = self[self.position]
+        self.position += 1
+
+        return value
+
+    next = __next__
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import heapq
+
+from martinellis import cidr
+from martinellis.compat import *
+
+class PoolError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`AddressPool`
+objects.'''
+
+    pass
+
+class AddressPool(object):
+    '''
+An allocator handing out aligned, non-overlapping subnets of a parent
+:py:class:`martinellis.cidr.CIDR`, for address management. Free space is kept as
+free blocks per prefix length, buddy allocator style: allocating
+takes the lowest free block of the smallest prefix that fits and splits it down
+to size, and releasing merges a block with its free buddy back up. Each prefix
+length keeps its free blocks in a set and a heap of their addresses, so finding,
+taking and freeing a block are logarithmic at every prefix length, however many
+subnets are allocated. An example::
+
+   >>> pool = AddressPool(V4CIDR(cidr='10.0.0.0/24'))
+   >>> pool.allocate(26)
+   V4CIDR(10.0.0.0/26)
+   >>> pool.allocate(25)
+   V4CIDR(10.0.0.128/25)
+   >>> pool.free_space()
+   [V4CIDR(10.0.0.64/26)]
+
+
+'''
+
+    def __init__(self, network):
+        '''Create an :py:class:`AddressPool` object allocating from *network*, a
+:py:class:`martinellis.cidr.CIDR` object or CIDR string. The whole network starts
+out free.'''
+
+        if isinstance(network, (str, unicode)):
+            network = cidr.CIDR.blind_assertion(network)
+
+        if not isinstance(network, cidr.CIDR):
+            raise PoolError('network must be a CIDR object or a CIDR string')
+
+        self.network = network
+        self.bitmax = network.address.max
+        self._free = dict([(prefix, set()) for prefix in range(network.prefix, self.bitmax + 1)])
+        self._heaps = dict([(prefix, list()) for prefix in range(network.prefix, self.bitmax + 1)])
+        self._allocated = set()
+        self._push(network.prefix, network.first)
+
+    def _block(self, first, prefix):
+        network = self.network
+
+        return network.__class__(address=network.address_class._from_int(first, self.bitmax)
+                                 ,prefix=prefix
+                                 ,inclusive=network.inclusive
+                                 ,random=network.random)
+
+    def _size(self, prefix):
+        return 1 << (self.bitmax - prefix)
+
+    def _push(self, prefix, first):
+        self._free[prefix].add(first)
+        heapq.heappush(self._heaps[prefix], first)
+
+    def _pop(self, prefix):
+        # blocks taken out of the middle stay in the heap until they surface
+        # here, and are skipped if they aren't free anymore
+        free = self._free[prefix]
+        heap = self._heaps[prefix]
+
+        while heap:
+            first = heapq.heappop(heap)
+
+            if first in free:
+                free.remove(first)
+                return first
+
+        return None
+
+    def _take(self, prefix, first):
+        free = self._free[prefix]
+
+        if not first in free:
+            return False
+
+        free.remove(first)
+        heap = self._heaps[prefix]
+
+        # drop the stale entries once they outnumber the free blocks
+        if len(heap) > 2 * len(free) + 16:
+            heap[:] = list(free)
+            heapq.heapify(heap)
+
+        return True
+
+    def _split(self, first, prefix, target, keep):
+        # split the free block down to the target prefix, freeing the half that
+        # doesn't hold *keep* at every step
+        while prefix < target:
+            prefix += 1
+            half = self._size(prefix)
+
+            if keep >= first + half:
+                self._push(prefix, first)
+                first += half
+            else:
+                self._push(prefix, first + half)
+
+        return first
+
+    def _check_prefix(self, prefix):
+        if not isinstance(prefix, (int, long)):
+            raise PoolError('prefix must be an integer')
+
+        if not self.network.prefix <= prefix <= self.bitmax:
+            raise PoolError('prefix out of range of the pool')
+
+    def allocate(self, prefix):
+        '''Allocate the lowest free subnet with the given *prefix* and return it as
+a :py:class:`martinellis.cidr.CIDR`. Raises a :py:class:`PoolError` if there's no
+room left for a subnet that size.'''
+
+        self._check_prefix(prefix)
+
+        for size in range(prefix, self.network.prefix - 1, -1):
+            first = self._pop(size)
+
+            if first is not None:
+                first = self._split(first, size, prefix, first)
+                self._allocated.add((first, prefix))
+
+                return self._block(first, prefix)
+
+        raise PoolError('no free /%d left in %s' % (prefix, self.network))
+
+    def allocate_at(self, network):
+        '''Allocate the specific subnet *network*, a
+:py:class:`martinellis.cidr.CIDR` object or CIDR string. Raises a
+:py:class:`PoolError` if any of it is already allocated.'''
+
+        if isinstance(network, (str, unicode)):
+            network = cidr.CIDR.blind_assertion(network)
+
+        if not isinstance(network, cidr.CIDR) or not network.address.max == self.bitmax:
+            raise PoolError('network must be a CIDR of the same family as the pool')
+
+        if not network.is_subset_of(self.network):
+            raise PoolError('%s is not part of %s' % (network, self.network))
+
+        for size in range(network.prefix, self.network.prefix - 1, -1):
+            first = network.first & ~(self._size(size) - 1)
+
+            if self._take(size, first):
+                self._split(first, size, network.prefix, network.first)
+                self._allocated.add((network.first, network.prefix))
+
+                return self._block(network.first, network.prefix)
+
+        raise PoolError('%s is not free' % network)
+
+    def release(self, network):
+        '''Give an allocated subnet *network* back to the pool, merging it with
+its free neighbours into larger free blocks.'''
+
+        if isinstance(network, (str, unicode)):
+            network = cidr.CIDR.blind_assertion(network)
+
+        if not isinstance(network, cidr.CIDR):
+            raise PoolError('network must be a CIDR object or a CIDR string')
+
+        key = (network.first, network.prefix)
+
+        if not network.address.max == self.bitmax or not key in self._allocated:
+            raise PoolError('%s is not allocated from this pool' % network)
+
+        self._allocated.remove(key)
+        first, prefix = key
+
+        while prefix > self.network.prefix:
+            buddy = first ^ self._size(prefix)
+
+            if not self._take(prefix, buddy):
+                break
+
+            first = min(first, buddy)
+            prefix -= 1
+
+        self._push(prefix, first)
+
+    def allocated(self):
+        '''Return a sorted list of the allocated subnets.'''
+
+        return [self._block(first, prefix) for first, prefix in sorted(self._allocated)]
+
+    def free_space(self):
+        '''Return a sorted list of the free blocks of the pool.'''
+
+        blocks = list()
+
+        for prefix, firsts in self._free.items():
+            blocks += [(first, prefix) for first in firsts]
+
+        return [self._block(first, prefix) for first, prefix in sorted(blocks)]
+
+    def free_count(self):
+        '''Count how many addresses of the pool are free.'''
+
+        return sum([len(firsts) * self._size(prefix) for prefix, firsts in self._free.items()])
+
+    def __len__(self):
+        return len(self._allocated)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.network)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+
+from martinellis import address, cidr, cidrmap, table
+
+class ServerError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`LookupServer`
+and :py:class:`LookupClient` objects.'''
+
+    pass
+
+LOOKUP_ERRORS = (address.AddressError
+                 ,cidr.CIDRError
+                 ,cidr.CIDRSetError
+                 ,cidrmap.CIDRMapError
+                 ,table.TableError
+                 ,UnicodeError
+                 ,ValueError)
+'''The errors raised by a bad query, which are answered with an error line
+rather than dropping the connection.'''
+
+class LookupServer(object):
+    '''
+Serve lookups against a :py:class:`martinellis.table.CIDRTable`,
+:py:class:`martinellis.cidrmap.CIDRMap` or :py:class:`martinellis.cidr.CIDRSet`
+over a Unix or TCP socket, so that many short-lived processes can share one
+resident table instead of each building their own.
+
+The protocol is line based. Every request line holds one address, and every
+reply line holds the JSON encoding of the result of looking it up: the value of
+the most specific network for maps, **true** for addresses in sets, and
+**null** for addresses that match nothing. Queries that can't be answered, such
+as unparseable addresses or map values that have no JSON encoding, get a reply
+line starting with ``!`` followed by the error message. Replies come back in request order, so clients can pipeline as
+many queries as they like; the server answers every complete line it has
+received in one batch and writes the replies back in a single write.
+
+When the server is given the filename of a compiled table, it maps it with
+:py:func:`martinellis.table.CIDRTable.load` and checks the file for changes every
+*reload_interval* seconds, swapping in the new table between batches. Replace
+the file atomically, e.g. by saving to a temporary file and renaming it over the
+old one, so the server never sees a half-written table. An example::
+
+   >>> server = LookupServer('blocklist.tbl')
+   >>> server.serve_forever(path='/run/blocklist.sock')
+
+
+'''
+
+    RELOAD_INTERVAL = 1.0
+    '''How often, in seconds, a table file is checked for changes. **None**
+turns reloading off.'''
+
+    MAX_LINE = 1024
+    '''The longest request line accepted before the connection is dropped.'''
+
+    READ_SIZE = 65536
+    '''How many bytes are read from a connection at a time.'''
+
+    def __init__(self, source, **kwargs):
+        '''
+Create a :py:class:`LookupServer` object. *source* is either the filename of a
+table saved with :py:func:`martinellis.cidr.CIDRSet.save` or
+:py:func:`martinellis.cidrmap.CIDRMap.save`, or an object to look addresses up in
+directly. A :py:class:`martinellis.cidr.CIDRSet` is compiled with
+:py:func:`martinellis.cidr.CIDRSet.compile` first, so lookups binary-search the
+table instead of scanning every network. Keyword arguments are:
+
+   *reload_interval*: See :py:attr:`LookupServer.RELOAD_INTERVAL`.
+
+
+'''
+
+        self.reload_interval = kwargs.setdefault('reload_interval', self.RELOAD_INTERVAL)
+        self.filename = None
+        self.source = None
+        self.servers = list()
+        self._modified = None
+        self._watcher = None
+        self._loop = None
+
+        if isinstance(source, str):
+            self.filename = source
+            self.reload()
+        elif isinstance(source, cidr.CIDRSet):
+            self.source = source.compile()
+        else:
+            self.source = source
+
+    def reload(self):
+        '''Load the table file again, replacing the table being served. Returns
+**True** if the file changed since it was last loaded. This can be called from
+any thread: while the server is running, the new table is swapped in on the
+event loop between batches, and this waits for the swap to happen.'''
+
+        if self.filename is None:
+            raise ServerError('server has no table file to reload')
+
+        stat = os.stat(self.filename)
+        modified = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+        if modified == self._modified:
+            return False
+
+        loaded = table.CIDRTable.load(self.filename)
+        self._modified = modified
+        loop = self._loop
+
+        if loop is not None and loop.is_running() and not self._on_loop(loop):
+            async def swap():
+                self._swap(loaded)
+
+            asyncio.run_coroutine_threadsafe(swap(), loop).result()
+        else:
+            self._swap(loaded)
+
+        return True
+
+    @staticmethod
+    def _on_loop(loop):
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _swap(self, source):
+        previous = self.source
+        self.source = source
+
+        # lookups never await, so on the event loop no batch is still reading
+        # the old table
+        if previous is not None:
+            previous.close()
+
+    def lookup(self, address_obj):
+        '''Look *address_obj* up in the table being served, returning the value
+of the most specific network containing it, **True** for sets, or **None**.'''
+
+        if isinstance(address_obj, str):
+            address_obj = address.Address.blind_assertion(address_obj)
+
+        return self.source.lookup(address_obj)
+
+    def answer(self, lines):
+        '''Return the reply lines, as bytes, for a batch of request lines.'''
+
+        replies = list()
+
+        for line in lines:
+            try:
+                value = self.lookup(line.strip().decode('ascii'))
+            except LOOKUP_ERRORS as error:
+                replies.append(('!%s' % error).encode('utf-8'))
+                continue
+
+            try:
+                replies.append(json.dumps(value, sort_keys=True).encode('utf-8'))
+            except (TypeError, ValueError) as error:
+                # maps can hold values JSON has no encoding for
+                replies.append(('!%s' % error).encode('utf-8'))
+
+        replies.append(b'')
+
+        return b'\n'.join(replies)
+
+    async def _handle(self, reader, writer):
+        pending = b''
+
+        try:
+            while True:
+                data = await reader.read(self.READ_SIZE)
+
+                if not data:
+                    break
+
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+
+                if len(pending) > self.MAX_LINE:
+                    writer.write(b'!request line too long\n')
+                    await writer.drain()
+                    break
+
+                if lines:
+                    writer.write(self.answer(lines))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+
+            try:
+                self.reload()
+            except (OSError, table.TableError):
+                # keep serving the old table until the file is readable again
+                pass
+
+    async def start(self, path=None, host=None, port=None):
+        '''Start listening on the Unix socket *path*, or on TCP *host* and
+*port*, and start watching the table file for changes.'''
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path=path)
+        elif port is not None:
+            server = await asyncio.start_server(self._handle, host=host, port=port)
+        else:
+            raise ServerError('either a socket path or a port is required')
+
+        self.servers.append(server)
+        self._loop = asyncio.get_running_loop()
+
+        if self.filename is not None and self.reload_interval is not None and self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+        return server
+
+    async def close(self):
+        '''Stop listening and stop watching the table file.'''
+
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+        self.servers = list()
+        self._loop = None
+
+    def serve_forever(self, path=None, host=None, port=None):
+        '''Run the server in a new event loop until interrupted. See
+:py:func:`LookupServer.start`.'''
+
+        async def serve():
+            server = await self.start(path=path, host=host, port=port)
+
+            try:
+                await server.serve_forever()
+            finally:
+                await self.close()
+
+        asyncio.run(serve())
+
+class LookupClient(object):
+    '''
+A blocking client for a :py:class:`LookupServer`. Class variables can be changed
+at the class definition to change the default behavior of the class. An
+example::
+
+   >>> with LookupClient(path='/run/blocklist.sock') as client:
+   ...     client.lookup_many(['10.1.2.3', '192.168.0.1'])
+   [True, None]
+
+
+'''
+
+    WINDOW = 1024
+    '''How many queries :py:func:`LookupClient.lookup_many` sends before reading
+their replies. Bounding the queries in flight keeps the server's replies from
+filling the socket buffers while the client is still writing.'''
+
+    def __init__(self, path=None, host=None, port=None, timeout=None):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        elif port is not None:
+            self.socket = socket.create_connection((host, port), timeout=timeout)
+        else:
+            raise ServerError('either a socket path or a port is required')
+
+        self._file = self.socket.makefile('rb')
+
+    def lookup(self, address_obj):
+        '''Look a single address up. See :py:func:`LookupClient.lookup_many`.'''
+
+        return self.lookup_many([address_obj])[0]
+
+    def lookup_many(self, addresses):
+        '''Send the addresses in *addresses* to the server in pipelined writes of
+:py:attr:`LookupClient.WINDOW` queries and return a list of the results in the
+same order. Addresses can be :py:class:`martinellis.address.Address` objects or
+strings. A query the server couldn't answer raises a :py:class:`ServerError`.'''
+
+        addresses = [str(address_obj) for address_obj in addresses]
+        results = list()
+
+        for start in range(0, len(addresses), self.WINDOW):
+            window = addresses[start:start+self.WINDOW]
+            self.socket.sendall(''.join(['%s\n' % address_obj for address_obj in window]).encode('ascii'))
+
+            # every reply of the window is read before more queries are sent
+            for address_obj in window:
+                line = self._file.readline()
+
+                if not line:
+                    raise ServerError('server closed the connection')
+
+                if line.startswith(b'!'):
+                    raise ServerError('%s: %s' % (address_obj, line[1:].strip().decode('utf-8')))
+
+                results.append(json.loads(line.decode('utf-8')))
+
+        return results
+
+    def close(self):
+        '''Close the connection to the server.'''
+
+        self._file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m martinellis.server'
+                                     ,description='Serve address lookups against a compiled table.')
+    parser.add_argument('table', help='a table saved with CIDRSet.save or CIDRMap.save')
+    parser.add_argument('--unix', dest='path', help='listen on this Unix socket')
+    parser.add_argument('--host', default='127.0.0.1', help='listen on this TCP host')
+    parser.add_argument('--port', type=int, help='listen on this TCP port')
+    parser.add_argument('--reload-interval', type=float, default=LookupServer.RELOAD_INTERVAL
+                        ,help='seconds between checks of the table for changes')
+    options = parser.parse_args(args)
+
+    if options.path is None and options.port is None:
+        parser.error('either --unix or --port is required')
+
+    server = LookupServer(options.table, reload_interval=options.reload_interval)
+
+    try:
+        server.serve_forever(path=options.path, host=options.host, port=options.port)
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import functools
+import threading
+import time
+
+from martinellis import address, cidr, iprange
+
+class StatsError(Exception):
+    '''
+A general error that's raised when errors occur while collecting statistics.'''
+
+    pass
+
+_clock = getattr(time, 'perf_counter', time.time)
+_lock = threading.Lock()
+_counters = dict()
+_originals = dict()
+_local = threading.local()
+
+def _record(name, count, seconds):
+    with _lock:
+        entry = _counters.get(name)
+
+        if entry is None:
+            _counters[name] = [count, seconds]
+        else:
+            entry[0] += count
+            entry[1] += seconds
+
+def _counted(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = _clock()
+
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            _record(name + '.errors', 1, 0.0)
+            raise
+        finally:
+            _record(name, 1, _clock() - start)
+
+    return wrapper
+
+def _checked(name, function):
+    counted = _counted(name, function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        # a running count per thread, so lookups on other threads don't land in
+        # the networks counted by a set lookup
+        _local.checked = getattr(_local, 'checked', 0) + 1
+        return counted(*args, **kwargs)
+
+    return wrapper
+
+def _visited(name, function):
+    # count the networks checked by a set lookup as the CIDR.has_address calls
+    # it makes on its own thread
+    counted = _counted(name, function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        before = getattr(_local, 'checked', 0)
+
+        try:
+            return counted(*args, **kwargs)
+        finally:
+            _record(name + '.networks', getattr(_local, 'checked', 0) - before, 0.0)
+
+    return wrapper
+
+def _yielded(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        iterator = function(*args, **kwargs)
+
+        # only the time spent producing each value counts, not the time the
+        # caller spends between values
+        while True:
+            start = _clock()
+
+            try:
+                value = next(iterator)
+            except StopIteration:
+                _record(name, 0, _clock() - start)
+                return
+
+            _record(name, 1, _clock() - start)
+            yield value
+
+    return wrapper
+
+HOOKS = [(address.Address, '__init__', 'address.construct', _counted)
+         ,(address.Address, '_from_int', 'address.from_int', _counted)
+         ,(address.V4Address, 'from_string', 'address.from_string.v4', _counted)
+         ,(address.V6Address, 'from_string', 'address.from_string.v6', _counted)
+         ,(address.Address, 'blind_assertion', 'address.blind_assertion', _counted)
+         ,(cidr.CIDR, '__init__', 'cidr.construct', _counted)
+         ,(cidr.CIDR, 'has_address', 'cidr.has_address', _checked)
+         ,(cidr.CIDRSet, 'has_address', 'cidrset.has_address', _visited)
+         ,(cidr.CIDR, '__iter__', 'cidr.iter', _yielded)
+         ,(cidr.CIDRSet, '__iter__', 'cidrset.iter', _yielded)
+         ,(iprange.IPRange, '__iter__', 'iprange.iter', _yielded)]
+'''
+The instrumented functions, as *(class, attribute, counter, wrapper)* tuples.
+Every call to a function counts once under its counter name, and calls that raise
+also count under the name with ``.errors`` appended; failed parses of
+:py:func:`martinellis.address.Address.blind_assertion` show up as
+``address.blind_assertion.errors``. Set lookups also count the networks they check
+under ``cidrset.has_address.networks``, and iterators count the values they yield
+rather than calls.'''
+
+def enabled():
+    '''Return **True** if statistics are being collected.'''
+
+    return bool(_originals)
+
+def enable():
+    '''
+Start collecting statistics. The functions listed in :py:data:`HOOKS` are swapped
+for counting and timing wrappers, and swapped back by :py:func:`disable`, so the
+library runs its normal code at full speed while statistics are off. Counters
+keep their values across :py:func:`enable` and :py:func:`disable` until
+:py:func:`reset` is called.'''
+
+    with _lock:
+        if _originals:
+            return
+
+        for owner, attribute, name, wrap in HOOKS:
+            original = owner.__dict__[attribute]
+            _originals[(owner, attribute)] = original
+
+            if isinstance(original, classmethod):
+                replacement = classmethod(wrap(name, original.__func__))
+            elif isinstance(original, staticmethod):
+                replacement = staticmethod(wrap(name, original.__func__))
+            else:
+                replacement = wrap(name, original)
+
+            setattr(owner, attribute, replacement)
+
+def disable():
+    '''Stop collecting statistics and restore the uninstrumented functions.'''
+
+    with _lock:
+        for (owner, attribute), original in _originals.items():
+            setattr(owner, attribute, original)
+
+        _originals.clear()
+
+def reset():
+    '''Clear every counter.'''
+
+    with _lock:
+        _counters.clear()
+
+def snapshot():
+    '''
+Return the counters collected so far as a dictionary mapping each counter name to
+a dictionary of its *count* and the total *seconds* spent in it. Example::
+
+   >>> enable()
+   >>> V4CIDR(cidr='10.0.0.0/8').has_address(V4Address(value='10.0.0.1'))
+   True
+   >>> snapshot()['cidr.has_address']
+   {'count': 1, 'seconds': 1.1e-06}
+
+
+'''
+
+    with _lock:
+        return dict([(name, {'count': count, 'seconds': seconds})
+                     for name, (count, seconds) in _counters.items()])
+
+class collect(object):
+    '''
+A context manager collecting statistics for the code inside it. The counters are
+reset on entry, and on exit statistics are turned off again, the results are
+stored in the *results* attribute as returned by :py:func:`snapshot`, and passed to
+*callback* if one was given. Example::
+
+   >>> with collect(callback=log_stats) as collected:
+   ...     run_job()
+   ...
+   >>> collected.results['address.blind_assertion.errors']
+   {'count': 12, 'seconds': 0.0}
+
+
+'''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.results = None
+
+    def __enter__(self):
+        if enabled():
+            raise StatsError('statistics are already being collected')
+
+        reset()
+        enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        disable()
+        self.results = snapshot()
+
+        if self.callback is not None:
+            self.callback(self.results)
@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+
+import array
+import bisect
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from martinellis import address, vector
+from martinellis.compat import *
+
+class TableError(Exception):
+    '''
+A general error that's raised when errors occur inside :py:class:`CIDRTable`
+objects.'''
+
+    pass
+
+MAGIC = b'MRTNCIDR'
+'''The bytes every compiled table file starts with.'''
+
+VERSION = 1
+'''The version of the compiled table format written by :py:func:`dump`.'''
+
+FLAG_VALUES = 1
+'''Header flag marking a table that stores a value for every range.'''
+
+HEADER = struct.Struct('<8sHHQQQQ')
+'''The layout of the table header: magic, version, flags, the number of IPv4
+ranges, the number of IPv6 ranges, the number of distinct values and the size of
+the encoded values in bytes.'''
+
+HEADER_SIZE = 48
+'''The size of the header, padded so the arrays after it are 8-byte aligned.'''
+
+# Python 2's memoryview can't be cast to an array of integers
+_CAST = hasattr(memoryview, 'cast')
+
+def _pad(size):
+    return (size + 7) & ~7
+
+def _itemsize(typecode):
+    return struct.calcsize('<' + typecode)
+
+def _pack(typecode, values):
+    '''Return *values* packed as a little-endian array of *typecode*.'''
+
+    try:
+        data = array.array(typecode, values)
+    except ValueError:
+        # Python 2's array module has no 64-bit typecodes
+        return struct.pack('<%d%s' % (len(values), typecode), *values)
+
+    if sys.byteorder == 'big':
+        data.byteswap()
+
+    return data.tobytes() if hasattr(data, 'tobytes') else data.tostring()
+
+def _unpack(typecode, buffer, offset, length):
+    '''Return a copy of the little-endian array of *length* items of *typecode*
+at *offset* in *buffer*.'''
+
+    try:
+        data = array.array(typecode)
+    except ValueError:
+        return struct.unpack_from('<%d%s' % (length, typecode), buffer, offset)
+
+    chunk = buffer[offset:offset+length*data.itemsize]
+
+    if hasattr(data, 'frombytes'):
+        data.frombytes(chunk)
+    else:
+        data.fromstring(chunk)
+
+    if sys.byteorder == 'big':
+        data.byteswap()
+
+    return data
+
+def _layout(v4_count, v6_count, value_count, values):
+    '''Return the *(offset, typecode, length)* of every array in a table.'''
+
+    sections = [('v4_first', 'I', v4_count)
+                ,('v4_last', 'I', v4_count)
+                ,('v4_value', 'I', v4_count if values else 0)
+                ,('v6_first_high', 'Q', v6_count)
+                ,('v6_first_low', 'Q', v6_count)
+                ,('v6_last_high', 'Q', v6_count)
+                ,('v6_last_low', 'Q', v6_count)
+                ,('v6_value', 'I', v6_count if values else 0)
+                ,('value_offsets', 'Q', value_count + 1 if values else 0)]
+    offset = HEADER_SIZE
+    layout = dict()
+
+    for name, typecode, length in sections:
+        layout[name] = (offset, typecode, length)
+        offset += _pad(length * _itemsize(typecode))
+
+    layout['values'] = (offset, 'B', None)
+
+    return layout
+
+def dump(fp, v4_ranges, v6_ranges, values=None):
+    '''
+Write a compiled table to the binary file object *fp*. *v4_ranges* and
+*v6_ranges* are sorted lists of disjoint *(first, last)* integer ranges, or of
+*(first, last, value_index)* tuples if *values* is given. *values* is a list of
+JSON-serializable objects that the value indexes point into.
+
+This is the low-level writer behind :py:func:`martinellis.cidr.CIDRSet.save` and
+:py:func:`martinellis.cidrmap.CIDRMap.save`, which are what you usually want.'''
+
+    encoded = list()
+    value_offsets = [0]
+
+    if values is not None:
+        for value in values:
+            encoded.append(json.dumps(value, sort_keys=True).encode('utf-8'))
+            value_offsets.append(value_offsets[-1] + len(encoded[-1]))
+
+    blob = b''.join(encoded)
+    flags = FLAG_VALUES if values is not None else 0
+    value_count = len(encoded)
+    mask = 0xFFFFFFFFFFFFFFFF
+
+    arrays = {'v4_first': [entry[0] for entry in v4_ranges]
+              ,'v4_last': [entry[1] for entry in v4_ranges]
+              ,'v4_value': [entry[2] for entry in v4_ranges] if flags else []
+              ,'v6_first_high': [entry[0] >> 64 for entry in v6_ranges]
+              ,'v6_first_low': [entry[0] & mask for entry in v6_ranges]
+              ,'v6_last_high': [entry[1] >> 64 for entry in v6_ranges]
+              ,'v6_last_low': [entry[1] & mask for entry in v6_ranges]
+              ,'v6_value': [entry[2] for entry in v6_ranges] if flags else []
+              ,'value_offsets': value_offsets if flags else []}
+
+    layout = _layout(len(v4_ranges), len(v6_ranges), value_count, flags)
+    header = HEADER.pack(MAGIC, VERSION, flags, len(v4_ranges), len(v6_ranges), value_count, len(blob))
+
+    fp.write(header + b'\0' * (HEADER_SIZE - len(header)))
+
+    for name in sorted(arrays, key=lambda name: layout[name][0]):
+        data = _pack(layout[name][1], arrays[name])
+        fp.write(data + b'\0' * (_pad(len(data)) - len(data)))
+
+    fp.write(blob)
+
+def save(filename, v4_ranges, v6_ranges, values=None):
+    '''Write a compiled table to *filename*. See :py:func:`dump`.'''
+
+    with open(filename, 'wb') as fp:
+        dump(fp, v4_ranges, v6_ranges, values)
+
+def compile(v4_ranges, v6_ranges, values=None):
+    '''Compile a table in memory and return a :py:class:`CIDRTable` over it. See
+:py:func:`dump`. The table is backed by an immutable ``bytes`` object, so it can be
+shared between threads without locking.'''
+
+    fp = io.BytesIO()
+    dump(fp, v4_ranges, v6_ranges, values)
+
+    return CIDRTable(fp.getvalue())
+
+def _as_numpy(data, dtype):
+    numpy = vector.numpy
+
+    if isinstance(data, tuple):
+        return numpy.array(data, dtype=dtype)
+
+    return numpy.frombuffer(data, dtype=dtype)
+
+class CIDRTable(object):
+    '''
+A read-only, compiled lookup table of address ranges, loaded from the binary
+format written by :py:func:`martinellis.cidr.CIDRSet.save` or
+:py:func:`martinellis.cidrmap.CIDRMap.save`. Lookups binary-search the sorted
+range arrays directly in the loaded buffer, so loading a table costs no parsing
+and creates no per-network objects. An example::
+
+   >>> CIDRSet(V4CIDR(cidr='10.0.0.0/8')).save('blocklist.tbl')
+   >>> blocklist = CIDRTable.load('blocklist.tbl')
+   >>> blocklist.has_address(V4Address(value='10.1.2.3'))
+   True
+
+Tables saved from a :py:class:`martinellis.cidrmap.CIDRMap` also return the value
+of the most specific network covering an address from
+:py:func:`CIDRTable.lookup`.
+
+On Python 2, which can't cast a :py:class:`memoryview`, and on big-endian hosts,
+the arrays are copied out of the buffer when the table is created instead.'''
+
+    def __init__(self, buffer):
+        '''Create a table over *buffer*, a bytes-like object holding a compiled
+table. Use :py:func:`CIDRTable.load` to map a table file from disk.'''
+
+        self._buffer = buffer
+        self._mmap = None
+        self._views = list()
+        self._decoded = dict()
+
+        if len(buffer) < HEADER_SIZE:
+            raise TableError('buffer too small to hold a table')
+
+        try:
+            magic, version, flags, v4_count, v6_count, value_count, blob_size = HEADER.unpack_from(buffer, 0)
+        except struct.error as error:
+            raise TableError('could not read table header: %s' % error)
+
+        if not magic == MAGIC:
+            raise TableError('buffer does not hold a compiled table')
+
+        if not version == VERSION:
+            raise TableError('unsupported table version %d' % version)
+
+        self.version = version
+        self.has_values = bool(flags & FLAG_VALUES)
+        self.value_count = value_count
+
+        layout = _layout(v4_count, v6_count, value_count, self.has_values)
+        blob_offset = layout['values'][0]
+
+        if len(buffer) < blob_offset + blob_size:
+            raise TableError('table is truncated')
+
+        for name, (offset, typecode, length) in layout.items():
+            if length is None:
+                continue
+
+            setattr(self, '_' + name, self._array(offset, typecode, length))
+
+        if _CAST:
+            self._blob = memoryview(buffer)[blob_offset:blob_offset+blob_size]
+            self._views.append(self._blob)
+        else:
+            self._blob = buffer[blob_offset:blob_offset+blob_size]
+
+    def _array(self, offset, typecode, length):
+        # the format is little-endian, so big-endian hosts need a copy, and so
+        # does Python 2, which can't cast a memoryview
+        if not _CAST or sys.byteorder == 'big':
+            return _unpack(typecode, self._buffer, offset, length)
+
+        view = memoryview(self._buffer)[offset:offset+length*_itemsize(typecode)]
+        view = view.cast(typecode)
+        self._views.append(view)
+        return view
+
+    @classmethod
+    def load(cls, filename):
+        '''Map the compiled table file *filename* into memory with
+:py:mod:`mmap` and return a :py:class:`CIDRTable` over it. Empty, truncated and
+corrupt files raise a :py:class:`TableError`.'''
+
+        with open(filename, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size < HEADER_SIZE:
+                raise TableError('file too small to hold a table')
+
+            try:
+                mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as error:
+                # the file shrank after it was checked
+                raise TableError('could not map table file: %s' % error)
+
+        try:
+            table = cls(mapped)
+        except Exception:
+            mapped.close()
+            raise
+
+        table._mmap = mapped
+
+        return table
+
+    def close(self):
+        '''Release the buffer of the table, unmapping it if it was loaded from
+a file. The table can't be used afterwards.'''
+
+        # the cached NumPy keys are views of the buffer too
+        for name in ('_v6_first_keys', '_v6_last_keys'):
+            if hasattr(self, name):
+                delattr(self, name)
+
+        for view in self._views:
+            view.release()
+
+        self._views = list()
+
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _find(self, address_obj):
+        if isinstance(address_obj, (str, unicode)):
+            address_obj = address.Address.blind_assertion(address_obj)
+
+        if not isinstance(address_obj, address.Address):
+            raise TableError('can only look up Address objects or address strings')
+
+        value = address_obj.value
+
+        if address_obj.max == 32:
+            index = bisect.bisect_right(self._v4_first, value) - 1
+
+            if index < 0 or value > self._v4_last[index]:
+                return None
+
+            return 32, index
+
+        if not address_obj.max == 128:
+            raise TableError('unsupported address family')
+
+        high = value >> 64
+        low = value & 0xFFFFFFFFFFFFFFFF
+        start = bisect.bisect_left(self._v6_first_high, high)
+        stop = bisect.bisect_right(self._v6_first_high, high, start)
+        # ranges sharing the high half are sorted by their low half, and when
+        # none of them starts at or under the address, the candidate is the
+        # last range starting under a lower high half
+        index = bisect.bisect_right(self._v6_first_low, low, start, stop) - 1
+
+        if index < 0:
+            return None
+
+        last_high = self._v6_last_high[index]
+
+        if high > last_high or (high == last_high and low > self._v6_last_low[index]):
+            return None
+
+        return 128, index
+
+    def _value(self, value_index):
+        if not value_index in self._decoded:
+            offsets = self._value_offsets
+            data = bytes(self._blob[offsets[value_index]:offsets[value_index+1]])
+            self._decoded[value_index] = json.loads(data.decode('utf-8'))
+
+        return self._decoded[value_index]
+
+    def has_address(self, address_obj):
+        '''Check if *address_obj* falls within any range of the table.
+*address_obj* can be a :py:class:`martinellis.address.Address` object or an
+address string.'''
+
+        return self._find(address_obj) is not None
+
+    def lookup(self, address_obj, default=None):
+        '''Return the value stored for the range containing *address_obj*, or
+*default* if no range contains it. Tables without values return **True** for
+addresses they contain.'''
+
+        found = self._find(address_obj)
+
+        if found is None:
+            return default
+
+        if not self.has_values:
+            return True
+
+        bitmax, index = found
+        values = self._v4_value if bitmax == 32 else self._v6_value
+
+        return self._value(values[index])
+
+    def contains_many(self, addresses):
+        '''Vectorized version of :py:func:`CIDRTable.has_address` over a NumPy
+array of addresses, in the form accepted by
+:py:func:`martinellis.cidr.CIDR.contains_many`. Requires NumPy.'''
+
+        return self._search_many(addresses) >= 0
+
+    def _search_many(self, addresses):
+        keys, bitmax = vector.as_keys(addresses)
+        numpy = vector.numpy
+
+        if bitmax == 32:
+            firsts = _as_numpy(self._v4_first, numpy.uint32)
+            lasts = _as_numpy(self._v4_last, numpy.uint32)
+        else:
+            firsts = self._v6_keys('first')
+            lasts = self._v6_keys('last')
+
+        result = numpy.full(len(keys), -1, dtype=numpy.int64)
+
+        if not len(firsts):
+            return result
+
+        positions = numpy.searchsorted(firsts, keys, side='right') - 1
+        found = positions >= 0
+        found[found] = keys[found] <= lasts[positions[found]]
+        result[found] = positions[found]
+
+        return result
+
+    def _v6_keys(self, name):
+        attribute = '_v6_%s_keys' % name
+
+        if not hasattr(self, attribute):
+            numpy = vector.numpy
+            pairs = numpy.empty((len(getattr(self, '_v6_%s_high' % name)), 2), dtype=numpy.uint64)
+            pairs[:, 0] = _as_numpy(getattr(self, '_v6_%s_high' % name), numpy.uint64)
+            pairs[:, 1] = _as_numpy(getattr(self, '_v6_%s_low' % name), numpy.uint64)
+            setattr(self, attribute, vector.as_keys(pairs)[0])
+
+        return getattr(self, attribute)
+
+    def lookup_many(self, addresses, default=None):
+        '''Vectorized version of :py:func:`CIDRTable.lookup`, returning a list of
+values for a NumPy array of addresses. Requires NumPy.'''
+
+        keys, bitmax = vector.as_keys(addresses)
+        indexes = self._search_many(addresses)
+        values = self._v4_value if bitmax == 32 else self._v6_value
+        result = list()
+
+        for index in indexes.tolist():
+            if index < 0:
+                result.append(default)
+            elif not self.has_values:
+                result.append(True)
+            else:
+                result.append(self._value(values[index]))
+
+        return result
+
+    def ranges(self):
+        '''Return an iterator of the *(first, last, value)* ranges in the table as
+integers, IPv4 ranges first. *value* is **None** for tables without values.'''
+
+        for index in range(len(self._v4_first)):
+            value = self._value(self._v4_value[index]) if self.has_values else None
+            yield self._v4_first[index], self._v4_last[index], value
+
+        for index in range(len(self._v6_first_high)):
+            value = self._value(self._v6_value[index]) if self.has_values else None
+            yield ((self._v6_first_high[index] << 64 | self._v6_first_low[index])
+                   ,(self._v6_last_high[index] << 64 | self._v6_last_low[index])
+                   ,value)
+
+    def __len__(self):
+        return len(self._v4_first) + len(self._v6_first_high)
+
+    def __contains__(self, address_obj):
+        return self.has_address(address_obj)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class TableHolder(object):
+    '''
+A holder for the current version of a lookup table that is replaced while other
+threads keep reading it, read-copy-update style. Readers fetch the current
+:py:class:`CIDRTable` with a single attribute read and never take a lock, and a
+new table is always built completely before it's swapped in with a single
+assignment, so a reader sees either the whole old table or the whole new one.
+Tables already handed to a reader stay valid until the reader drops them, as old
+tables are never closed by the holder. An example::
+
+   >>> holder = TableHolder(CIDRSet(V4CIDR(cidr='10.0.0.0/8')))
+   >>> holder.start(lambda: classify.load_networks('blocklist.txt'), interval=300)
+   >>> holder.has_address('10.1.2.3')
+   True
+
+Class variables can be changed at the class definition to change the default
+behavior of the class.'''
+
+    INTERVAL = 60.0
+    '''The default number of seconds between reloads started with
+:py:func:`TableHolder.start`.'''
+
+    def __init__(self, source=None):
+        '''Create a holder, starting out with the table compiled from *source*
+if given. See :py:func:`TableHolder.swap` for what *source* can be.'''
+
+        self._table = None
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+        self.errors = list()
+
+        if source is not None:
+            self.swap(source)
+
+    @property
+    def table(self):
+        '''The current :py:class:`CIDRTable`. Hold on to the result to run
+several lookups against the same version of the table.'''
+
+        return self._table
+
+    def swap(self, source):
+        '''
+Make *source* the current table and return the table it replaces. *source* is a
+:py:class:`CIDRTable`, or any object with a ``compile`` method returning one, such
+as a :py:class:`martinellis.cidr.CIDRSet` or
+:py:class:`martinellis.cidrmap.CIDRMap`. Compiling happens before the swap, so
+readers keep using the previous table meanwhile.'''
+
+        if not isinstance(source, CIDRTable):
+            if not hasattr(source, 'compile'):
+                raise TableError('source must be a CIDRTable or have a compile method')
+
+            source = source.compile()
+
+        with self._lock:
+            previous = self._table
+            self._table = source
+
+        return previous
+
+    def reload(self, build):
+        '''Call *build* and swap in the table it returns, see
+:py:func:`TableHolder.swap`. Returns the table that was replaced.'''
+
+        return self.swap(build())
+
+    def start(self, build, interval=None):
+        '''Reload the table with :py:func:`TableHolder.reload` every *interval*
+seconds in a background daemon thread, keeping the rebuild off the request path.
+Errors raised by *build* leave the current table in place and are appended to the
+*errors* attribute.'''
+
+        if self._thread is not None:
+            raise TableError('holder is already reloading')
+
+        if interval is None:
+            interval = self.INTERVAL
+
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.reload(build)
+                except Exception as error:
+                    self.errors.append(error)
+
+        self._stop = stop
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the reloads started with :py:func:`TableHolder.start`, waiting for
+a reload in progress to finish.'''
+
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._stop = None
+        self._thread = None
+
+    def _current(self):
+        current = self._table
+
+        if current is None:
+            raise TableError('holder has no table yet')
+
+        return current
+
+    def has_address(self, address_obj):
+        '''Call :py:func:`CIDRTable.has_address` on the current table.'''
+
+        return self._current().has_address(address_obj)
+
+    def lookup(self, address_obj, default=None):
+        '''Call :py:func:`CIDRTable.lookup` on the current table.'''
+
+        return self._current().lookup(address_obj, default)
+
+    def __contains__(self, address_obj):
+        return self.has_address(address_obj)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+import heapq
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from martinellis.compat import *
+
+class VectorError(Exception):
+    '''
+A general error that's raised when errors occur while operating on arrays of
+addresses.'''
+
+    pass
+
+def require_numpy():
+    '''Raise a :py:class:`VectorError` if NumPy is not installed.'''
+
+    if numpy is None:
+        raise VectorError('numpy is required for vectorized operations')
+
+def _cast(addresses, dtype, maximum):
+    # casting wraps values that don't fit, so they are checked first rather
+    # than silently turned into other addresses
+    if not addresses.size:
+        return addresses.astype(dtype)
+
+    if not addresses.dtype.kind in 'iu':
+        raise VectorError('addresses must be an integer array')
+
+    if addresses.dtype.kind == 'i' and (addresses < 0).any():
+        raise VectorError('addresses must not be negative')
+
+    if addresses.dtype.itemsize > numpy.dtype(dtype).itemsize and (addresses > maximum).any():
+        raise VectorError('addresses out of range for the address family')
+
+    return addresses.astype(dtype, copy=False)
+
+def as_keys(addresses):
+    '''
+Convert an array of addresses into an array of sortable keys. The address family
+is taken from the shape of the array: a one-dimensional array of integers is
+treated as IPv4 addresses, and an array of shape *(n, 2)* is treated as IPv6
+addresses split into high and low 64-bit columns. Returns a tuple of the key
+array and the bit size of the address family. A :py:class:`VectorError` is raised
+for arrays that aren't integers, or that hold values outside the address family.'''
+
+    require_numpy()
+
+    addresses = numpy.asarray(addresses)
+
+    if addresses.ndim == 1:
+        return _cast(addresses, numpy.uint32, 0xFFFFFFFF), 32
+
+    if addresses.ndim == 2 and addresses.shape[1] == 2:
+        # big-endian bytes sort the same way as the 128-bit integers they hold
+        v6_keys = numpy.ascontiguousarray(_cast(addresses, '>u8', 0xFFFFFFFFFFFFFFFF))
+        return v6_keys.view('S16').reshape(-1), 128
+
+    raise VectorError('addresses must be a uint32 array or an (n, 2) uint64 array')
+
+def int_keys(values, bitmax):
+    '''Convert a sequence of integer addresses into a key array comparable with
+the keys returned by :py:func:`as_keys`.'''
+
+    require_numpy()
+
+    if bitmax == 32:
+        return numpy.array(values, dtype=numpy.uint32)
+
+    return numpy.array([struct.pack('>QQ', value >> 64, value & 0xFFFFFFFFFFFFFFFF)
+                        for value in values], dtype='S16')
+
+def int_array(values, bitmax):
+    '''Convert a sequence of integer addresses into an array in the form accepted
+by :py:func:`as_keys`: a ``uint32`` array for IPv4, or an *(n, 2)* ``uint64``
+array of high and low halves for IPv6.'''
+
+    require_numpy()
+
+    if bitmax == 32:
+        return numpy.array(values, dtype=numpy.uint32)
+
+    values = list(values)
+    result = numpy.empty((len(values), 2), dtype=numpy.uint64)
+    result[:, 0] = [value >> 64 for value in values]
+    result[:, 1] = [value & 0xFFFFFFFFFFFFFFFF for value in values]
+
+    return result
+
+def segment_table(offsets, firsts, bitmax):
+    '''
+Build the lookup table used by :py:func:`segment_addresses` for a run of address
+segments, where the segment starting at position *offsets[i]* begins at the
+integer address *firsts[i]*. *offsets* must be sorted and fit in 64 bits.'''
+
+    require_numpy()
+
+    offsets = numpy.array(offsets, dtype=numpy.uint64)
+
+    if bitmax == 32:
+        return offsets, numpy.array(firsts, dtype=numpy.uint64), None
+
+    return (offsets
+            ,numpy.array([first >> 64 for first in firsts], dtype=numpy.uint64)
+            ,numpy.array([first & 0xFFFFFFFFFFFFFFFF for first in firsts], dtype=numpy.uint64))
+
+def segment_addresses(positions, table, bitmax):
+    '''Map a ``uint64`` array of *positions* through a table from
+:py:func:`segment_table` to the addresses at those positions, in the form returned
+by :py:func:`int_array`.'''
+
+    # IPv4 tables hold whole segment starts in *bases*, IPv6 tables split them
+    # into high halves in *bases* and low halves in *lows*
+    offsets, bases, lows = table
+
+    if len(offsets) == 1:
+        index = numpy.zeros(len(positions), dtype=numpy.intp)
+    else:
+        index = numpy.searchsorted(offsets, positions, side='right') - 1
+
+    deltas = positions - offsets[index]
+
+    if bitmax == 32:
+        return (bases[index] + deltas).astype(numpy.uint32)
+
+    low = lows[index] + deltas
+    result = numpy.empty((len(positions), 2), dtype=numpy.uint64)
+    result[:, 0] = bases[index] + (low < deltas)
+    result[:, 1] = low
+
+    return result
+
+def in_range(keys, bitmax, first, last):
+    '''Return a boolean mask of the *keys* that fall within *first* and *last*
+inclusive.'''
+
+    bounds = int_keys([first, last], bitmax)
+
+    return (keys >= bounds[0]) & (keys <= bounds[1])
+
+def flatten(bounds):
+    '''
+Flatten a sequence of possibly overlapping *(first, last, rank, index)* ranges
+into a sorted list of disjoint *(first, last, index)* ranges. Wherever ranges
+overlap, the *index* of the range with the highest *rank* wins.'''
+
+    bounds = sorted(bounds)
+    points = sorted(set([bound[0] for bound in bounds] + [bound[1] + 1 for bound in bounds]))
+    active = list()
+    flattened = list()
+    position = 0
+
+    for start, stop in zip(points, points[1:]):
+        while position < len(bounds) and bounds[position][0] == start:
+            first, last, rank, index = bounds[position]
+            heapq.heappush(active, (-rank, position, last, index))
+            position += 1
+
+        while active and active[0][2] < start:
+            heapq.heappop(active)
+
+        if not active:
+            continue
+
+        index = active[0][3]
+
+        if flattened and flattened[-1][2] == index and flattened[-1][1] + 1 == start:
+            flattened[-1] = (flattened[-1][0], stop - 1, index)
+        else:
+            flattened.append((start, stop - 1, index))
+
+    return flattened
+
+def search(keys, bitmax, flattened):
+    '''Return an integer array holding, for every key in *keys*, the *index* of
+the range in the *flattened* list from :py:func:`flatten` containing it, or -1 if
+no range contains it.'''
+
+    result = numpy.full(len(keys), -1, dtype=numpy.int64)
+
+    if not flattened:
+        return result
+
+    starts = int_keys([entry[0] for entry in flattened], bitmax)
+    ends = int_keys([entry[1] for entry in flattened], bitmax)
+    owners = numpy.array([entry[2] for entry in flattened], dtype=numpy.int64)
+
+    positions = numpy.searchsorted(starts, keys, side='right') - 1
+    found = positions >= 0
+    found[found] = keys[found] <= ends[positions[found]]
+    result[found] = owners[positions[found]]
+
+    return result
@@ -13,7 +13,8 @@ setup(
     ,url = 'https://github.com/frank2/martinellis'
     ,package_dir = {'martinellis': 'lib'}
     ,packages = ['martinellis']
-    ,install_requires = ['hotmic>=0.1.3']
+    ,install_requires = []
+    ,extras_require = {'numpy': ['numpy']}
     ,test_suite = 'test'
     ,long_description = '''Martinellis-- named after the famous brand of cider-- is a library for manipulating
 IP addresses in various formats. It allows for arbitrary masking of addresses and can
@@ -1,7 +1,21 @@
 #!/usr/bin/env python
 
+import bisect
+import io
+import itertools
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from martinellis import *
 
 class TestMartinellis(unittest.TestCase):
@@ -10,6 +24,772 @@ class TestMartinellis(unittest.TestCase):
         self.assertEqual(Address.blind_assertion('::').value, 0)
         self.assertEqual(Address.blind_assertion('7f00::1').value, 0x7f000000000000000000000000000001)
     
+    def test_blind_assertion(self):
+        self.assertRaises(address.AddressError, Address.blind_assertion, 'not an address')
+        self.assertRaises(cidr.CIDRError, CIDR.blind_assertion, '10.0.0.0/x')
+        self.assertIsInstance(CIDR.blind_assertion('7f00::/16'), V6CIDR)
+
+        Address.CACHE = ParseCache(maxsize=2)
+
+        try:
+            first = Address.blind_assertion('10.0.0.1')
+
+            self.assertIs(Address.blind_assertion('10.0.0.1'), first)
+
+            Address.blind_assertion('::1')
+            Address.blind_assertion('10.0.0.2')
+
+            self.assertIsNot(Address.blind_assertion('10.0.0.1'), first)
+            self.assertEqual(Address.CACHE.stats(), {'hits': 1, 'misses': 4, 'size': 2, 'maxsize': 2})
+        finally:
+            Address.CACHE = None
+
+    def test_Address_operators(self):
+        addr = V4Address(value='10.20.30.40')
+        masked = addr & V4Address(value='255.255.240.0')
+
+        self.assertIsInstance(masked, V4Address)
+        self.assertEqual(masked.value, 0x0a141000)
+        self.assertEqual(masked.max, 32)
+        self.assertEqual((addr + 5).value, 0x0a141e2d)
+        self.assertEqual((addr - 5).value, 0x0a141e23)
+        self.assertEqual((0xFFFFFF00 & addr).value, 0x0a141e00)
+        self.assertEqual((addr | 0xFF).value, 0x0a141eff)
+        self.assertEqual(str(V6Address(value='7f00::1') + 1), '7f00::2')
+        self.assertFalse(hasattr(addr, '__dict__'))
+
+        shared = addr
+        addr += 1
+        addr &= 0xFFFFFF00
+
+        self.assertEqual(str(shared), '10.20.30.40')
+        self.assertEqual(str(addr), '10.20.30.0')
+    
+    def test_CIDRMap(self):
+        routes = CIDRMap(('10.0.0.0/8', 'core'), ('10.1.0.0/16', 'lab'), ('::/0', 'v6'))
+        routes[V4CIDR(cidr='10.1.2.0/24')] = 'rack'
+
+        self.assertEqual(len(routes), 4)
+        self.assertEqual(routes.lookup('10.1.2.3'), 'rack')
+        self.assertEqual(routes.lookup('10.1.3.3'), 'lab')
+        self.assertEqual(routes.lookup('10.2.3.4'), 'core')
+        self.assertEqual(routes.lookup('11.0.0.1'), None)
+        self.assertEqual(routes.lookup('7f00::1'), 'v6')
+        self.assertEqual([value for network, value in routes.matches('10.1.2.3')], ['core', 'lab', 'rack'])
+        self.assertEqual(routes['10.1.0.0/16'], 'lab')
+
+        del routes['10.1.0.0/16']
+
+        self.assertEqual(routes.lookup('10.1.3.3'), 'core')
+        self.assertEqual(routes.lookup('10.1.2.3'), 'rack')
+        self.assertNotIn('10.1.0.0/16', routes)
+        self.assertEqual([str(network) for network in routes], ['10.0.0.0/8', '10.1.2.0/24', '::/0'])
+    
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_contains_many(self):
+        v4_addresses = numpy.array([0x0a000001, 0x0a010203, 0x0b000001], dtype=numpy.uint32)
+        v6_addresses = numpy.array([[0x7f00 << 48, 1], [0, 1]], dtype=numpy.uint64)
+
+        self.assertEqual(V4CIDR(cidr='10.0.0.0/8').contains_many(v4_addresses).tolist(), [True, True, False])
+        self.assertEqual(V6CIDR(cidr='7f00::/16').contains_many(v6_addresses).tolist(), [True, False])
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/8'), V4CIDR(cidr='10.1.0.0/16'), V6CIDR(cidr='::/96'))
+        networks, indexes = cidr_set.match_many(v4_addresses)
+
+        self.assertEqual([str(networks[index]) if index >= 0 else None for index in indexes]
+                         ,['10.0.0.0/8', '10.1.0.0/16', None])
+        self.assertEqual(cidr_set.contains_many(v6_addresses).tolist(), [False, True])
+
+        from martinellis import vector
+
+        wide = numpy.array([2 ** 32 + 0x0a000001, 0x0a000001], dtype=numpy.int64)
+
+        self.assertRaises(vector.VectorError, cidr_set.contains_many, wide)
+        self.assertRaises(vector.VectorError, cidr_set.contains_many, numpy.array([-1, 0x0a000001]))
+        self.assertRaises(vector.VectorError, cidr_set.contains_many, numpy.array([[0, -1]]))
+        self.assertRaises(vector.VectorError, cidr_set.contains_many, numpy.array([1.5]))
+        self.assertEqual(cidr_set.contains_many(wide[1:]).tolist(), [True])
+    
+    def test_CIDRSet_collapse(self):
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/24')
+                           ,V4CIDR(cidr='10.0.1.0/24')
+                           ,V4CIDR(cidr='10.0.0.128/25')
+                           ,V4CIDR(cidr='10.0.3.0/24')
+                           ,V6CIDR(cidr='::/1')
+                           ,V6CIDR(cidr='8000::/1'))
+        collapsed = cidr_set.collapse()
+
+        self.assertEqual(sorted(map(str, collapsed)), ['10.0.0.0/23', '10.0.3.0/24', '::/0'])
+        self.assertEqual(len(cidr_set), 6)
+        self.assertEqual([str(network) for network in V4CIDR.from_range(V4Address(value='10.0.0.1'), V4Address(value='10.0.0.6'))]
+                         ,['10.0.0.1/32', '10.0.0.2/31', '10.0.0.4/31', '10.0.0.6/32'])
+
+        auto_set = CIDRSet(V4CIDR(cidr='10.0.0.0/25'), collapsed=True)
+        auto_set.add(V4CIDR(cidr='10.0.0.128/25'))
+        auto_set.add(V4CIDR(cidr='10.0.0.64/26'))
+
+        self.assertEqual(list(map(str, auto_set)), ['10.0.0.0/24'])
+        self.assertEqual(auto_set.address_length(), 256)
+
+        auto_set.remove(V4CIDR(cidr='10.0.0.64/26'))
+
+        self.assertEqual(sorted(map(str, auto_set)), ['10.0.0.0/26', '10.0.0.128/25'])
+        self.assertRaises(KeyError, auto_set.remove, V4CIDR(cidr='10.0.0.64/27'))
+
+        auto_set.discard(V4CIDR(cidr='10.0.0.0/25'))
+        auto_set.update([V4CIDR(cidr='10.0.0.0/25')])
+
+        self.assertEqual(list(map(str, auto_set)), ['10.0.0.0/24'])
+
+        for index in range(1, 256, 2):
+            auto_set.add(V4CIDR(cidr='10.0.1.%d/32' % index))
+
+        self.assertEqual(len(auto_set), 129)
+        self.assertEqual(auto_set.address_length(), 384)
+        self.assertEqual(sorted(auto_set.network_set()), auto_set.collapsed_networks())
+
+        exclusive = CIDRSet(V4CIDR(cidr='10.0.0.0/25', inclusive=False), V4CIDR(cidr='10.0.0.128/25', inclusive=False))
+
+        self.assertEqual(sorted([(str(network), network.inclusive) for network in exclusive.collapse()]), [('10.0.0.0/25', False), ('10.0.0.128/25', False)])
+        self.assertEqual(exclusive.collapse().address_length(), 252)
+        self.assertEqual([str(network) for network in (exclusive | CIDRSet(V4CIDR(cidr='10.0.0.0/24', inclusive=False))).collapse()], ['10.0.0.0/24'])
+        self.assertEqual(CIDRSet(V4CIDR(cidr='10.0.0.0/24', inclusive=False)).collapse().address_length(), 254)
+        self.assertRaises(cidr.CIDRSetError, CIDRSet(V4CIDR(cidr='10.0.0.0/25', inclusive=False), V4CIDR(cidr='10.0.0.128/25')).collapse)
+    
+    def test_loader(self):
+        data = b'10.0.0.0/8\n# comment\n\n192.168.1.1\r\nnot an address\n7f00::/16\n10.0.0.0/33\n::1'
+
+        chunks = list(loader.iter_chunks(io.BytesIO(data), cidrs=True, chunk_lines=3, block_size=7))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(sum(map(len, chunks)), 4)
+
+        for result in (loader.load(data, cidrs=True), loader.load(io.BytesIO(data), cidrs=True)):
+            self.assertEqual(list(result.v4), [0x0a000000, 0xc0a80101])
+            self.assertEqual(list(result.v4_prefixes), [8, 32])
+            self.assertEqual(list(result.v6_high), [0x7f00 << 48, 0])
+            self.assertEqual(list(result.v6_low), [0, 1])
+            self.assertEqual(list(result.v6_prefixes), [16, 128])
+            self.assertEqual(result.errors, [(5, b'not an address'), (7, b'10.0.0.0/33')])
+    
+    def test_permutation(self):
+        for length in (1, 2, 7, 1000, 4097):
+            values = list(Permutation(length, seed=1))
+
+            self.assertEqual(sorted(values), list(range(length)))
+
+        addresses = V6CIDR(cidr='7f00::/32').permutation(seed=1337)
+        first = [next(addresses) for i in range(5)]
+        state = addresses.state()
+        rest = [next(addresses) for i in range(5)]
+        resumed = V6CIDR(cidr='7f00::/32').permutation().resume(state)
+
+        self.assertEqual(list(map(str, [next(resumed) for i in range(5)])), list(map(str, rest)))
+
+        resumed.seek(0)
+
+        self.assertEqual(str(next(resumed)), str(first[0]))
+        self.assertEqual(resumed.index(int(first[3]) - (0x7f00 << 112)), 3)
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/30'), V4CIDR(cidr='10.0.1.0/31'), addresses=True, random=True, seed=5)
+
+        self.assertEqual(sorted(map(int, cidr_set)), sorted(map(int, cidr_set.permutation())))
+        self.assertEqual(len(set(map(int, cidr_set.permutation()))), 6)
+    
+    def test_shard(self):
+        network = V4CIDR(cidr='10.0.0.0/30')
+
+        self.assertEqual([list(map(str, network.shard(2, index))) for index in range(2)]
+                         ,[['10.0.0.0', '10.0.0.1'], ['10.0.0.2', '10.0.0.3']])
+        self.assertRaises(cidr.CIDRError, network.shard, 2, 0, random=True)
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/20'), *[V4CIDR(cidr='10.1.%d.0/24' % index) for index in range(8)])
+
+        for random in (False, True):
+            shards = [cidr_set.shard(3, index, random=random, seed=9) for index in range(3)]
+            addresses = [int(address_obj) for shard in shards for address_obj in shard]
+
+            self.assertEqual([len(shard) for shard in shards], [2048, 2048, 2048])
+            self.assertEqual(len(set(addresses)), 6144)
+    
+    def test_weighted_random(self):
+        weights = cidr.FenwickTree([3, 0, 5, 1])
+
+        self.assertEqual([weights.find(value) for value in range(9)], [0, 0, 0, 2, 2, 2, 2, 2, 3])
+
+        weights.add(2, -5)
+
+        self.assertEqual(weights.total(), 4)
+        self.assertEqual(weights.find(3), 3)
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/16'), V4CIDR(cidr='10.1.0.0/30'), addresses=True, random=True, seed=1)
+        first = [next(iter(cidr_set)) for i in range(2)]
+        early = list(itertools.islice(cidr_set, 256))
+
+        self.assertEqual(first[0].value, first[1].value)
+        self.assertTrue(len([address_obj for address_obj in early if address_obj.value >= 0x0a010000]) < 4)
+        self.assertEqual(len(set(map(int, cidr_set))), 65540)
+        self.assertTrue(0x0a000000 <= cidr_set.random_address().value <= 0x0a010003)
+
+        subnet = cidr_set.random_subnet(24)
+
+        self.assertEqual(subnet.prefix, 24)
+        self.assertEqual(subnet.address.value & 0xFFFF00FF, 0x0a000000)
+
+        class Counted(CIDRSet):
+            sorts = 0
+
+            def sorted_networks(self):
+                Counted.sorts += 1
+                return super(Counted, self).sorted_networks()
+
+        counted = Counted(V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.2.0/25'))
+
+        for index in range(100):
+            self.assertTrue(counted.random_address().value >> 8 in (0x0a0000, 0x0a0002))
+            self.assertEqual(counted.random_subnet(26).prefix, 26)
+
+        self.assertEqual(Counted.sorts, 2)
+
+        counted.add(V4CIDR(cidr='10.0.4.0/26'))
+
+        self.assertTrue(any([counted.random_subnet(26).address.value == 0x0a000400 for index in range(200)]))
+        self.assertEqual(Counted.sorts, 3)
+
+    def test_iter_ints(self):
+        network = V4CIDR(cidr='10.0.0.0/30')
+
+        self.assertEqual(list(network.iter_ints()), [0x0a000000, 0x0a000001, 0x0a000002, 0x0a000003])
+        self.assertEqual([list(chunk) for chunk in network.iter_chunks(3)]
+                         ,[[0x0a000000, 0x0a000001, 0x0a000002], [0x0a000003]])
+        self.assertEqual(sorted(network.iter_ints(random=True)), list(network.iter_ints()))
+        self.assertEqual([int(value) for value in network.permutation(seed=2)]
+                         ,list(network.iter_ints(random=True, seed=2)))
+
+        v6_network = V6CIDR(cidr='::ffff:ffff:ffff:fffe/127')
+        high, low = next(v6_network.iter_chunks(2))
+
+        self.assertEqual(list(high), [0, 0])
+        self.assertEqual(list(low), [0xfffffffffffffffe, 0xffffffffffffffff])
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.2.0/23'))
+        values = [value for chunk in cidr_set.iter_chunks(100, random=True, seed=4) for value in chunk]
+
+        self.assertEqual(sorted(values), list(cidr_set.iter_ints()))
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_iter_chunks_numpy(self):
+        v6_network = V6CIDR(cidr='::ffff:ffff:ffff:fffe/126')
+        chunks = list(v6_network.iter_chunks(3, as_numpy=True))
+
+        self.assertEqual(chunks[1].tolist(), [[0, 0xffffffffffffffff]])
+        self.assertTrue(v6_network.contains_many(chunks[0]).all())
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.2.0/23'))
+
+        for random in (False, True):
+            values = numpy.concatenate(list(cidr_set.iter_chunks(100, random=random, seed=4, as_numpy=True)))
+
+            self.assertEqual(sorted(values.tolist()), list(cidr_set.iter_ints()))
+            self.assertEqual(values.tolist(), [value for chunk in cidr_set.iter_chunks(100, random=random, seed=4) for value in chunk])
+    
+    def test_table(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        set_path = os.path.join(directory, 'set.tbl')
+        map_path = os.path.join(directory, 'map.tbl')
+
+        CIDRSet(V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.1.0/24'), V6CIDR(cidr='2001:db8::/127')).save(set_path)
+
+        with CIDRTable.load(set_path) as compiled:
+            self.assertEqual(len(compiled), 2)
+            self.assertTrue(compiled.has_address('10.0.1.255'))
+            self.assertFalse(compiled.has_address('10.0.2.0'))
+            self.assertTrue(compiled.has_address('2001:db8::1'))
+            self.assertFalse(compiled.has_address('2001:db8::2'))
+
+        routes = CIDRMap(('10.0.0.0/8', 'core')
+                         ,('10.1.0.0/16', 'lab')
+                         ,('0:0:0:1::/64', {'site': 1})
+                         ,('::/32', 'core'))
+        routes.save(map_path)
+
+        with CIDRTable.load(map_path) as compiled:
+            self.assertEqual(compiled.value_count, 3)
+
+            for string in ('10.1.2.3', '10.2.3.4', '11.0.0.0', '::1:0:0:0:1', '::2:0:0:0:1', '1::'):
+                self.assertEqual(compiled.lookup(string, 'none'), routes.lookup(string, 'none'))
+
+            if numpy is not None:
+                addresses = numpy.array([0x0a010203, 0x0a020304, 0x0b000000], dtype=numpy.uint32)
+                self.assertEqual(compiled.lookup_many(addresses), ['lab', 'core', None])
+
+        # the copying fallback used where a memoryview can't be cast
+        table._CAST = False
+
+        try:
+            with CIDRTable.load(map_path) as compiled:
+                for string in ('10.1.2.3', '11.0.0.0', '::1:0:0:0:1', '1::'):
+                    self.assertEqual(compiled.lookup(string, 'none'), routes.lookup(string, 'none'))
+        finally:
+            table._CAST = True
+
+        with open(map_path, 'rb') as fp:
+            data = fp.read()
+
+        broken_path = os.path.join(directory, 'broken.tbl')
+
+        for broken in (b'', data[:20], data[:table.HEADER_SIZE + 8], b'X' * len(data)):
+            with open(broken_path, 'wb') as fp:
+                fp.write(broken)
+
+            self.assertRaises(table.TableError, CIDRTable.load, broken_path)
+
+        if sys.version_info >= (3, 7):
+            from martinellis import server
+
+            lookup_server = server.LookupServer(map_path, reload_interval=None)
+            os.rename(broken_path, map_path)
+
+            self.assertRaises(table.TableError, lookup_server.reload)
+            self.assertEqual(lookup_server.lookup('10.1.2.3'), 'lab')
+
+            lookup_server.source.close()
+
+    def test_IPRange(self):
+        v4_range = V4Range(range='10.0.0.1-10.0.0.6')
+        v4_cidrs = v4_range.to_cidrs()
+
+        self.assertEqual([str(network) for network in v4_cidrs], ['10.0.0.1/32', '10.0.0.2/31', '10.0.0.4/31', '10.0.0.6/32'])
+        self.assertEqual([int(address_obj) for address_obj in itertools.chain(*v4_cidrs)], list(v4_range.iter_ints()))
+        self.assertEqual(V4Range.from_cidrs(v4_cidrs), [v4_range])
+        self.assertEqual(len(v4_range), 6)
+        self.assertTrue(v4_range.has_address(V4Address(value='10.0.0.6')))
+        self.assertFalse(V4Address(value='10.0.0.7') in v4_range)
+        self.assertTrue(V4CIDR(cidr='10.0.0.2/31') in v4_range)
+        self.assertEqual(sorted(int(address_obj) for address_obj in V4Range(range='10.0.0.1-10.0.0.6', random=True)), list(v4_range.iter_ints()))
+
+        v6_range = V6Range(first='::1', last='ffff:ffff:ffff:ffff:ffff:ffff:ffff:fffe')
+        v6_cidrs = v6_range.to_cidrs()
+
+        self.assertEqual(len(v6_cidrs), 254)
+        self.assertEqual(V6Range.from_cidrs(v6_cidrs), [v6_range])
+        self.assertEqual(IPRange.blind_assertion('::1-::2'), V6Range(first=1, last=2))
+
+    def test_CIDR_bounds(self):
+        network = V4CIDR(cidr='10.0.0.77/24')
+
+        self.assertEqual(str(network), '10.0.0.0/24')
+        self.assertEqual((network.first, network.last, network.mask), (0x0a000000, 0x0a0000ff, 0xffffff00))
+        self.assertTrue(network.has_address(V4Address(value='10.0.0.1')))
+        self.assertTrue(network.has_address(V4Address(value='10.0.0.255')))
+        self.assertFalse(V4CIDR(cidr='10.0.0.0/24', inclusive=False).has_address(V4Address(value='10.0.0.255')))
+        self.assertTrue(V4CIDR(cidr='10.0.0.128/25').is_subset_of(network))
+        self.assertFalse(network.is_subset_of(V4CIDR(cidr='10.0.0.128/25')))
+        self.assertRaises(cidr.CIDRError, setattr, network, 'prefix', 16)
+        self.assertEqual(pickle.loads(pickle.dumps(network)).last, network.last)
+
+        base = V4Address(value='10.0.0.0')
+        network = V4CIDR(address=base, prefix=24)
+        base += 1024
+
+        self.assertEqual(str(network), '10.0.0.0/24')
+
+    def test_comparisons(self):
+        addresses = [V6Address(value='::1'), V4Address(value='10.0.0.2'), V4Address(value='10.0.0.1')]
+
+        self.assertEqual([str(address_obj) for address_obj in sorted(addresses)], ['10.0.0.1', '10.0.0.2', '::1'])
+        self.assertEqual(V4Address(value='10.0.0.1'), V4Address(value=0x0a000001))
+        self.assertNotEqual(V4Address(value='0.0.0.1'), V6Address(value='::1'))
+        self.assertEqual(len(set([V4Address(value='10.0.0.1'), V4Address(value='10.0.0.1')])), 1)
+        self.assertEqual(bisect.bisect_left(sorted(addresses), V4Address(value='10.0.0.2')), 1)
+
+        networks = [V4CIDR(cidr='10.0.0.0/24'), V4CIDR(cidr='10.0.0.0/8'), V6CIDR(cidr='::/0'), V4CIDR(cidr='9.0.0.0/8')]
+
+        self.assertEqual([str(network) for network in sorted(networks)], ['9.0.0.0/8', '10.0.0.0/8', '10.0.0.0/24', '::/0'])
+        self.assertEqual(V4CIDR(cidr='10.0.0.1/8'), V4CIDR(cidr='10.0.0.0/8'))
+        self.assertEqual(len(CIDRSet(V4CIDR(cidr='10.0.0.0/8'), V4CIDR(cidr='10.1.0.0/8'))), 1)
+        self.assertTrue(V4Address(value='10.0.0.1') < V4Address(value='10.0.0.2') <= V4Address(value='10.0.0.2'))
+        self.assertRaises(address.AddressError, lambda: V4Address(value='10.0.0.1') < 1)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'server requires Python 3.7')
+    def test_server(self):
+        import asyncio
+        from martinellis import server
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'routes.tbl')
+        CIDRMap(('10.0.0.0/8', 'core'), ('10.1.0.0/16', 'lab')).save(filename)
+
+        lookup_server = server.LookupServer(filename, reload_interval=None)
+        loop = asyncio.new_event_loop()
+        listener = loop.run_until_complete(lookup_server.start(host='127.0.0.1', port=0))
+        port = listener.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        try:
+            with server.LookupClient(host='127.0.0.1', port=port, timeout=10) as client:
+                self.assertEqual(client.lookup_many(['10.1.2.3', '10.2.3.4', '11.0.0.0']), ['lab', 'core', None])
+                self.assertRaises(server.ServerError, client.lookup, 'bogus')
+
+                CIDRMap(('10.0.0.0/8', 'edge')).save(filename + '.new')
+                os.rename(filename + '.new', filename)
+                self.assertTrue(lookup_server.reload())
+                self.assertEqual(client.lookup(V4Address(value='10.1.2.3')), 'edge')
+
+                previous, lookup_server.source = lookup_server.source, CIDRMap(('10.0.0.0/8', object()), ('11.0.0.0/8', 'core'))
+                previous.close()
+
+                self.assertRaises(server.ServerError, client.lookup, '10.0.0.1')
+                self.assertEqual(client.lookup('11.0.0.1'), 'core')
+
+                client.socket.sendall(b'1' * (lookup_server.MAX_LINE + 1))
+                self.assertEqual(client._file.readline(), b'!request line too long\n')
+        finally:
+            asyncio.run_coroutine_threadsafe(lookup_server.close(), loop).result(10)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'server requires Python 3.7')
+    def test_server_large_batch(self):
+        import asyncio
+        import socket
+        from martinellis import server
+
+        lookup_server = server.LookupServer(CIDRSet(V4CIDR(cidr='10.0.0.0/8')), reload_interval=None)
+        self.assertTrue(isinstance(lookup_server.source, table.CIDRTable))
+
+        loop = asyncio.new_event_loop()
+        listener = loop.run_until_complete(lookup_server.start(host='127.0.0.1', port=0))
+        port = listener.sockets[0].getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        # small socket buffers make a batch that's sent all at once deadlock
+        # long before it's done
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            listener.sockets[0].setsockopt(socket.SOL_SOCKET, option, 4096)
+
+        try:
+            with server.LookupClient(host='127.0.0.1', port=port, timeout=10) as client:
+                for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                    client.socket.setsockopt(socket.SOL_SOCKET, option, 4096)
+
+                results = client.lookup_many(['10.1.2.3', '11.0.0.1'] * 25000)
+
+                self.assertEqual(len(results), 50000)
+                self.assertEqual(results[-2:], [True, None])
+        finally:
+            asyncio.run_coroutine_threadsafe(lookup_server.close(), loop).result(10)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def test_classify(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        networks = os.path.join(directory, 'networks.txt')
+        log = os.path.join(directory, 'access.log')
+
+        with open(networks, 'w') as fp:
+            fp.write('# network label\n10.0.0.0/8 corp\n10.1.0.0/16 lab net\n2001:db8::/32 v6\n')
+
+        lines = [b'GET / from 10.1.2.3:443', b'no address here', b'12:00:01 [2001:db8::1]', b'', b'8.8.8.8 then 10.9.9.9'] * 5
+
+        with open(log, 'wb') as fp:
+            fp.write(b'\n'.join(lines))
+
+        expected = b''.join([label + b'\t' + line + b'\n' for label, line in zip([b'lab net', b'-', b'v6', b'-', b'corp'] * 5, lines)])
+
+        for processes, chunk_size in ((1, 7), (2, 7), (2, 1 << 20)):
+            output = io.BytesIO()
+
+            self.assertEqual(classify.classify(networks, [log], output, processes=processes, chunk_size=chunk_size), len(lines))
+            self.assertEqual(output.getvalue(), expected)
+
+        output = io.BytesIO()
+        classify.classify([('10.0.0.0/8', 10), ('10.1.0.0/16', {'site': 'lab'}), ('2001:db8::/32', [6])], [log], output, processes=2, chunk_size=7)
+
+        self.assertEqual(output.getvalue().split(b'\n')[:5], [b'{"site": "lab"}\t' + lines[0], b'-\t' + lines[1], b'[6]\t' + lines[2], b'-\t', b'10\t' + lines[4]])
+
+    def test_CIDRSet_diff(self):
+        old = CIDRSet(V4CIDR(cidr='10.0.0.0/16'), V4CIDR(cidr='192.168.0.0/24'), V6CIDR(cidr='2001:db8::/32'))
+        split = CIDRSet(V4CIDR(cidr='10.0.0.0/17'), V4CIDR(cidr='10.0.128.0/17'), V4CIDR(cidr='192.168.0.0/24'), V6CIDR(cidr='2001:db8::/32'))
+
+        self.assertEqual(old.diff(split), ([], []))
+
+        new = CIDRSet(V4CIDR(cidr='10.0.0.0/17'), V4CIDR(cidr='10.1.0.0/24'), V6CIDR(cidr='2001:db8::/31'))
+        added, removed = old.diff(new)
+
+        self.assertEqual([str(network) for network in added], ['10.1.0.0/24', '2001:db9::/32'])
+        self.assertEqual([str(network) for network in removed], ['10.0.128.0/17', '192.168.0.0/24'])
+
+        old.apply((added, removed))
+
+        self.assertEqual(old.sorted_networks(), new.sorted_networks())
+        self.assertEqual(cidr.combine_intervals([(0, 4), (5, 9)], [(3, 12)], lambda left, right: left != right), [(0, 2), (10, 12)])
+
+    def test_CIDRSet_algebra(self):
+        wide = CIDRSet(V4CIDR(cidr='10.0.0.0/8'), V6CIDR(cidr='2001:db8::/32'))
+        narrow = CIDRSet(V4CIDR(cidr='10.1.0.0/16'), V4CIDR(cidr='192.168.0.0/24'))
+        strings = lambda cidr_set: [str(network) for network in cidr_set.sorted_networks()]
+
+        self.assertEqual(strings(wide & narrow), ['10.1.0.0/16'])
+        self.assertEqual(strings(wide | narrow), ['10.0.0.0/8', '192.168.0.0/24', '2001:db8::/32'])
+        self.assertEqual(strings(wide - narrow), ['10.0.0.0/16', '10.2.0.0/15', '10.4.0.0/14', '10.8.0.0/13', '10.16.0.0/12', '10.32.0.0/11', '10.64.0.0/10', '10.128.0.0/9', '2001:db8::/32'])
+        self.assertEqual(strings(wide ^ narrow), strings((wide - narrow) | CIDRSet(V4CIDR(cidr='192.168.0.0/24'))))
+        self.assertEqual(strings(narrow.complement(V4CIDR(cidr='10.0.0.0/15'))), ['10.0.0.0/16'])
+        self.assertEqual(strings(CIDRSet(V4CIDR(cidr='0.0.0.0/1')).complement()), ['128.0.0.0/1'])
+        self.assertEqual(strings(wide.intersection(narrow, [V4CIDR(cidr='10.1.2.0/24')])), ['10.1.2.0/24'])
+
+        wide -= narrow
+        self.assertEqual(len(wide), 9)
+
+        exclusive = CIDRSet(V4CIDR(cidr='10.0.0.0/24', inclusive=False))
+        half = CIDRSet(V4CIDR(cidr='10.0.0.0/25', inclusive=False))
+
+        self.assertEqual(exclusive.address_length(), 254)
+        self.assertEqual((exclusive & exclusive).address_length(), 254)
+        self.assertEqual((exclusive | exclusive).address_length(), 254)
+        self.assertEqual((exclusive ^ half).address_length(), 126)
+        self.assertEqual((exclusive - half).address_length(), 126)
+        self.assertTrue(all(not network.inclusive for network in exclusive.complement().network_set()))
+        # the first and last addresses of 10.0.1.0/24 can't be held by a
+        # non-inclusive network, so they are dropped rather than widened over
+        self.assertEqual(exclusive.union(CIDRSet(V4CIDR(cidr='10.0.1.0/24'))).address_length(), 508)
+
+        pieces = CIDRSet(V4CIDR(cidr='10.0.0.0/24', inclusive=False), collapsed=True)
+        pieces.remove(V4CIDR(cidr='10.0.0.64/26', inclusive=False))
+
+        self.assertFalse(pieces.has_address(V4Address(value='10.0.0.64')))
+        self.assertFalse(pieces.has_address(V4Address(value='10.0.0.128')))
+        self.assertTrue(pieces.has_address(V4Address(value='10.0.0.129')))
+
+        exclusive &= half
+        self.assertEqual(exclusive.address_length(), 126)
+
+    def test_formatter(self):
+        buffer = bytearray()
+
+        self.assertEqual(formatter.write(buffer, CIDRSet(V4CIDR(cidr='10.0.0.0/31'), V6CIDR(cidr='2001:db8::/127'))), 4)
+        self.assertEqual(bytes(buffer), b'10.0.0.0\n10.0.0.1\n2001:db8::\n2001:db8::1\n')
+
+        output = io.BytesIO()
+        formatter.write(output, [0x0a000102], bitmax=32, style=formatter.PTR, separator=b' ')
+        formatter.write(output, V6CIDR(cidr='2001:db8::1/128'), style=formatter.EXPLODED)
+
+        self.assertEqual(output.getvalue(), b'2.1.0.10.in-addr.arpa 2001:0db8:0000:0000:0000:0000:0000:0001\n')
+        self.assertEqual(formatter.format_v6([1], formatter.PTR), [b'1.' + b'0.' * 31 + b'ip6.arpa'])
+        self.assertEqual(formatter.format_ints([0xffff01020304], 128), [str(V6Address(value=0xffff01020304)).encode('ascii')])
+        self.assertRaises(formatter.FormatterError, formatter.write, buffer, [1])
+
+    def test_AddressPool(self):
+        address_pool = AddressPool('10.0.0.0/24')
+
+        self.assertEqual(str(address_pool.allocate(26)), '10.0.0.0/26')
+        self.assertEqual(str(address_pool.allocate(25)), '10.0.0.128/25')
+        self.assertEqual(str(address_pool.allocate_at('10.0.0.100/30')), '10.0.0.100/30')
+        self.assertRaises(pool.PoolError, address_pool.allocate_at, '10.0.0.96/27')
+        self.assertRaises(pool.PoolError, address_pool.allocate, 26)
+        self.assertEqual([str(network) for network in address_pool.free_space()], ['10.0.0.64/27', '10.0.0.96/30', '10.0.0.104/29', '10.0.0.112/28'])
+        self.assertEqual(address_pool.free_count(), 60)
+
+        for network in address_pool.allocated():
+            address_pool.release(network)
+
+        self.assertEqual([str(network) for network in address_pool.free_space()], ['10.0.0.0/24'])
+        self.assertRaises(pool.PoolError, address_pool.release, '10.0.0.0/26')
+
+        v6_pool = AddressPool(V6CIDR(cidr='2001:db8::/32'))
+        self.assertEqual([str(v6_pool.allocate(64)) for index in range(3)], ['2001:db8::/64', '2001:db8:0:1::/64', '2001:db8:0:2::/64'])
+
+        churn_pool = AddressPool('10.0.0.0/22')
+        hosts = [churn_pool.allocate(32) for index in range(1024)]
+
+        for host in hosts[1::2] + hosts[::4]:
+            churn_pool.release(host)
+
+        self.assertEqual(str(churn_pool.allocate(32)), '10.0.0.3/32')
+        self.assertEqual(str(churn_pool.allocate(31)), '10.0.0.0/31')
+        self.assertEqual(churn_pool.free_count(), 1024 - 256 - 3)
+
+    def test_stats(self):
+        original = CIDR.__dict__['has_address']
+        networks = CIDRSet(V4CIDR(cidr='10.0.0.0/8'), V4CIDR(cidr='192.168.0.0/16'))
+        reports = list()
+
+        with stats.collect(callback=reports.append) as collected:
+            self.assertTrue(stats.enabled())
+            self.assertTrue(networks.has_address(V4Address(value='192.168.1.1')))
+            Address.blind_assertion('2001:db8::1')
+            self.assertRaises(address.AddressError, Address.blind_assertion, 'bogus')
+            self.assertEqual(len(list(V4CIDR(cidr='10.0.0.0/30', inclusive=True))), 4)
+
+        self.assertFalse(stats.enabled())
+        self.assertTrue(CIDR.__dict__['has_address'] is original)
+        self.assertEqual(reports, [collected.results])
+
+        results = collected.results
+        self.assertEqual(results['cidrset.has_address']['count'], 1)
+        self.assertEqual(results['cidrset.has_address.networks']['count'], results['cidr.has_address']['count'])
+        self.assertEqual(results['address.blind_assertion']['count'], 2)
+        self.assertEqual(results['address.blind_assertion.errors']['count'], 1)
+        self.assertEqual(results['address.from_string.v6']['count'], 1)
+        self.assertEqual(results['cidr.iter']['count'], 4)
+        self.assertTrue(results['cidr.construct']['count'] >= 1)
+
+        networks.has_address(V4Address(value='10.0.0.1'))
+        self.assertEqual(stats.snapshot()['cidrset.has_address']['count'], 1)
+
+        other = V4CIDR(cidr='10.0.0.0/8')
+
+        class Busy(V4CIDR):
+            # runs lookups on another thread in the middle of a set lookup
+            def has_address(self, address_obj):
+                thread = threading.Thread(target=lambda: [other.has_address(address_obj) for index in range(5)])
+                thread.start()
+                thread.join()
+
+                return super(Busy, self).has_address(address_obj)
+
+        with stats.collect() as collected:
+            CIDRSet(Busy(cidr='192.168.0.0/16')).has_address(V4Address(value='192.168.1.1'))
+
+        self.assertEqual(collected.results['cidr.has_address']['count'], 6)
+        self.assertEqual(collected.results['cidrset.has_address.networks']['count'], 1)
+
+    def test_exclude(self):
+        self.assertEqual(cidr.subtract_intervals([(0, 9), (20, 29)], [(3, 4), (8, 21), (40, 50)]), [(0, 2), (5, 7), (22, 29)])
+
+        network = V4CIDR(cidr='10.0.0.0/24', inclusive=True)
+        blocked = CIDRSet(*[V4CIDR(cidr='10.0.0.%d/30' % (index * 8)) for index in range(32)])
+        expected = [int(address_obj) for address_obj in network if not blocked.has_address(address_obj)]
+
+        self.assertEqual(list(network.iter_ints(exclude=blocked)), expected)
+        self.assertEqual(sorted(network.iter_ints(random=True, seed=4, exclude=blocked)), expected)
+        self.assertEqual(list(itertools.chain.from_iterable(network.iter_chunks(7, exclude=blocked))), expected)
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/25'), network, V6CIDR(cidr='::/126'), random=True, seed=2)
+        values = list(cidr_set.iter_ints(exclude=blocked))
+
+        self.assertEqual(sorted(values), [0, 1, 2, 3] + expected)
+        self.assertEqual(list(cidr_set.iter_ints(random=False, exclude=V6CIDR(cidr='::/127')))[-2:], [2, 3])
+        self.assertRaises(cidr.CIDRSetError, network.iter_ints, exclude='10.0.0.0/30')
+
+    def test_sample(self):
+        network = V4CIDR(cidr='10.0.0.0/30', inclusive=False)
+
+        self.assertEqual(str(network.get_address(2)), '10.0.0.2')
+        self.assertRaises(IndexError, network.get_address, 3)
+        self.assertEqual(str(V4CIDR(cidr='10.0.0.0/30', inclusive=True).get_address(3)), '10.0.0.3')
+        self.assertRaises(IndexError, V4CIDR(cidr='10.0.0.0/30', inclusive=True).get_address, 4)
+
+        for i in range(20):
+            self.assertTrue(network.has_address(network.random_address()))
+
+        self.assertEqual(sorted(map(str, network.sample(2, seed=1))), ['10.0.0.1', '10.0.0.2'])
+        self.assertRaises(ValueError, network.sample, 3)
+        self.assertEqual(set(network.random_ints(50, seed=1)), set([0x0a000001, 0x0a000002]))
+
+        large = V6CIDR(cidr='2001:db8::/32')
+        drawn = large.sample_ints(1000, seed=5)
+
+        self.assertEqual(len(set(drawn)), 1000)
+        self.assertEqual(drawn, large.sample_ints(1000, seed=5))
+        self.assertTrue(all(large.first <= value <= large.last for value in drawn))
+
+        high, low = large.random_ints(10, seed=3)
+        self.assertEqual(len(low), 10)
+        self.assertEqual(set([value >> 32 for value in high]), set([0x20010db8]))
+
+        cidr_set = CIDRSet(V4CIDR(cidr='10.0.0.0/31'), V4CIDR(cidr='10.0.0.0/30'), V6CIDR(cidr='::/127'), seed=3)
+
+        self.assertEqual(sorted(map(str, cidr_set.sample(6))), ['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3', '::', '::1'])
+        self.assertRaises(cidr.CIDRSetError, cidr_set.random_ints, 5)
+        self.assertEqual(set(CIDRSet(V4CIDR(cidr='10.0.0.0/31'), V4CIDR(cidr='10.0.0.4/31')).random_ints(100, seed=2))
+                         ,set([0x0a000000, 0x0a000001, 0x0a000004, 0x0a000005]))
+
+        if numpy is not None:
+            self.assertEqual(sorted(set(network.random_ints(50, seed=1, as_numpy=True).tolist())), [0x0a000001, 0x0a000002])
+
+    def test_TableHolder(self):
+        blocklist = CIDRSet(V4CIDR(cidr='10.0.0.0/8'))
+        snapshot = blocklist.compile()
+        blocklist.add(V6CIDR(cidr='2001:db8::/32'))
+
+        self.assertTrue(snapshot.has_address('10.1.2.3'))
+        self.assertFalse(snapshot.has_address('2001:db8::1'))
+        self.assertEqual(CIDRMap(('10.0.0.0/8', 'corp'), ('10.1.0.0/16', 'lab')).compile().lookup('10.1.2.3'), 'lab')
+
+        holder = table.TableHolder()
+        self.assertRaises(table.TableError, holder.has_address, '10.1.2.3')
+        self.assertTrue(holder.swap(snapshot) is None)
+        self.assertTrue(holder.has_address('10.1.2.3'))
+        self.assertTrue(holder.swap(blocklist) is snapshot)
+        self.assertTrue('2001:db8::1' in holder)
+        self.assertRaises(table.TableError, holder.swap, [])
+
+        versions = [CIDRMap(('10.0.0.0/8', index)) for index in range(3)]
+        reloaded = threading.Event()
+
+        def build():
+            if not versions:
+                reloaded.set()
+                raise ValueError('feed unavailable')
+
+            return versions.pop(0)
+
+        holder.start(build, interval=0.001)
+
+        try:
+            self.assertRaises(table.TableError, holder.start, build)
+            self.assertTrue(reloaded.wait(10))
+        finally:
+            holder.stop()
+
+        self.assertEqual(holder.lookup('10.1.2.3'), 2)
+        self.assertTrue(isinstance(holder.errors[0], ValueError))
+
+    def test_benchmark(self):
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.addCleanup(sys.path.pop, 0)
+
+        from benchmark import runner
+        from benchmark.__main__ import main
+
+        torn_down = list()
+        runner.BENCHMARKS.append(runner.Benchmark('test.noop'
+                                                  ,lambda size: (1, lambda: None, None, lambda: torn_down.append(size))
+                                                  ,(None,)
+                                                  ,(None,)))
+        self.addCleanup(runner.BENCHMARKS.pop)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'baseline.json')
+        stdout = sys.stdout
+
+        def compare(ns_per_op):
+            with open(filename, 'w') as fp:
+                fp.write('{"results": [{"name": "test.noop", "size": null, "martinellis": {"ns_per_op": %r}}]}' % ns_per_op)
+
+            sys.stdout = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+
+            try:
+                return main(['--quick', '--repeat', '1', '--filter', 'test.noop', '--baseline', filename]), sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+
+        status, output = compare(1e-9)
+
+        self.assertEqual(status, 1)
+        self.assertTrue('regression: test.noop[None]' in output)
+        self.assertEqual(compare(1e12)[0], 0)
+        self.assertEqual(torn_down, [None, None])
+
     def test_CIDR(self):
         pass
 